@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Times iterating over and indexing into KeyTables of increasing size.
+
+Time per entry should stay flat as the KeyTable grows. For comparison the
+previous implementation, which re-enumerated the entries on every step, is
+timed too; its time per entry grows with the size of the KeyTable.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from odkim_rotate.key_table import KeyTable
+
+SIZES = [1000, 2000, 4000, 8000]
+
+def write_key_table(path, size):
+    with open(path, 'w') as f:
+        for i in range(size):
+            f.write('name{0:06}  domain{0}.test:20170101:/etc/dkimkeys/name{0}.private\n'.format(i))
+
+def enumerate_iteration(keytable):
+    """Iterates the way KeyTable did before, finding every step's entry by
+    enumerating from the start.
+    """
+    for iter_index in range(len(keytable.entries)):
+        for index, key in enumerate(keytable.entries):
+            if index == iter_index:
+                break
+
+def iteration(keytable):
+    for short_name, values in keytable:
+        pass
+
+def indexing(keytable):
+    for index in range(len(keytable)):
+        keytable[index]
+
+def main():
+    path = tempfile.mkstemp()[1]
+
+    try:
+        print('{:>8} {:>16} {:>16} {:>16}'.format('entries', 'iterate us/entry',
+                                                  'index us/entry', 'before us/entry'))
+
+        for size in SIZES:
+            write_key_table(path, size)
+            keytable = KeyTable(path)
+
+            times = [min(timeit.repeat(lambda: func(keytable), number=1, repeat=3))
+                     for func in [iteration, indexing, enumerate_iteration]]
+
+            print('{:>8} {:>16.3f} {:>16.3f} {:>16.3f}'.format(
+                size, *[t / size * 1e6 for t in times]))
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    main()
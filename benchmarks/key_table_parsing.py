@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+"""Times loading and saving KeyTables of increasing size, with comments.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from odkim_rotate.key_table import KeyTable
+
+SIZES = [10000, 100000, 200000]
+
+def write_key_table(path, size):
+    with open(path, 'w') as f:
+        for i in range(size):
+            if i % 100 == 0:
+                f.write('# Customer block {}\n\n'.format(i // 100))
+
+            f.write('name{0:06}  domain{0}.test:20170101:/etc/dkimkeys/name{0}.private\n'.format(i))
+
+def main():
+    path = tempfile.mkstemp()[1]
+
+    try:
+        print('{:>8} {:>10} {:>10}'.format('entries', 'load s', 'save s'))
+
+        for size in SIZES:
+            write_key_table(path, size)
+
+            load = min(timeit.repeat(lambda: KeyTable(path), number=1, repeat=3))
+
+            keytable = KeyTable(path)
+            keytable.update_selector(keytable.short_names[0], '20170201')
+            save = min(timeit.repeat(keytable.save_changes, number=1, repeat=3))
+
+            # Saving keeps a backup of the file as it was read next to it.
+            keytable.discard_backup()
+
+            print('{:>8} {:>10.3f} {:>10.3f}'.format(size, load, save))
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    main()
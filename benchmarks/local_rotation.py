@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Times a whole rotation of KeyTables of increasing size, offline.
+
+Records are published with the local DNS provider, and propagation and the
+keys are checked against the provider's records instead of real DNS. Keys
+are Ed25519 keys generated in-process, so the time is dominated by the
+rotation itself rather than key generation. Requires the cryptography
+package.
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from odkim_rotate import utils
+from odkim_rotate.dns.local_provider import LocalDnsProvider
+from odkim_rotate.keygen.python_generator import PythonKeyGenerator
+from odkim_rotate.key_table import KeyTable
+from odkim_rotate.manager import Manager
+from odkim_rotate.verify.dns_verifier import DnsKeyVerifier, parse_dkim_record
+from odkim_rotate.verify.verifier import KeyVerificationError
+
+SIZES = [1000, 10000]
+
+class LocalPropagationChecker:
+    """Treats every record the local provider holds as propagated.
+    """
+
+    resolvers = ['local']
+
+    def __init__(self, dns_provider):
+        self.dns_provider = dns_provider
+
+    def wait(self, records, progress=None, propagated=None):
+        return self.wait_stream(iter(records), progress, propagated)
+
+    def wait_stream(self, records, progress=None, propagated=None, stop=None):
+        stragglers = []
+
+        for record in records:
+            if record.value in [r.value for r in
+                                self.dns_provider.list_txt_records(record.domain)]:
+                if propagated is not None:
+                    propagated(record, 0.0)
+            else:
+                stragglers.append(record)
+
+        return stragglers
+
+class LocalKeyVerifier(DnsKeyVerifier):
+    """Compares keys with the public keys held by the local provider.
+    """
+
+    def __init__(self, dns_provider):
+        DnsKeyVerifier.__init__(self, [])
+        self.dns_provider = dns_provider
+
+    def verify(self, domain, selector, private_key_path):
+        with open(private_key_path, 'rb') as f:
+            expected = self.encoded_public_key(f.read())
+
+        keys = [parse_dkim_record(record.value).get('p')
+                for record in self.dns_provider.list_txt_records(domain)
+                if record.selector == selector]
+
+        if expected not in keys:
+            raise KeyVerificationError('Public key for {} does not match'.format(domain))
+
+def rotate(work_dir, size):
+    key_dir = os.path.join(work_dir, 'keys')
+    os.mkdir(key_dir)
+
+    keytable_path = os.path.join(work_dir, 'key.table')
+
+    with open(keytable_path, 'w') as f:
+        for i in range(size):
+            f.write('name{0:06}  domain{0}.test:20170101:{1}/name{0}.private\n'.format(
+                i, key_dir))
+
+    manager = Manager(False, os.cpu_count() or 1, 32, 32)
+    manager.opendkim_conf = os.path.join(work_dir, 'opendkim.conf')
+    manager.opendkim_keys_basedir = key_dir
+    manager.install_mode = Manager.RELOAD
+    manager.key_generator = PythonKeyGenerator('ed25519')
+    manager.dns_provider = LocalDnsProvider(32, os.path.join(work_dir, 'zones'))
+    manager.propagation_checker = LocalPropagationChecker(manager.dns_provider)
+    manager.key_verifier = LocalKeyVerifier(manager.dns_provider)
+    manager.key_owner_uid = os.getuid()
+    manager.key_group_gid = os.getgid()
+    manager.keytable_path = keytable_path
+    manager.keytable = KeyTable(keytable_path)
+
+    start = time.time()
+    manager.rotate_keys()
+    return time.time() - start
+
+def main():
+    # Nothing to reload.
+    utils.reload_opendkim = lambda: None
+
+    results = []
+    stdout = sys.stdout
+
+    for size in SIZES:
+        work_dir = tempfile.mkdtemp()
+        sys.stdout = open(os.devnull, 'w')
+
+        try:
+            results.append((size, rotate(work_dir, size)))
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            shutil.rmtree(work_dir)
+
+    print('{:>8} {:>10} {:>16}'.format('entries', 'rotate s', 'us/entry'))
+
+    for size, seconds in results:
+        print('{:>8} {:>10.2f} {:>16.1f}'.format(size, seconds, seconds / size * 1e6))
+
+if __name__ == '__main__':
+    main()
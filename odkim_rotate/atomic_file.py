@@ -0,0 +1,41 @@
+import os
+import tempfile
+
+def fsync_directory(path):
+    """Flushes a directory to disk so that renames into it are durable.
+    """
+    fd = os.open(path, os.O_RDONLY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_atomically(path, data, mode=0o600, uid=None, gid=None):
+    """Replaces the file at path with data, as bytes.
+
+    data is written and flushed to disk under a temporary name in the same
+    directory, which is then renamed over path. Readers see either the old
+    or the new file, never part of one, even if the system crashes. The
+    temporary file is removed if anything fails.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.chmod(temp_path, mode)
+
+        if uid is not None and (uid, gid) != (os.getuid(), os.getgid()):
+            os.chown(temp_path, uid, gid)
+
+        os.rename(temp_path, path)
+    except Exception:
+        os.unlink(temp_path)
+        raise
+
+    fsync_directory(directory)
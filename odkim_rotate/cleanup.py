@@ -0,0 +1,84 @@
+import datetime
+
+from odkim_rotate.concurrency import map_concurrently
+from odkim_rotate.selection import issued_selector_date, selector_date
+
+class SelectorCleaner:
+    """Deletes the DKIM TXT records of selectors that are no longer in use.
+
+    A selector is retired when a newer one goes live in its place. Its
+    record is kept for grace_days after that so that mail signed with the
+    old key just before the rotation can still be verified, and is deleted
+    once the grace period has passed. Only selectors this script generates
+    are ever deleted, never those of other senders even if they look dated.
+    Selectors newer than the one in use, e.g. those of an unfinished
+    rotation, are never deleted either.
+    """
+
+    def __init__(self, dns_provider, grace_days=7, jobs=8, batch_size=None):
+        self.dns_provider = dns_provider
+        self.grace_days = grace_days
+        self.jobs = jobs
+        self.batch_size = batch_size
+
+    def stale_records(self, live_selectors, now=None):
+        """Returns the TxtRecords that are past their grace period.
+
+        live_selectors maps domains to the selectors in use for them. Every
+        domain's records are listed from the DNS provider, several domains at
+        once. Returns (records, errors), where errors is a list of
+        (domain, error) tuples for domains whose records couldn't be listed.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+
+        cutoff = now - datetime.timedelta(days=self.grace_days)
+        results = map_concurrently(self.dns_provider.list_txt_records,
+                                   list(live_selectors), self.jobs)
+        stale = []
+        errors = []
+
+        for domain, records, error in results:
+            if error is not None:
+                errors.append((domain, error))
+                continue
+
+            stale.extend(self.retired(records, live_selectors[domain], cutoff))
+
+        return stale, errors
+
+    def retired(self, records, live, cutoff):
+        """Returns the records of one domain that were retired before cutoff.
+        """
+        live_dates = [date for date in map(selector_date, live) if date is not None]
+
+        if not live_dates:
+            return []
+
+        newest_live = max(live_dates)
+
+        # Dates every selector up to the one in use went live on.
+        dates = sorted(set([date for date in map(issued_selector_date,
+                                                 [record.selector for record in records])
+                            if date is not None and date <= newest_live] + live_dates))
+        retired = []
+
+        for record in records:
+            date = issued_selector_date(record.selector)
+
+            if record.selector in live or date is None or date >= newest_live:
+                continue
+
+            # The selector was retired when the next one went live.
+            successor = min(d for d in dates if d > date)
+
+            if successor <= cutoff:
+                retired.append(record)
+
+        return retired
+
+    def delete(self, records, progress=None):
+        """Deletes records in batches, returning a RecordResult for each.
+        """
+        return self.dns_provider.delete_txt_records(records, self.jobs, self.batch_size,
+                                                    progress)
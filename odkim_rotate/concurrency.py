@@ -0,0 +1,18 @@
+from concurrent.futures import ThreadPoolExecutor
+
+def map_concurrently(func, items, jobs):
+    """Calls func on every item using a pool of at most jobs threads.
+
+    Returns a list of (item, result, error) tuples in the same order as
+    items. Exceptions raised by func are captured in error instead of being
+    raised so that one failure doesn't abandon the remaining work.
+    """
+
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as e:
+            return item, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        return list(executor.map(call, items))
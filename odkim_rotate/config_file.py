@@ -0,0 +1,65 @@
+import argparse
+
+try:
+    from configparser import ConfigParser, Error as ConfigError
+except ImportError:
+    from ConfigParser import SafeConfigParser as ConfigParser, Error as ConfigError
+
+# Section of the config file holding the options.
+SECTION = 'rotate'
+
+def read_config_file(path, parser):
+    """Returns defaults for parser's options from the config file at path.
+
+    The file is in INI format. Its [rotate] section takes the long names of
+    the command line options, without the leading dashes, e.g.
+    "dns-jobs = 16". Flags take yes or no, and options that may be repeated
+    take a whitespace separated list.
+
+    Raises ValueError if the file can't be read or has unknown options or
+    invalid values.
+    """
+    config = ConfigParser()
+
+    try:
+        if not config.read(path):
+            raise ValueError('Could not read config file {}'.format(path))
+    except ConfigError as e:
+        raise ValueError('Malformed config file {}: {}'.format(path, e))
+
+    if not config.has_section(SECTION):
+        return {}
+
+    actions = {}
+
+    for action in parser._actions:
+        for option in action.option_strings:
+            if option.startswith('--'):
+                actions[option[2:]] = action
+
+    defaults = {}
+
+    for name, value in config.items(SECTION):
+        action = actions.get(name.replace('_', '-'))
+
+        if action is None or action.dest in ['help', 'config']:
+            raise ValueError('Unknown option "{}" in config file {}'.format(name, path))
+
+        try:
+            if action.nargs == 0:
+                value = config.getboolean(SECTION, name)
+            elif isinstance(action, argparse._AppendAction):
+                value = [action.type(v) if action.type else v for v in value.split()]
+            elif action.type is not None:
+                value = action.type(value)
+        except ValueError:
+            raise ValueError('Invalid value "{}" for "{}" in config file {}'.format(
+                value, name, path))
+
+        if action.choices is not None and value not in action.choices:
+            raise ValueError('Invalid value "{}" for "{}" in config file {}, choose from {}'
+                             .format(value, name, path, ', '.join(action.choices)))
+
+        defaults[action.dest] = value
+
+    return defaults
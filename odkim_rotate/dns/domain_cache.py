@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+from odkim_rotate.atomic_file import *
+
+class DomainCache:
+    """Saves domain names and their provider IDs to a JSON file.
+
+    Lets later runs skip enumerating every domain on the account. The file is
+    ignored once it is older than ttl seconds.
+    """
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+
+    def load(self):
+        """Returns the cached domains, or None if there are none to use.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if not isinstance(cache, dict) or 'domains' not in cache:
+            return None
+
+        if time.time() - cache.get('created', 0) > self.ttl:
+            return None
+
+        return cache['domains']
+
+    def save(self, domains):
+        """Replaces the cached domains.
+
+        The file is replaced atomically so that a concurrent run never reads
+        half a file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+
+        data = json.dumps({'created': time.time(), 'domains': domains})
+        write_atomically(self.path, data.encode('utf-8'))
+
+    def invalidate(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -1,7 +1,27 @@
 import os
+import random
 import requests
+import threading
+import time
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from odkim_rotate.dns.domain_cache import *
 from odkim_rotate.dns.provider import *
+from odkim_rotate.dns.request_stats import *
+from odkim_rotate.metrics import counters, Counters
+
+class LinodeApiError(RuntimeError):
+    """Errors returned in the ERRORARRAY of a Linode API response.
+    """
+
+    def __init__(self, errors):
+        messages = ['{} (code {})'.format(error['ERRORMESSAGE'], error['ERRORCODE'])
+                    for error in errors]
+
+        RuntimeError.__init__(self, 'Errors from Linode: {}'.format(', '.join(messages)))
+        self.codes = [error['ERRORCODE'] for error in errors]
 
 class LinodeDnsProvider(DnsProvider):
     """DNS provider for Linode.
@@ -9,9 +29,20 @@ class LinodeDnsProvider(DnsProvider):
     Linode requires a domain ID when adding any DNS records. Rather than
     enumerating all domains on every request to create a TXT record in order
     to find the ID of the domain in use, all domains for the Linode account
-    are cached in memory so that subsequent requests are faster. This opens
-    the possibility of errors if the domain on Linode is deleted after its
-    information has been cached.
+    are cached in memory so that subsequent requests are faster. The domains
+    can also be kept in a DomainCache so that later runs don't have to
+    enumerate them again.
+
+    A cached ID may be out of date if the domain was deleted or added on
+    Linode after it was cached. Looking up a domain that isn't cached, or
+    Linode reporting that a cached domain ID doesn't exist, refreshes the
+    cache from Linode once per run.
+
+    Requests rejected by Linode because of rate limiting are retried with an
+    exponential backoff. All requests go through a single session that keeps
+    up to pool_size connections alive, so that only the first requests pay
+    for the TCP and TLS handshakes. Counters for the requests made are kept
+    in stats.
 
     Full documentation on Linode API:
     https://www.linode.com/api/
@@ -21,64 +52,252 @@ class LinodeDnsProvider(DnsProvider):
     api_url = 'https://api.linode.com/'
     domains = {}
 
-    def __init__(self):
+    # Error codes for requests Linode rejected without acting on them, which
+    # are safe to send again: "Batch approaching timeout" and "API rate limit
+    # exceeded".
+    RETRY_ERROR_CODES = [12, 14]
+
+    # Error code for "Object not found".
+    NOT_FOUND_ERROR_CODE = 5
+
+    # HTTP status codes that are retried. Only rate limiting is certain to
+    # have been rejected without Linode acting on it. A gateway error may
+    # come after Linode carried the request out, so it's only retried for
+    # actions that are safe to repeat.
+    RATE_LIMITED_STATUS_CODE = 429
+    RETRY_STATUS_CODES = [RATE_LIMITED_STATUS_CODE, 502, 503, 504]
+
+    # Actions that would be carried out twice if repeated, e.g. creating a
+    # duplicate record.
+    UNSAFE_ACTIONS = ['domain.resource.create']
+
+    # Number of times a request is retried and the delay, in seconds, before
+    # the first retry. The delay doubles with every retry.
+    max_retries = 5
+    retry_delay = 1.0
+
+    # Seconds to wait for a connection to be established and for a response
+    # to be received.
+    connect_timeout = 10
+    read_timeout = 60
+
+    # Number of times connecting to Linode is retried. Only failures to
+    # connect are retried by the connection pool since by then nothing has
+    # been sent.
+    connect_retries = 3
+
+    def __init__(self, pool_size=DnsProvider.concurrency, domain_cache=None):
         if 'LINODE_API_KEY' not in os.environ:
             raise KeyError('LINODE_API_KEY environment variable not set')
 
         self.api_key = os.environ.get('LINODE_API_KEY')
         self.domains = {}
+        self.domains_lock = threading.Lock()
+        self.domain_cache = domain_cache
 
-    def create_txt_record(self, domain, selector, value):
-        if not self.domains:
-            self.enumerate_domains()
+        # Whether domains were enumerated from Linode during this run, rather
+        # than loaded from domain_cache.
+        self.domains_current = False
+        self.concurrency = pool_size
+        self.stats = RequestStats()
 
-        if domain not in self.domains:
-            raise KeyError('Domain {} not found in Linode'.format(domain))
+        retries = Retry(total=self.connect_retries, connect=self.connect_retries,
+                        read=0, status=0, backoff_factor=self.retry_delay)
 
-        data = {
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                   max_retries=retries)
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'OpenDKIMRotateKeys/1.0.0'
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def create_txt_record(self, domain, selector, value):
+        zone = self.get_zone(domain)[0]
+
+        self.send_domain_request(domain, {
             'api_action': 'domain.resource.create',
-            'DomainID': self.domains[domain],
             'Type': 'TXT',
-            'Name': selector + '._domainkey',
+            'Name': record_name(domain, selector, zone),
             'Target': value
-        }
+        })
+
+    def list_txt_records(self, domain):
+        zone = self.get_zone(domain)[0]
+        r = self.send_domain_request(domain, {
+            'api_action': 'domain.resource.list'
+        })
+
+        # Records of a subdomain are named "<selector>._domainkey.<subdomain>"
+        # in its parent's zone.
+        suffix = record_name(domain, '', zone)
+
+        return [TxtRecord(domain, resource['NAME'][:-len(suffix)], resource['TARGET'],
+                          resource['RESOURCEID'])
+                for resource in r['DATA']
+                if resource['TYPE'].upper() == 'TXT' and
+                resource['NAME'].lower().endswith(suffix) and len(resource['NAME']) > len(suffix)]
+
+    def delete_txt_record(self, record):
+        try:
+            self.send_domain_request(record.domain, {
+                'api_action': 'domain.resource.delete',
+                'ResourceID': record.record_id
+            })
+        except LinodeApiError as e:
+            # The record, or its whole domain, is already gone.
+            if self.NOT_FOUND_ERROR_CODE not in e.codes:
+                raise
+
+    def send_domain_request(self, domain, data):
+        """Sends a request about one of domain's resources, with the ID of
+        the zone domain is hosted in.
+
+        If Linode reports the ID as not found, the cached domains are dropped
+        and enumerated again, and the request is sent once more with the
+        domain's new ID.
+        """
+        domain_id = self.get_domain_id(domain)
+
+        try:
+            return self.send_request(dict(data, DomainID=domain_id))
+        except LinodeApiError as e:
+            if self.NOT_FOUND_ERROR_CODE not in e.codes or \
+                    not self.refresh_domains(domain_id):
+                raise
+
+        return self.send_request(dict(data, DomainID=self.get_domain_id(domain)))
+
+    def get_domain_id(self, domain):
+        return self.get_zone(domain)[1]
+
+    def get_zone(self, domain):
+        """Returns the name and ID of the zone domain is hosted in, which is
+        either domain itself or one of its parent domains.
+        """
+        with self.domains_lock:
+            if not self.domains:
+                self.load_domains()
 
-        r = self.send_request(data)
+            zone = find_zone(domain, self.domains)
+
+            if zone is None and not self.domains_current:
+                self.enumerate_domains()
+                zone = find_zone(domain, self.domains)
+
+            if zone is None:
+                raise KeyError('Domain {} not found in Linode'.format(domain))
+
+            return zone, self.domains[zone]
+
+    def hosted_zones(self, refresh=False):
+        with self.domains_lock:
+            if refresh and not self.domains_current:
+                self.enumerate_domains()
+            elif not self.domains:
+                self.load_domains()
+
+            return set(zone.lower() for zone in self.domains)
+
+    def load_domains(self):
+        """Fills the domain cache from domain_cache, or Linode if that's empty.
+        """
+        if self.domain_cache is not None:
+            domains = self.domain_cache.load()
+
+            if domains:
+                self.domains = domains
+                return
+
+        self.enumerate_domains()
+
+    def refresh_domains(self, stale_domain_id):
+        """Enumerates domains again after Linode reported stale_domain_id as
+        not found.
+
+        Returns False if the domains were already enumerated during this run,
+        in which case the error wasn't caused by an out of date cache.
+        """
+        with self.domains_lock:
+            if self.domains_current and stale_domain_id in self.domains.values():
+                return False
+
+            if not self.domains_current:
+                # Don't leave the stale ID for later runs should enumerating
+                # fail.
+                if self.domain_cache is not None:
+                    self.domain_cache.invalidate()
+
+                self.enumerate_domains()
+
+            return True
 
     def enumerate_domains(self):
         """Cache all domains available along with their domain ID.
         """
 
-        data = {
-            'api_action': 'domain.list'
-        }
-
         r = self.send_request({'api_action': 'domain.list'})
 
+        self.domains = {}
+
         for domain in r['DATA']:
-            self.domains[domain['DOMAIN']] = domain['DOMAINID']
+            self.domains[domain['DOMAIN'].lower()] = domain['DOMAINID']
+
+        self.domains_current = True
 
         if len(self.domains) == 0:
             raise RuntimeError('No domains found on Linode')
 
-    def send_request(self, data):
-        headers = {
-            'User-Agent': 'OpenDKIMRotateKeys/1.0.0'
-        }
+        if self.domain_cache is not None:
+            self.domain_cache.save(self.domains)
 
+    def send_request(self, data):
         data['api_key'] = self.api_key
+        attempt = 0
 
-        r = requests.post(self.api_url, data=data, headers=headers).json()
+        while True:
+            try:
+                return self.parse_response(self.post(data))
+            except LinodeApiError as e:
+                if not set(e.codes) & set(self.RETRY_ERROR_CODES) or \
+                        attempt == self.max_retries:
+                    raise
+            except requests.HTTPError as e:
+                status_code = e.response.status_code
 
-        if len(r['ERRORARRAY']) > 0:
-            messages = []
+                if status_code not in self.RETRY_STATUS_CODES or \
+                        (status_code != self.RATE_LIMITED_STATUS_CODE and
+                         data['api_action'] in self.UNSAFE_ACTIONS) or \
+                        attempt == self.max_retries:
+                    raise
 
-            for error in r['ERRORARRAY']:
-                msg = '{} (code {})'.format(error['ERRORMESSAGE'],
-                                            error['ERRORCODE'])
-                messages.append(msg)
+            # Jitter keeps concurrent requests that were rejected together
+            # from being retried together.
+            time.sleep(self.retry_delay * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt = attempt + 1
 
-            raise RuntimeError('Errors from Linode: {}'.format(', '.join(messages)))
+    def post(self, data):
+        counters.increment(Counters.API_REQUESTS)
+        start = time.time()
+        response = self.session.post(self.api_url, data=data,
+                                     timeout=(self.connect_timeout, self.read_timeout))
+        latency = time.time() - start
 
-        return r
+        self.stats.record(len(response.request.body or ''), len(response.content),
+                          latency, self.count_connections())
 
+        return response
+
+    def count_connections(self):
+        """Returns the number of connections opened by the connection pool.
+        """
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def parse_response(self, response):
+        response.raise_for_status()
+        r = response.json()
+
+        if len(r['ERRORARRAY']) > 0:
+            raise LinodeApiError(r['ERRORARRAY'])
+
+        return r
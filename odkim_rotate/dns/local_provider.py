@@ -0,0 +1,174 @@
+import os
+import re
+import threading
+import time
+
+from odkim_rotate.atomic_file import *
+from odkim_rotate.dns.provider import *
+from odkim_rotate.metrics import counters, Counters
+
+class LocalDnsProvider(DnsProvider):
+    """DNS provider that keeps records in memory and, optionally, zone files.
+
+    Needs no account or network access, which makes it suitable for tests
+    and for load testing a rotation of many domains. With zone_dir set, the
+    DKIM records of every domain are written to "<zone_dir>/<domain>.zone"
+    in master file format, ready to be included by a local nameserver, and
+    read back from there by later runs. Zone files are written once per
+    batch of records rather than once per record; records created one at a
+    time are written by flush.
+
+    When domains is given only those domains and their subdomains are
+    hosted, and records for any other domain fail as they would with a real
+    provider. latency adds a delay, in seconds, to every request to stand in
+    for a provider's API.
+    """
+
+    # TTL of the records written to zone files.
+    ttl = 300
+
+    # Longest character-string a TXT record can hold.
+    MAX_STRING_LENGTH = 255
+
+    RECORD_PATTERN = re.compile(r'^(\S+)\._domainkey\s+(?:\d+\s+)?IN\s+TXT\s+\(?(.*?)\)?\s*$')
+
+    def __init__(self, pool_size=DnsProvider.concurrency, zone_dir=None, domains=None,
+                 latency=0.0):
+        self.concurrency = pool_size
+        self.zone_dir = zone_dir
+        self.domains = set(domain.lower() for domain in domains) \
+            if domains is not None else None
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+
+        # Domain to its list of TxtRecords.
+        self.zones = {}
+        self.next_id = 1
+
+        # Domains whose zone files are out of date.
+        self.dirty = set()
+
+        if zone_dir is not None:
+            self.load_zones()
+
+    def check_domain(self, domain):
+        counters.increment(Counters.API_REQUESTS)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self.domains is not None and find_zone(domain, self.domains) is None:
+            raise KeyError('Domain {} not found'.format(domain))
+
+    def hosted_zones(self, refresh=False):
+        if self.domains is None:
+            return None
+
+        return set(self.domains)
+
+    def create_txt_record(self, domain, selector, value):
+        self.check_domain(domain)
+
+        with self.lock:
+            self.zones.setdefault(domain, []).append(
+                TxtRecord(domain, selector, value, self.next_id))
+            self.next_id = self.next_id + 1
+            self.dirty.add(domain)
+
+    def list_txt_records(self, domain):
+        self.check_domain(domain)
+
+        with self.lock:
+            return list(self.zones.get(domain, []))
+
+    def delete_txt_record(self, record):
+        self.check_domain(record.domain)
+
+        with self.lock:
+            records = self.zones.get(record.domain, [])
+            self.zones[record.domain] = [r for r in records
+                                         if r.record_id != record.record_id]
+            self.dirty.add(record.domain)
+
+    def create_txt_records(self, records, concurrency=None):
+        try:
+            return DnsProvider.create_txt_records(self, records, concurrency)
+        finally:
+            self.flush()
+
+    def flush(self):
+        self.save_zones()
+
+    def delete_txt_records(self, records, concurrency=None, batch_size=None,
+                           progress=None):
+        def save_batch(batch):
+            self.save_zones()
+
+            if progress is not None:
+                progress(batch)
+
+        return DnsProvider.delete_txt_records(self, records, concurrency, batch_size,
+                                              save_batch)
+
+    def zone_path(self, domain):
+        return os.path.join(self.zone_dir, domain + '.zone')
+
+    def load_zones(self):
+        """Reads the records of every zone file in zone_dir.
+        """
+        if not os.path.isdir(self.zone_dir):
+            return
+
+        for name in sorted(os.listdir(self.zone_dir)):
+            if not name.endswith('.zone'):
+                continue
+
+            domain = name[:-len('.zone')]
+
+            with open(os.path.join(self.zone_dir, name), 'r') as f:
+                for line in f:
+                    match = self.RECORD_PATTERN.match(line.strip())
+
+                    if match is None:
+                        continue
+
+                    value = ''.join(re.sub(r'\\(.)', r'\1', string) for string in
+                                    re.findall(r'"((?:[^"\\]|\\.)*)"', match.group(2)))
+                    self.zones.setdefault(domain, []).append(
+                        TxtRecord(domain, match.group(1), value, self.next_id))
+                    self.next_id = self.next_id + 1
+
+    def escape(self, string):
+        return string.replace('\\', '\\\\').replace('"', '\\"')
+
+    def render_zone(self, domain, records):
+        lines = ['$ORIGIN {}.'.format(domain)]
+
+        for record in records:
+            strings = ['"{}"'.format(self.escape(record.value[i:i + self.MAX_STRING_LENGTH]))
+                       for i in range(0, len(record.value), self.MAX_STRING_LENGTH)] or ['""']
+            lines.append('{}._domainkey {} IN TXT ( {} )'.format(
+                record.selector, self.ttl, ' '.join(strings)))
+
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def save_zones(self):
+        """Writes the zone files of domains changed since the last save.
+        """
+        if self.zone_dir is None:
+            return
+
+        # Saves are serialized so that an older copy of a zone is never
+        # written over a newer one.
+        with self.save_lock:
+            with self.lock:
+                dirty = [(domain, list(self.zones.get(domain, []))) for domain in self.dirty]
+                self.dirty = set()
+
+            if dirty and not os.path.isdir(self.zone_dir):
+                os.makedirs(self.zone_dir)
+
+            for domain, records in dirty:
+                write_atomically(self.zone_path(domain), self.render_zone(domain, records),
+                                 0o644)
@@ -1,9 +1,146 @@
-import os
+import time
+
+from odkim_rotate.concurrency import map_concurrently
+
+def find_zone(domain, zones):
+    """Returns the zone domain belongs to, i.e. domain itself or the closest
+    of its parent domains in zones, or None if there's none.
+
+    zones holds lower case domain names.
+    """
+    labels = domain.lower().rstrip('.').split('.')
+
+    for i in range(len(labels)):
+        zone = '.'.join(labels[i:])
+
+        if zone in zones:
+            return zone
+
+    return None
+
+def record_name(domain, selector, zone):
+    """Returns the name of domain's DKIM record for selector, relative to
+    the zone domain belongs to.
+    """
+    name = selector + '._domainkey'
+    subdomain = domain.lower().rstrip('.')[:-len(zone)].rstrip('.')
+
+    if subdomain:
+        return name + '.' + subdomain
+
+    return name
+
+class TxtRecord:
+    """DKIM TXT record to publish for a domain's selector.
+    """
+
+    def __init__(self, domain, selector, value, record_id=None):
+        self.domain = domain
+        self.selector = selector
+        self.value = value
+
+        # Provider's ID for a record that exists, as returned by
+        # list_txt_records.
+        self.record_id = record_id
+
+class RecordResult:
+    """Outcome of publishing or deleting a single TxtRecord.
+    """
+
+    def __init__(self, record, error=None, seconds=None):
+        self.record = record
+        self.error = error
+
+        # How long the request for the record took.
+        self.seconds = seconds
+
+    @property
+    def succeeded(self):
+        return self.error is None
 
 class DnsProvider:
     """DNS provider.
     """
 
+    # Number of requests create_txt_records keeps in flight at once when the
+    # caller doesn't say otherwise.
+    concurrency = 8
+
+    # Number of records delete_txt_records deletes before moving on to the
+    # next batch.
+    delete_batch_size = 100
+
     def create_txt_record(self, domain, selector, value):
         raise NotImplementedError()
 
+    def list_txt_records(self, domain):
+        """Returns a TxtRecord for every DKIM TXT record of domain, i.e. those
+        named "<selector>._domainkey".
+        """
+        raise NotImplementedError()
+
+    def delete_txt_record(self, record):
+        """Deletes a TxtRecord returned by list_txt_records.
+        """
+        raise NotImplementedError()
+
+    def hosted_zones(self, refresh=False):
+        """Returns the lower case names of the zones the provider hosts, or
+        None if it can't tell. With refresh, names the provider cached are
+        fetched again.
+        """
+        return None
+
+    def flush(self):
+        """Saves records created with create_txt_record one at a time, for
+        providers that hold changes back to save them in bulk.
+        """
+        pass
+
+    def create_txt_records(self, records, concurrency=None):
+        """Creates many TXT records with several requests in flight at once.
+
+        Returns a RecordResult for every TxtRecord, in the same order as
+        records. A failure to create one record doesn't stop the others from
+        being created.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+
+        def create(record):
+            start = time.time()
+            self.create_txt_record(record.domain, record.selector, record.value)
+            return time.time() - start
+
+        results = map_concurrently(create, list(records), concurrency)
+
+        return [RecordResult(record, error, seconds) for record, seconds, error in results]
+
+    def delete_txt_records(self, records, concurrency=None, batch_size=None,
+                           progress=None):
+        """Deletes many TXT records, batch_size at a time with up to
+        concurrency requests in flight at once.
+
+        progress, if given, is called with the results of every batch once
+        it's done. Returns a RecordResult for every TxtRecord, in the same
+        order as records.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+        if batch_size is None:
+            batch_size = self.delete_batch_size
+
+        records = list(records)
+        results = []
+
+        for start in range(0, len(records), batch_size):
+            batch = map_concurrently(self.delete_txt_record,
+                                     records[start:start + batch_size], concurrency)
+            batch = [RecordResult(record, error) for record, result, error in batch]
+
+            if progress is not None:
+                progress(batch)
+
+            results.extend(batch)
+
+        return results
@@ -0,0 +1,67 @@
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    entry_points = None
+
+# Entry point group other packages can add DNS providers to. Each entry point
+# names a factory called as factory(concurrency, domain_cache, **options)
+# that returns a DnsProvider.
+ENTRY_POINT_GROUP = 'odkim_rotate.dns_providers'
+
+dns_providers = {}
+entry_points_loaded = False
+
+def register_dns_provider(name, factory):
+    """Makes a DNS provider available to create_dns_provider under name.
+    """
+    dns_providers[name] = factory
+
+def load_entry_points():
+    """Registers the DNS providers installed packages advertise.
+
+    Providers registered in code take precedence over entry points of the
+    same name. Entry points are only imported once the provider is used, so
+    that a broken plugin doesn't affect the others.
+    """
+    global entry_points_loaded
+
+    if entry_points_loaded:
+        return
+
+    entry_points_loaded = True
+
+    if entry_points is not None:
+        try:
+            group = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            group = entry_points().get(ENTRY_POINT_GROUP, [])
+    else:
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+
+        group = pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+    for entry_point in group:
+        if entry_point.name not in dns_providers:
+            dns_providers[entry_point.name] = entry_point
+
+def dns_provider_names():
+    load_entry_points()
+    return sorted(dns_providers)
+
+def get_dns_provider_factory(name):
+    load_entry_points()
+
+    if name not in dns_providers:
+        msg = "Unknown DNS provider '{}' specified".format(name)
+        raise NameError(msg)
+
+    factory = dns_providers[name]
+
+    if not callable(factory):
+        factory = factory.load()
+        dns_providers[name] = factory
+
+    return factory
@@ -0,0 +1,66 @@
+import threading
+
+class RequestStats:
+    """Counters describing the HTTP requests made to a DNS provider's API.
+
+    Safe to update from several threads at once.
+    """
+
+    # Upper bounds, in seconds, of the request latency histogram buckets.
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf')]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_latency = 0.0
+
+        # Number of requests that took at most the matching LATENCY_BUCKETS
+        # value, and more than the one before it.
+        self.latency_histogram = [0] * len(self.LATENCY_BUCKETS)
+
+    @property
+    def connections_reused(self):
+        """Number of requests sent over an already open connection.
+        """
+        return max(0, self.requests - self.connections_opened)
+
+    def record(self, bytes_sent, bytes_received, latency, connections_opened):
+        """Adds a completed request.
+
+        connections_opened is the total number of connections opened so far,
+        as counted by the connection pool.
+        """
+        with self.lock:
+            self.requests = self.requests + 1
+            self.bytes_sent = self.bytes_sent + bytes_sent
+            self.bytes_received = self.bytes_received + bytes_received
+            self.total_latency = self.total_latency + latency
+            self.connections_opened = connections_opened
+
+            for index, bound in enumerate(self.LATENCY_BUCKETS):
+                if latency <= bound:
+                    self.latency_histogram[index] = self.latency_histogram[index] + 1
+                    break
+
+    def describe(self):
+        """Returns a list of human readable lines summarising the counters.
+        """
+        lines = [
+            'Requests sent: {:,}'.format(self.requests),
+            'Connections opened: {:,}, reused: {:,}'.format(self.connections_opened,
+                                                            self.connections_reused),
+            'Bytes sent: {:,}, received: {:,}'.format(self.bytes_sent,
+                                                      self.bytes_received)
+        ]
+
+        if self.requests:
+            lines.append('Average latency: {:.3f}s'.format(self.total_latency / self.requests))
+
+        for bound, count in zip(self.LATENCY_BUCKETS, self.latency_histogram):
+            if count:
+                lines.append('  <= {}s: {:,}'.format(bound, count))
+
+        return lines
@@ -0,0 +1,187 @@
+import random
+import socket
+import struct
+
+# Record type and class numbers from RFC 1035.
+TYPE_TXT = 16
+CLASS_IN = 1
+
+# Response codes.
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+# Header flag bits.
+FLAG_RD = 0x0100
+FLAG_TC = 0x0200
+
+class DnsQueryError(RuntimeError):
+    """Raised when a nameserver can't be queried or answers with an error.
+    """
+    pass
+
+def read_resolv_conf(path='/etc/resolv.conf'):
+    """Returns the nameservers listed in resolv.conf.
+    """
+    nameservers = []
+
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+
+            if len(parts) >= 2 and parts[0] == 'nameserver':
+                nameservers.append(parts[1])
+
+    return nameservers
+
+def parse_nameserver(nameserver, default_port=53):
+    """Splits "host", "host:port" or "[ipv6]:port" into a (host, port) tuple.
+    """
+    if nameserver.startswith('['):
+        host, _, port = nameserver[1:].partition(']')
+        port = port.lstrip(':')
+    elif nameserver.count(':') == 1:
+        host, _, port = nameserver.partition(':')
+    else:
+        host, port = nameserver, ''
+
+    return host, int(port) if port else default_port
+
+def build_query(query_id, name, record_type=TYPE_TXT):
+    header = struct.pack('!HHHHHH', query_id, FLAG_RD, 1, 0, 0, 0)
+    question = b''
+
+    for label in name.rstrip('.').split('.'):
+        encoded = label.encode('idna') if label else b''
+        question += struct.pack('!B', len(encoded)) + encoded
+
+    return header + question + struct.pack('!BHH', 0, record_type, CLASS_IN)
+
+def skip_name(message, offset):
+    """Returns the offset just past the (possibly compressed) name at offset.
+    """
+    while True:
+        length = struct.unpack_from('!B', message, offset)[0]
+
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        elif length == 0:
+            return offset + 1
+
+        offset = offset + length + 1
+
+def parse_txt_response(message, query_id):
+    """Returns the TXT records in a response, each as a single string.
+
+    Multiple character-strings in a record are joined together, the same
+    way DKIM verifiers treat them. Raises DnsQueryError for error responses.
+    """
+    try:
+        response_id, flags, qdcount, ancount, nscount, arcount = \
+            struct.unpack_from('!HHHHHH', message)
+    except struct.error:
+        raise DnsQueryError('Truncated DNS response')
+
+    if response_id != query_id:
+        raise DnsQueryError('DNS response ID does not match query')
+
+    rcode = flags & 0x000F
+
+    if rcode == RCODE_NXDOMAIN:
+        return []
+    elif rcode != RCODE_NOERROR:
+        raise DnsQueryError('DNS query failed with response code {}'.format(rcode))
+
+    records = []
+
+    try:
+        offset = 12
+
+        for i in range(qdcount):
+            offset = skip_name(message, offset) + 4
+
+        for i in range(ancount):
+            offset = skip_name(message, offset)
+            record_type, record_class, ttl, rdlength = \
+                struct.unpack_from('!HHIH', message, offset)
+            offset = offset + 10
+
+            if record_type == TYPE_TXT:
+                rdata = message[offset:offset + rdlength]
+                strings = []
+                position = 0
+
+                while position < len(rdata):
+                    length = struct.unpack_from('!B', rdata, position)[0]
+                    strings.append(rdata[position + 1:position + 1 + length])
+                    position = position + length + 1
+
+                records.append(b''.join(strings).decode('utf-8', 'replace'))
+
+            offset = offset + rdlength
+    except struct.error:
+        raise DnsQueryError('Malformed DNS response')
+
+    return records
+
+def query_txt(name, nameserver, timeout=2.0):
+    """Queries nameserver for the TXT records of name.
+
+    Returns a list of record values, which is empty if the name doesn't
+    exist. Queries are made over UDP and repeated over TCP when the answer
+    is truncated.
+    """
+    host, port = parse_nameserver(nameserver)
+    family, socktype, proto, canonname, address = \
+        socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+
+    query_id = random.randint(0, 0xFFFF)
+    query = build_query(query_id, name)
+
+    try:
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+
+        try:
+            sock.settimeout(timeout)
+            sock.sendto(query, address)
+
+            while True:
+                message, sender = sock.recvfrom(65535)
+
+                # Ignore stray datagrams from anywhere but the nameserver.
+                if sender[:2] == address[:2]:
+                    break
+        finally:
+            sock.close()
+
+        if len(message) >= 4 and struct.unpack_from('!H', message, 2)[0] & FLAG_TC:
+            message = query_tcp(query, family, address, timeout)
+    except socket.error as e:
+        raise DnsQueryError('Unable to query {}: {}'.format(nameserver, e))
+
+    return parse_txt_response(message, query_id)
+
+def query_tcp(query, family, address, timeout):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+
+    try:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(struct.pack('!H', len(query)) + query)
+
+        length = struct.unpack('!H', receive_exactly(sock, 2))[0]
+        return receive_exactly(sock, length)
+    finally:
+        sock.close()
+
+def receive_exactly(sock, length):
+    data = b''
+
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+
+        if not chunk:
+            raise socket.error('Connection closed by nameserver')
+
+        data += chunk
+
+    return data
@@ -0,0 +1,147 @@
+import math
+
+from collections import OrderedDict
+
+from odkim_rotate.keygen.opendkim_generator import OpenDkimKeyGenerator
+from odkim_rotate.keygen.pool import PooledKeyGenerator
+from odkim_rotate.verify.opendkim_verifier import OpenDkimKeyVerifier
+
+class RotationEstimate:
+    """Estimates the work a rotation will do and how long it will take,
+    without doing any of it.
+
+    Each domain is assumed to take as long in each phase as it did on
+    average in an earlier run's metrics report, when one is given, and the
+    DEFAULT_SECONDS otherwise. Domains are spread over the concurrency each
+    phase runs with. Keys that can be taken from a key pool cost nothing.
+    """
+
+    # Seconds a single domain takes in each phase when there's no earlier run
+    # to go by.
+    DEFAULT_SECONDS = {
+        'generate': 0.15,
+        'publish': 0.5,
+        'verify': 0.1,
+        'install': 0.01,
+        'cleanup': 0.5
+    }
+
+    # Seconds DNS records take to propagate when there's no earlier run to go
+    # by. Linode typically takes about 15 minutes.
+    DEFAULT_PROPAGATION_SECONDS = 900
+
+    def __init__(self, manager, domains, history=None, keys=None, records=None):
+        self.manager = manager
+        self.domains = domains
+        self.history = history or {}
+
+        # Number of keys to generate and of DNS records to publish, which are
+        # fewer than domains when entries share keys.
+        self.keys = domains if keys is None else keys
+        self.records = domains if records is None else records
+
+    def seconds_per_domain(self, phase):
+        timings = [phases[phase] for phases in self.history.get('domains', {}).values()
+                   if phase in phases]
+
+        if timings:
+            return sum(timings) / len(timings)
+
+        return self.DEFAULT_SECONDS[phase]
+
+    def propagation_seconds(self):
+        phase = self.history.get('phases', {}).get('propagate')
+
+        if phase is not None:
+            return phase['seconds']
+
+        return self.DEFAULT_PROPAGATION_SECONDS
+
+    def keys_to_generate(self):
+        """Returns the number of keys that can't be taken from a key pool.
+        """
+        generator = self.manager.key_generator
+
+        if isinstance(generator, PooledKeyGenerator):
+            return max(0, self.keys - generator.pool.size())
+
+        return self.keys
+
+    def phases(self):
+        """Returns the estimated seconds of each phase, in order.
+        """
+        manager = self.manager
+
+        def spread(phase, concurrency, domains=self.domains):
+            return math.ceil(domains / float(max(1, concurrency))) * \
+                self.seconds_per_domain(phase)
+
+        phases = OrderedDict([
+            ('generate', spread('generate', manager.jobs, self.keys_to_generate())),
+            ('publish', spread('publish', manager.dns_jobs, self.records)),
+            ('propagate', self.propagation_seconds() if self.domains else 0),
+            ('verify', spread('verify', manager.verify_jobs)),
+            ('install', spread('install', 1))
+        ])
+
+        if manager.selector_cleaner is not None:
+            phases['cleanup'] = spread('cleanup', manager.selector_cleaner.jobs)
+
+        return phases
+
+    def total_seconds(self):
+        """Returns the estimated seconds of the whole rotation.
+
+        Keys are published as they're generated, so together the two take
+        about as long as the slower of them.
+        """
+        phases = self.phases()
+        return sum(phases.values()) - min(phases['generate'], phases['publish'])
+
+    def operations(self):
+        """Returns the number of subprocesses and API requests the rotation
+        is expected to cost.
+        """
+        manager = self.manager
+        subprocesses = 0
+
+        generator = manager.key_generator
+
+        if isinstance(generator, PooledKeyGenerator):
+            generator = generator.generator
+        if isinstance(generator, OpenDkimKeyGenerator):
+            subprocesses += self.keys_to_generate()
+        if isinstance(manager.key_verifier, OpenDkimKeyVerifier):
+            subprocesses += self.domains
+
+        if manager.fleet is not None:
+            subprocesses += len(manager.fleet.nodes)
+        elif manager.install_mode == manager.RELOAD:
+            subprocesses += 1
+        else:
+            subprocesses += 4
+
+        # One request per record, plus listing the records of every domain
+        # when cleaning up. Deletes can't be known in advance.
+        api_requests = self.records
+
+        if manager.selector_cleaner is not None:
+            api_requests += self.domains
+
+        return OrderedDict([('subprocesses', subprocesses), ('api_requests', api_requests)])
+
+    def describe(self):
+        """Returns lines describing the estimate.
+        """
+        phases = self.phases()
+        lines = ['Estimated time per phase:']
+
+        for name, seconds in phases.items():
+            lines.append('  {:<10} {:>10.0f}s'.format(name, seconds))
+
+        lines.append('  {:<10} {:>10.0f}s'.format('total', self.total_seconds()))
+
+        for name, count in self.operations().items():
+            lines.append('Estimated {}: {:,}'.format(name.replace('_', ' '), count))
+
+        return lines
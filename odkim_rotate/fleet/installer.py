@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+
+from odkim_rotate.concurrency import *
+from odkim_rotate.key_table import *
+
+class FleetNode:
+    """An OpenDKIM node that keys are installed on.
+
+    keytable_path is the KeyTable file on the node and key_directory the
+    directory new keys are installed under, in a directory named after the
+    selector.
+    """
+
+    def __init__(self, name, transport, keytable_path, key_directory,
+                 reload_command=None):
+        self.name = name
+        self.transport = transport
+        self.keytable_path = keytable_path
+        self.key_directory = key_directory
+        self.reload_command = reload_command or ['systemctl', 'reload', 'opendkim']
+
+class NodeResult:
+    """Outcome of installing keys on a single node.
+    """
+
+    def __init__(self, node):
+        self.node = node
+
+        # Last phase the node reached, one of the FleetInstaller phases.
+        self.phase = None
+        self.error = None
+
+        # Error that kept the node from being rolled back, if any.
+        self.rollback_error = None
+
+        # KeyTable before and after the new keys, as bytes.
+        self.original_keytable = None
+        self.new_keytable = None
+
+        # Paths on the node of the keys written to it.
+        self.installed_keys = []
+
+    @property
+    def succeeded(self):
+        return self.error is None and self.phase == FleetInstaller.VERIFIED
+
+class FleetInstaller:
+    """Installs the same keys on many OpenDKIM nodes at once.
+
+    Installing happens in stages across the whole fleet. Every node first
+    has its keys written next to the ones in use and its new KeyTable
+    rendered, which changes nothing OpenDKIM sees. Only once every node is
+    staged is each node's KeyTable replaced and OpenDKIM reloaded, after
+    which the KeyTable and keys are read back to verify them. If any node
+    fails, every node is rolled back to its original KeyTable.
+    """
+
+    STAGED = 'staged'
+    ACTIVATED = 'activated'
+    VERIFIED = 'verified'
+    ROLLED_BACK = 'rolled back'
+
+    def __init__(self, nodes, jobs=8, owner=None, group=None):
+        self.nodes = nodes
+        self.jobs = jobs
+        self.owner = owner
+        self.group = group
+
+    def install(self, selector, keys):
+        """Installs keys, an ordered mapping of KeyTable short names to
+        private keys as bytes, on every node.
+
+        Returns a NodeResult for every node, in the same order as the nodes.
+        """
+        results = [NodeResult(node) for node in self.nodes]
+
+        if self.run_phase(lambda result: self.stage(result, selector, keys), results) and \
+                self.run_phase(lambda result: self.activate(result, keys), results):
+            return results
+
+        map_concurrently(self.roll_back, results, self.jobs)
+        return results
+
+    def run_phase(self, func, results):
+        """Calls func on every node's result concurrently.
+
+        Returns True if it succeeded on every node.
+        """
+        failed = False
+
+        for result, value, error in map_concurrently(func, results, self.jobs):
+            if error is not None:
+                result.error = result.error or error
+                failed = True
+
+        return not failed
+
+    def stage(self, result, selector, keys):
+        node = result.node
+        result.original_keytable = node.transport.read_file(node.keytable_path)
+
+        key_dir = os.path.join(node.key_directory, selector)
+        key_paths = dict((short_name, os.path.join(key_dir, short_name + '.private'))
+                         for short_name in keys)
+        result.new_keytable = self.render_keytable(result.original_keytable, selector,
+                                                   key_paths)
+
+        node.transport.make_directory(key_dir, 0o750, self.owner, self.group)
+
+        for short_name, private_key in keys.items():
+            result.installed_keys.append(key_paths[short_name])
+            node.transport.write_file(key_paths[short_name], private_key, 0o600,
+                                      self.owner, self.group)
+
+        result.phase = self.STAGED
+
+    def render_keytable(self, original, selector, key_paths):
+        """Returns the KeyTable original with the entries in key_paths
+        pointed at the new selector and keys.
+
+        Entries the node's KeyTable doesn't have are ignored.
+        """
+        work_dir = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(work_dir, 'key.table')
+
+            with open(path, 'wb') as f:
+                f.write(original)
+
+            keytable = KeyTable(path)
+
+            for short_name, key_path in key_paths.items():
+                if short_name in keytable.entries:
+                    keytable.update_selector(short_name, selector)
+                    keytable.update_private_key(short_name, key_path)
+
+            keytable.save_changes()
+
+            with open(path, 'rb') as f:
+                return f.read()
+        finally:
+            shutil.rmtree(work_dir)
+
+    def activate(self, result, keys):
+        node = result.node
+        node.transport.write_file(node.keytable_path, result.new_keytable)
+        result.phase = self.ACTIVATED
+
+        node.transport.run(node.reload_command)
+        self.verify(result, keys)
+        result.phase = self.VERIFIED
+
+    def verify(self, result, keys):
+        transport = result.node.transport
+
+        if transport.read_file(result.node.keytable_path) != result.new_keytable:
+            raise RuntimeError('KeyTable differs from the one installed')
+
+        for key_path, private_key in zip(result.installed_keys, keys.values()):
+            if transport.read_file(key_path) != private_key:
+                raise RuntimeError('Key {} differs from the one installed'.format(key_path))
+
+    def roll_back(self, result):
+        node = result.node
+
+        try:
+            if result.phase in [self.ACTIVATED, self.VERIFIED]:
+                node.transport.write_file(node.keytable_path, result.original_keytable)
+                node.transport.run(node.reload_command)
+
+            for key_path in result.installed_keys:
+                node.transport.remove(key_path)
+        except Exception as e:
+            result.rollback_error = e
+            return
+
+        if result.phase is not None:
+            result.phase = self.ROLLED_BACK
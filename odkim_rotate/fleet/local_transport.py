@@ -0,0 +1,76 @@
+import grp
+import os
+import pwd
+import subprocess
+
+from odkim_rotate.atomic_file import *
+from odkim_rotate.fleet.transport import *
+from odkim_rotate.metrics import counters, Counters
+
+class LocalDirectoryTransport(Transport):
+    """Treats a local directory as the root filesystem of a node.
+
+    With a root of "/" this is the local host. Any other root lets a
+    directory stand in for a remote node, e.g. in tests. Commands are run
+    locally from the root directory.
+    """
+
+    def __init__(self, root='/'):
+        self.root = root
+
+    def local_path(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def ids(self, owner, group):
+        uid = pwd.getpwnam(owner).pw_uid if owner is not None else None
+        gid = grp.getgrnam(group).gr_gid if group is not None else None
+
+        if uid is None and gid is None:
+            return None, None
+
+        return (uid if uid is not None else -1), (gid if gid is not None else -1)
+
+    def read_file(self, path):
+        with open(self.local_path(path), 'rb') as f:
+            return f.read()
+
+    def write_file(self, path, data, mode=None, owner=None, group=None):
+        local_path = self.local_path(path)
+        uid, gid = self.ids(owner, group)
+
+        if mode is None:
+            try:
+                stat = os.stat(local_path)
+                mode = stat.st_mode & 0o7777
+
+                if uid is None:
+                    uid, gid = stat.st_uid, stat.st_gid
+            except OSError:
+                mode = 0o600
+
+        write_atomically(local_path, data, mode, uid, gid)
+
+    def make_directory(self, path, mode=0o750, owner=None, group=None):
+        local_path = self.local_path(path)
+
+        if os.path.isdir(local_path):
+            return
+
+        os.mkdir(local_path, mode)
+        uid, gid = self.ids(owner, group)
+
+        if uid is not None:
+            os.chown(local_path, uid, gid)
+
+    def remove(self, path):
+        try:
+            os.unlink(self.local_path(path))
+        except OSError:
+            pass
+
+    def run(self, args):
+        counters.increment(Counters.SUBPROCESSES)
+        return subprocess.check_output(args, stderr=subprocess.STDOUT, cwd=self.root)
+
+    def describe(self):
+        return 'local:' + self.root
@@ -0,0 +1,91 @@
+import os
+import subprocess
+
+from odkim_rotate.fleet.transport import *
+from odkim_rotate.metrics import counters, Counters
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+class SshTransport(Transport):
+    """Reaches a node by running shell commands over ssh.
+
+    Relies on ssh being able to log in without a password, e.g. with an
+    agent or a key in ~/.ssh, and on GNU coreutils on the node.
+    """
+
+    def __init__(self, host, user=None, port=None, ssh='/usr/bin/ssh'):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.ssh = ssh
+
+    def command(self, script):
+        options = [self.ssh, '-o', 'BatchMode=yes']
+
+        if self.port is not None:
+            options.extend(['-p', str(self.port)])
+        if self.user is not None:
+            options.extend(['-l', self.user])
+
+        options.extend([self.host, script])
+        return options
+
+    def run_script(self, script, data=None):
+        counters.increment(Counters.SUBPROCESSES)
+        process = subprocess.Popen(self.command(script), stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate(data)[0]
+
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, script, output)
+
+        return output
+
+    def ownership(self, owner, group):
+        if owner is None and group is None:
+            return ''
+        return '{}:{}'.format(owner or '', group or '')
+
+    def read_file(self, path):
+        return self.run_script('cat ' + quote(path))
+
+    def write_file(self, path, data, mode=None, owner=None, group=None):
+        target = quote(path)
+        script = ['tmp=$(mktemp {}/.odkim-XXXXXX) || exit 1'.format(
+                      quote(os.path.dirname(path))),
+                  'trap \'rm -f "$tmp"\' EXIT',
+                  'cat > "$tmp" && sync "$tmp" || exit 1']
+
+        if mode is None:
+            script.append('if [ -e {0} ]; then chmod --reference={0} "$tmp" && '
+                          'chown --reference={0} "$tmp" || exit 1; fi'.format(target))
+        else:
+            script.append('chmod {:o} "$tmp" || exit 1'.format(mode))
+
+        if self.ownership(owner, group):
+            script.append('chown {} "$tmp" || exit 1'.format(quote(self.ownership(owner, group))))
+
+        script.append('mv -f "$tmp" {}'.format(target))
+        self.run_script('\n'.join(script), data)
+
+    def make_directory(self, path, mode=0o750, owner=None, group=None):
+        target = quote(path)
+        script = '[ -d {0} ] || {{ mkdir -m {1:o} {0}'.format(target, mode)
+
+        if self.ownership(owner, group):
+            script += ' && chown {} {}'.format(quote(self.ownership(owner, group)), target)
+
+        self.run_script(script + '; }')
+
+    def remove(self, path):
+        self.run_script('rm -f ' + quote(path))
+
+    def run(self, args):
+        return self.run_script(' '.join(quote(arg) for arg in args))
+
+    def describe(self):
+        host = self.host if self.user is None else '{}@{}'.format(self.user, self.host)
+        return 'ssh://' + (host if self.port is None else '{}:{}'.format(host, self.port))
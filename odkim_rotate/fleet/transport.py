@@ -0,0 +1,40 @@
+class Transport:
+    """Reads and writes files and runs commands on an OpenDKIM node.
+
+    Paths are absolute paths on the node. Methods must be safe to call from
+    several threads at once, as nodes are updated concurrently.
+    """
+
+    def read_file(self, path):
+        """Returns the contents of the file at path as bytes.
+        """
+        raise NotImplementedError()
+
+    def write_file(self, path, data, mode=None, owner=None, group=None):
+        """Atomically replaces the file at path with data, as bytes.
+
+        When mode is None an existing file's mode and ownership are kept, and
+        a new file is created with mode 0600. owner and group are user and
+        group names on the node.
+        """
+        raise NotImplementedError()
+
+    def make_directory(self, path, mode=0o750, owner=None, group=None):
+        """Creates the directory at path unless it already exists.
+        """
+        raise NotImplementedError()
+
+    def remove(self, path):
+        """Removes the file at path, if there is one.
+        """
+        raise NotImplementedError()
+
+    def run(self, args):
+        """Runs the command args on the node and returns its output.
+
+        Raises subprocess.CalledProcessError if the command fails.
+        """
+        raise NotImplementedError()
+
+    def describe(self):
+        raise NotImplementedError()
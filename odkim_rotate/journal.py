@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+import threading
+
+class Journal:
+    """Durable record of how far a rotation got for each KeyTable entry.
+
+    The journal lives in a state directory along with the keys generated for
+    the rotation, so that a rotation interrupted by a failure can be resumed
+    by a later run with the same selector, redoing only the unfinished work.
+
+    The journal file is a header line naming the selector and entries being
+    rotated, followed by one JSON line for every phase an entry completes or
+    for every entry dropped from the rotation.
+    Every write is flushed to disk before returning. A partially written
+    last line, left by a crash, is ignored.
+    """
+
+    GENERATED = 'generated'
+    PUBLISHED = 'published'
+    PROPAGATED = 'propagated'
+    VERIFIED = 'verified'
+    INSTALLED = 'installed'
+
+    PHASES = [GENERATED, PUBLISHED, PROPAGATED, VERIFIED, INSTALLED]
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, 'journal')
+
+        # Keys generated for the rotation are kept here rather than in a
+        # temporary directory so that they survive until it's finished.
+        self.scratch_dir = os.path.join(state_dir, 'keys')
+
+        self.selector = None
+        self.short_names = []
+
+        # Phases completed, keyed by short name.
+        self.phases = {}
+
+        # TXT record values of generated keys, keyed by short name.
+        self.txt_values = {}
+
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Reads the journal of an unfinished rotation.
+
+        Returns False if there is no unfinished rotation to resume.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                lines = f.read().splitlines()
+        except IOError:
+            return False
+
+        dropped = set()
+
+        for index, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                if index == len(lines) - 1:
+                    break
+                raise RuntimeError('Journal {} is corrupt at line {}'.format(
+                    self.path, index + 1))
+
+            if index == 0:
+                self.selector = entry['selector']
+                self.short_names = entry['short_names']
+                continue
+
+            short_name = entry['short_name']
+
+            if entry.get('dropped'):
+                dropped.add(short_name)
+                continue
+
+            self.phases.setdefault(short_name, set()).add(entry['phase'])
+
+            if 'txt_value' in entry:
+                self.txt_values[short_name] = entry['txt_value']
+
+        self.short_names = [short_name for short_name in self.short_names
+                            if short_name not in dropped]
+
+        return self.selector is not None
+
+    def start(self, selector, short_names):
+        """Starts the journal of a new rotation.
+        """
+        for directory in [self.state_dir, self.scratch_dir]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+
+        self.selector = selector
+        self.short_names = list(short_names)
+        self.phases = {}
+        self.txt_values = {}
+
+        with open(self.path, 'w') as f:
+            self.write(f, [{'selector': selector, 'short_names': self.short_names}])
+
+    def done(self, short_name, phase):
+        return phase in self.phases.get(short_name, ())
+
+    def record(self, short_name, phase, txt_value=None):
+        self.record_many([short_name], phase, txt_value)
+
+    def record_many(self, short_names, phase, txt_value=None):
+        """Records that the entries completed phase, with a single flush to
+        disk for all of them.
+        """
+        entries = []
+
+        for short_name in short_names:
+            entry = {'short_name': short_name, 'phase': phase}
+
+            if txt_value is not None:
+                entry['txt_value'] = txt_value
+
+            entries.append(entry)
+
+        with self.lock:
+            with open(self.path, 'a') as f:
+                self.write(f, entries)
+
+            for short_name in short_names:
+                self.phases.setdefault(short_name, set()).add(phase)
+
+                if txt_value is not None:
+                    self.txt_values[short_name] = txt_value
+
+    def drop(self, short_names):
+        """Leaves entries out of the rest of the rotation, including when
+        it's resumed.
+        """
+        dropped = set(short_names)
+
+        with self.lock:
+            with open(self.path, 'a') as f:
+                self.write(f, [{'short_name': short_name, 'dropped': True}
+                               for short_name in short_names])
+
+            self.short_names = [short_name for short_name in self.short_names
+                                if short_name not in dropped]
+
+    def write(self, f, entries):
+        for entry in entries:
+            f.write(json.dumps(entry) + '\n')
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    def finish(self):
+        """Removes the journal and keys of a completed rotation.
+        """
+        os.unlink(self.path)
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
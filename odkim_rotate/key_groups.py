@@ -0,0 +1,59 @@
+import os
+
+from collections import OrderedDict
+
+from odkim_rotate.key_table import *
+
+def group_entries(entries, by_key_path=False):
+    """Groups the (short name, values) pairs of KeyTable entries that have to
+    share a key.
+
+    Entries signing for the same domain get the same selector and so the
+    same DNS record, which can only hold one key. With by_key_path, entries
+    whose private keys are kept in the same file are grouped too, even if
+    they sign for different domains. Returns lists of entries, ordered by
+    their first entry.
+    """
+    parents = list(range(len(entries)))
+    first = {}
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, (short_name, values) in enumerate(entries):
+        keys = [('domain', values[KeyTable.DOMAIN].lower())]
+
+        if by_key_path:
+            keys.append(('path', os.path.normpath(values[KeyTable.PRIVATE_KEY])))
+
+        for key in keys:
+            if key not in first:
+                first[key] = i
+                continue
+
+            # Every group is named after its first entry.
+            a, b = find(i), find(first[key])
+            parents[max(a, b)] = min(a, b)
+
+    groups = OrderedDict()
+
+    for i, entry in enumerate(entries):
+        groups.setdefault(find(i), []).append(entry)
+
+    return list(groups.values())
+
+def group_records(records):
+    """Groups (short name, TxtRecord) pairs by the record they need.
+
+    Returns (short names, TxtRecord) pairs, one for each distinct record.
+    """
+    groups = OrderedDict()
+
+    for short_name, record in records:
+        key = (record.domain.lower(), record.selector, record.value)
+        groups.setdefault(key, ([], record))[0].append(short_name)
+
+    return list(groups.values())
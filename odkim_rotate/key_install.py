@@ -0,0 +1,204 @@
+import errno
+import os
+
+from collections import OrderedDict
+
+# Whether files can be worked on relative to an open directory, which needs
+# Python 3.3 or later. Otherwise their paths are used.
+DIR_FD = hasattr(os, 'supports_dir_fd') and \
+    set([os.open, os.mkdir, os.link, os.rename, os.chmod, os.unlink, os.rmdir]) <= \
+    os.supports_dir_fd and os.chown in os.supports_follow_symlinks and \
+    os.listdir in os.supports_fd
+
+class KeyInstaller:
+    """Installs many private keys at once.
+
+    Keys are first staged in a directory inside every directory they're
+    installed in, where they're given their owner and mode. Staged keys are
+    hard links to the keys being installed when both are on the same
+    filesystem, and copies otherwise, e.g. when keys were generated on a
+    tmpfs. Which one is needed is told from the directories' devices rather
+    than from a failing rename. Every staged key's data is synced to disk
+    while staging. Installing the staged keys is then a rename per key,
+    followed by a single fsync of every directory.
+
+    Where Python allows it, everything is done relative to open directory
+    file descriptors, so that every directory's path is only looked up once.
+    stage can run well before install, e.g. before services are stopped, so
+    that only the renames are left for install. The keys being installed are
+    left as they are, so that an interrupted installation can be staged
+    again.
+    """
+
+    STAGING_DIR = '.odkim-rotate-staging'
+
+    def __init__(self, keys, uid=None, gid=None, mode=0o600):
+        # Destination path to the path of the key to install there, for every
+        # one of the (source, destination) pairs in keys.
+        self.keys = OrderedDict((os.path.abspath(destination), source)
+                                for source, destination in keys)
+        self.uid = uid
+        self.gid = gid
+        self.mode = mode
+
+        # Destination directory to (its descriptor, the staging directory's
+        # descriptor, its device).
+        self.directories = OrderedDict()
+
+        # Number of keys staged by linking and by copying.
+        self.linked = 0
+        self.copied = 0
+
+    def stage(self):
+        """Stages every key next to where it's to be installed.
+        """
+        for destination, source in self.keys.items():
+            directory, name = os.path.split(destination)
+            dir_fd, staging_fd, device = self.open_directory(directory)
+
+            if not (os.stat(os.path.dirname(os.path.abspath(source))).st_dev == device and
+                    self.link(source, directory, name)):
+                self.copy(source, directory, name)
+
+            if DIR_FD:
+                if self.uid is not None:
+                    os.chown(name, self.uid, self.gid, dir_fd=staging_fd,
+                             follow_symlinks=False)
+
+                os.chmod(name, self.mode, dir_fd=staging_fd)
+            else:
+                path = self.staged_path(directory, name)
+
+                if self.uid is not None:
+                    os.lchown(path, self.uid, self.gid)
+
+                os.chmod(path, self.mode)
+
+            # Renaming the key into place is only made durable by syncing its
+            # directory, which doesn't sync the key's data.
+            self.sync(directory, name)
+
+        for dir_fd, staging_fd, device in self.directories.values():
+            os.fsync(staging_fd)
+
+    def install(self):
+        """Moves every staged key into place.
+        """
+        for destination in self.keys:
+            directory, name = os.path.split(destination)
+            dir_fd, staging_fd, device = self.directories[directory]
+
+            if DIR_FD:
+                os.rename(name, name, src_dir_fd=staging_fd, dst_dir_fd=dir_fd)
+            else:
+                os.rename(self.staged_path(directory, name), destination)
+
+        for dir_fd, staging_fd, device in self.directories.values():
+            os.fsync(dir_fd)
+
+    def cleanup(self):
+        """Removes the staging directories, along with any keys left in them,
+        and closes the directories.
+        """
+        for directory, (dir_fd, staging_fd, device) in self.directories.items():
+            try:
+                self.clear(directory, staging_fd)
+
+                if DIR_FD:
+                    os.rmdir(self.STAGING_DIR, dir_fd=dir_fd)
+                else:
+                    os.rmdir(self.staged_path(directory))
+            finally:
+                os.close(staging_fd)
+                os.close(dir_fd)
+
+        self.directories = OrderedDict()
+
+    def staged_path(self, directory, name=''):
+        return os.path.join(directory, self.STAGING_DIR, name)
+
+    def open_directory(self, directory):
+        if directory in self.directories:
+            return self.directories[directory]
+
+        flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+        dir_fd = os.open(directory, flags)
+
+        try:
+            try:
+                if DIR_FD:
+                    os.mkdir(self.STAGING_DIR, 0o700, dir_fd=dir_fd)
+                else:
+                    os.mkdir(self.staged_path(directory), 0o700)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            if DIR_FD:
+                staging_fd = os.open(self.STAGING_DIR, flags, dir_fd=dir_fd)
+            else:
+                staging_fd = os.open(self.staged_path(directory), flags)
+        except Exception:
+            os.close(dir_fd)
+            raise
+
+        # Keys staged by an interrupted installation are staged again.
+        self.clear(directory, staging_fd)
+
+        self.directories[directory] = (dir_fd, staging_fd, os.fstat(dir_fd).st_dev)
+        return self.directories[directory]
+
+    def clear(self, directory, staging_fd):
+        if DIR_FD:
+            for name in os.listdir(staging_fd):
+                os.unlink(name, dir_fd=staging_fd)
+        else:
+            for name in os.listdir(self.staged_path(directory)):
+                os.unlink(self.staged_path(directory, name))
+
+    def link(self, source, directory, name):
+        """Stages source as a hard link, returning False if the filesystem
+        doesn't allow one.
+        """
+        try:
+            if DIR_FD:
+                os.link(source, name, dst_dir_fd=self.directories[directory][1])
+            else:
+                os.link(source, self.staged_path(directory, name))
+        except OSError as e:
+            if e.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP]:
+                raise
+            return False
+
+        self.linked += 1
+        return True
+
+    def sync(self, directory, name):
+        if DIR_FD:
+            fd = os.open(name, os.O_RDONLY, dir_fd=self.directories[directory][1])
+        else:
+            fd = os.open(self.staged_path(directory, name), os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def copy(self, source, directory, name):
+        with open(source, 'rb') as f:
+            data = f.read()
+
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL
+
+        if DIR_FD:
+            fd = os.open(name, flags, self.mode, dir_fd=self.directories[directory][1])
+        else:
+            fd = os.open(self.staged_path(directory, name), flags, self.mode)
+
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+        finally:
+            os.close(fd)
+
+        self.copied += 1
@@ -1,107 +1,318 @@
+import mmap
 import os
 
 from collections import OrderedDict
 
-class KeyTable:
-    """Allows parsing, editing, and saving OpenDKIM KeyTable files.
+from odkim_rotate.atomic_file import *
+
+# Types short names can have. Lines are decoded to unicode on Python 2.
+try:
+    TEXT_TYPES = (str, unicode)
+except NameError:
+    TEXT_TYPES = (str,)
+
+class KeyTableError(ValueError):
+    """Raised when a KeyTable file can't be parsed.
+
+    errors is a list of (line number, message) tuples for every malformed
+    line.
+    """
+
+    def __init__(self, file_path, errors):
+        messages = ['line {}: {}'.format(line_number, message)
+                    for line_number, message in errors]
+
+        ValueError.__init__(self, 'Malformed KeyTable {}: {}'.format(
+            file_path, '; '.join(messages)))
+        self.errors = errors
+
+class KeyTableEntry(object):
+    """Values of a single KeyTable entry.
+
+    Values can be read and changed either as attributes or by indexing with
+    KeyTable.DOMAIN, KeyTable.SELECTOR and KeyTable.PRIVATE_KEY.
+    """
+
+    __slots__ = ('domain', 'selector', 'private_key')
+
+    def __init__(self, domain, selector, private_key):
+        self.domain = domain
+        self.selector = selector
+        self.private_key = private_key
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, KeyTableEntry) and \
+            (self.domain, self.selector, self.private_key) == \
+            (other.domain, other.selector, other.private_key)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def copy(self):
+        return KeyTableEntry(self.domain, self.selector, self.private_key)
+
+    def __repr__(self):
+        return 'KeyTableEntry({!r}, {!r}, {!r})'.format(self.domain, self.selector,
+                                                        self.private_key)
+
+class BaseKeyTable:
+    """Entries of an OpenDKIM KeyTable dataset, wherever it is stored.
+
+    Subclasses load the entries and save changes made to them back to where
+    they came from.
 
     See "KeyTable (dataset)" entry at
     http://www.opendkim.org/opendkim.conf.5.html
     """
 
-    # Entries from the KeyTable file. Dictionary keyed by domain short name.
-    # Values are an array containing: name of the domain ("d=" value),
-    # selector ("s=" value), and path to private key.
+    # Entries from the KeyTable. Dictionary keyed by domain short name.
+    # Values are a KeyTableEntry containing: name of the domain ("d="
+    # value), selector ("s=" value), and path to private key.
     entries = {}
 
-    # Copy of OpenDKIM KeyTable file before any modifications were made.
-    original_conf_file = {}
+    # Short names sorted, for looking up entries by position.
+    short_names = []
 
-    file_path = ''
+    # Copy of the KeyTable before any modifications were made. Values are
+    # copies of the entries, unaffected by later updates.
+    original_conf_file = {}
 
     DOMAIN = 'domain'
     SELECTOR = 'selector'
     PRIVATE_KEY = 'private_key'
 
-    # Number of spaces to add to the longest short name when writing the
-    # KeyTable file. All subsequent entries will be padded to match.
-    SELECTOR_PADDING = 5
-
-    def __init__(self, file_path):
-        self.entries = {}
-        self.original_conf_file = {}
-
-        with open(file_path, 'r') as f:
-            for line in f:
-                parts = line.split()
-                v = parts[1].split(':')
-                values = {
-                    self.DOMAIN: v[0],
-                    self.SELECTOR: v[1],
-                    self.PRIVATE_KEY: v[2]
-                }
-
-                self.entries[parts[0]] = values
-                self.original_conf_file[parts[0]] = values
-
-        self.entries = OrderedDict(sorted(self.entries.items()))
-        self.file_path = file_path
-        self.iter_index = 0
-
     def update_selector(self, short_name, selector):
         self.entries[short_name][self.SELECTOR] = selector
 
-    def __iter__(self):
-        return self
-
-    def next(self):
-        if self.iter_index == len(self.entries):
-            self.iter_index = 0
-            raise StopIteration
+    def update_private_key(self, short_name, private_key):
+        self.entries[short_name][self.PRIVATE_KEY] = private_key
 
-        for index, key in enumerate(self.entries):
-            if index == self.iter_index:
-                self.iter_index = self.iter_index + 1
-                return key, self.entries[key]
+    def __iter__(self):
+        """Returns an iterator of (short name, KeyTableEntry) pairs sorted by
+        short name.
 
-    def __next__(self):
-        return self.next()
+        Every call returns a new iterator, so the KeyTable can be iterated
+        from several places at once.
+        """
+        entries = self.entries
+        return ((short_name, entries[short_name]) for short_name in self.short_names)
 
     def __len__(self):
         return len(self.entries)
 
     def __getitem__(self, key):
         if isinstance(key, int):
-            for index, short_name in enumerate(self.entries):
-                if index == key:
-                    return self.entries[short_name]
-            raise IndexError('Index {} not found'.format(key))
-        elif isinstance(key, str):
+            if not -len(self.short_names) <= key < len(self.short_names):
+                raise IndexError('Index {} not found'.format(key))
+            return self.entries[self.short_names[key]]
+        elif isinstance(key, TEXT_TYPES):
             if key not in self.entries:
                 raise KeyError('Short name, {}, not found'.format(key))
             return self.entries[key]
         else:
             raise TypeError('Index must be an int or str, not {}'.format(type(key).__name__))
 
+    def changed_entries(self):
+        """Returns the short names of entries that differ from the original.
+        """
+        return [short_name for short_name in self.short_names
+                if self.entries[short_name] != self.original_conf_file[short_name]]
+
+    def save_changes(self):
+        raise NotImplementedError()
+
+    def revert_changes(self):
+        raise NotImplementedError()
+
+    def discard_backup(self):
+        """Forgets whatever save_changes kept to be able to revert them.
+        """
+        pass
+
+class KeyTable(BaseKeyTable):
+    """Allows parsing, editing, and saving OpenDKIM KeyTable files.
+
+    Every line of the file is kept as it was read, including comments and
+    blank lines. Saving replaces just the value of changed entries in their
+    lines, so the file keeps its order and formatting and unchanged entries
+    are written back byte-for-byte.
+
+    The file is always replaced atomically. The first save keeps the file as
+    it was read as a hard link next to it, so that reverting is a single
+    rename.
+    """
+
+    # Hard link to the KeyTable file as it was read, made on the first save.
+    backup_path = ''
+    backup_created = False
+
+    # Every line of the KeyTable file as read, in order.
+    lines = []
+
+    # Where each entry's value is in lines, keyed by short name. Values are
+    # tuples of the line index and the start and end offsets of the value in
+    # the line.
+    value_positions = {}
+
+    file_path = ''
+
+    # Files larger than this many bytes are memory-mapped rather than read.
+    MMAP_THRESHOLD = 1024 * 1024
+
+    def __init__(self, file_path):
+        self.entries = {}
+        self.original_conf_file = {}
+        self.lines = []
+        self.value_positions = {}
+
+        # Flat files can be given with a "file:" dataset prefix. A "refile:"
+        # KeyTable has the same format, only with patterns for keys.
+        for prefix in ['file:', 'refile:']:
+            if file_path.startswith(prefix):
+                file_path = file_path[len(prefix):]
+
+        errors = []
+
+        for line_number, line in enumerate(self.read_lines(file_path), 1):
+            self.lines.append(line)
+
+            try:
+                self.parse_line(line, len(self.lines) - 1)
+            except ValueError as e:
+                errors.append((line_number, str(e)))
+
+        if errors:
+            raise KeyTableError(file_path, errors)
+
+        self.entries = OrderedDict(sorted(self.entries.items()))
+        self.short_names = list(self.entries)
+        self.file_path = file_path
+        self.backup_path = os.path.join(os.path.dirname(os.path.abspath(file_path)),
+                                        '.' + os.path.basename(file_path) + '.orig')
+        self.backup_created = False
+
+    def read_lines(self, file_path):
+        """Yields the lines of the file, including line endings.
+
+        Large files are memory-mapped so that they are paged in as they are
+        parsed instead of read up front.
+        """
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < self.MMAP_THRESHOLD:
+                for line in f:
+                    yield line.decode('utf-8')
+                return
+
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            try:
+                for line in iter(m.readline, b''):
+                    yield line.decode('utf-8')
+            finally:
+                m.close()
+
+    def parse_line(self, line, index):
+        """Adds the entry on a line, if it has one.
+
+        Everything after a "#" is a comment. Lines with nothing else on them
+        are kept but have no entry. Raises ValueError for malformed lines.
+        """
+        content = line.split('#', 1)[0]
+        parts = content.split(None, 1)
+
+        if not parts:
+            return
+
+        if len(parts) == 1:
+            raise ValueError("no value for '{}'".format(parts[0]))
+
+        short_name = parts[0]
+        value = parts[1].strip()
+        v = value.split(':', 2)
+
+        if len(v) != 3 or not all(v):
+            raise ValueError("value '{}' is not domain:selector:keypath".format(value))
+
+        if short_name in self.entries:
+            raise ValueError("duplicate entry for '{}'".format(short_name))
+
+        start = content.index(value, len(content) - len(parts[1]))
+
+        values = KeyTableEntry(v[0], v[1], v[2])
+
+        self.entries[short_name] = values
+        self.original_conf_file[short_name] = values.copy()
+        self.value_positions[short_name] = (index, start, start + len(value))
+
     def save_changes(self):
+        if not self.backup_created:
+            # A backup left behind by an earlier run isn't of this file as it
+            # was read.
+            if os.path.lexists(self.backup_path):
+                os.unlink(self.backup_path)
+
+            try:
+                os.link(self.file_path, self.backup_path)
+                self.backup_created = True
+            except OSError:
+                # Reverting will rewrite the file from the lines as read.
+                pass
+
         self.write_entries_to_file(self.entries)
 
     def revert_changes(self):
-        self.write_entries_to_file(self.original_conf_file)
+        if self.backup_created:
+            os.rename(self.backup_path, self.file_path)
+            fsync_directory(os.path.dirname(self.backup_path))
+            self.backup_created = False
+        else:
+            self.write_entries_to_file(self.original_conf_file)
 
-    def write_entries_to_file(self, entries):
-        max_short_name_len = max(len(x) for x in entries)
-        padding_length = max_short_name_len + self.SELECTOR_PADDING
+    def discard_backup(self):
+        """Removes the backup made by save_changes once it's no longer needed.
+        """
+        if self.backup_created:
+            os.unlink(self.backup_path)
+            self.backup_created = False
 
-        with open(self.file_path, 'w') as f:
-            for short_name in entries:
-                line_format = '{:' + str(padding_length) + '}{}:{}:{}\n'
+    def render_line(self, short_name, values):
+        """Returns the KeyTable file line for an entry.
+
+        The line keeps its original spacing and comments with just the value
+        replaced.
+        """
+        value = '{}:{}:{}'.format(values[self.DOMAIN], values[self.SELECTOR],
+                                  values[self.PRIVATE_KEY])
+
+        index, start, end = self.value_positions[short_name]
+        line = self.lines[index]
+
+        return line[:start] + value + line[end:]
+
+    def write_entries_to_file(self, entries):
+        """Replaces the KeyTable file with the entries.
 
-                entry = line_format.format(
-                    short_name,
-                    entries[short_name][self.DOMAIN],
-                    entries[short_name][self.SELECTOR],
-                    entries[short_name][self.PRIVATE_KEY])
+        Only lines of entries that differ from the file as read are
+        re-rendered. The file is replaced atomically, keeping its mode and
+        ownership, so that OpenDKIM never sees a partially written file.
+        """
+        lines = list(self.lines)
 
-                f.write(entry)
+        for short_name in entries:
+            if entries[short_name] != self.original_conf_file[short_name]:
+                lines[self.value_positions[short_name][0]] = \
+                    self.render_line(short_name, entries[short_name])
 
+        st = os.stat(self.file_path)
+        write_atomically(self.file_path, ''.join(lines).encode('utf-8'),
+                         st.st_mode & 0o7777, st.st_uid, st.st_gid)
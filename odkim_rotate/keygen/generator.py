@@ -0,0 +1,42 @@
+class GeneratedKey:
+    """Private key and DNS TXT record value of a newly generated key.
+    """
+
+    def __init__(self, private_key, txt_value, output=''):
+        # PEM encoded private key, as bytes.
+        self.private_key = private_key
+
+        # Value of the "<selector>._domainkey" TXT record, e.g.
+        # "v=DKIM1; k=rsa; s=email; p=...".
+        self.txt_value = txt_value
+
+        # Anything the generator wants shown in verbose mode.
+        self.output = output
+
+class KeyGenerator:
+    """Key generator.
+    """
+
+    RSA = 'rsa'
+    ED25519 = 'ed25519'
+
+    KEY_TYPES = [RSA, ED25519]
+
+    def __init__(self, key_type=RSA, bits=2048):
+        if key_type not in self.KEY_TYPES:
+            raise ValueError("Unknown key type '{}'".format(key_type))
+
+        self.key_type = key_type
+        self.bits = bits
+
+    def generate(self, domain, selector):
+        """Returns a GeneratedKey for the domain and selector.
+
+        Must be safe to call from several threads at once.
+        """
+        raise NotImplementedError()
+
+    def describe(self):
+        if self.key_type == self.RSA:
+            return '{}-bit RSA'.format(self.bits)
+        return 'Ed25519'
@@ -0,0 +1,73 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from odkim_rotate.keygen.generator import *
+from odkim_rotate.metrics import counters, Counters
+
+def scrub_txt_record(txt_value):
+    """Returns the TXT record value from a .txt file written by opendkim-genkey.
+    """
+    txt = ''
+
+    for line in txt_value.strip().split('\n'):
+        first = line.index('"') + 1
+        last = line.rindex('"')
+        txt += line[first:last]
+
+    return txt
+
+class OpenDkimKeyGenerator(KeyGenerator):
+    """Generates keys by running opendkim-genkey.
+
+    Every key costs a fork/exec of opendkim-genkey, which in turn runs
+    openssl, plus a round trip through the .private and .txt files it writes.
+    opendkim-genkey only knows how to generate RSA keys.
+    """
+
+    def __init__(self, key_type=KeyGenerator.RSA, bits=2048,
+                 genkey='/usr/bin/opendkim-genkey', verbose=False):
+        KeyGenerator.__init__(self, key_type, bits)
+
+        if key_type != self.RSA:
+            raise ValueError('opendkim-genkey can only generate RSA keys')
+
+        self.genkey = genkey
+        self.verbose = verbose
+
+    def generate(self, domain, selector):
+        # Each call works in its own directory so that concurrent calls don't
+        # collide on the "<selector>.private" file names.
+        work_dir = tempfile.mkdtemp()
+
+        options = [
+            self.genkey, \
+            '--bits=' + str(self.bits), \
+            #'--hash-algorithms=rsa-sha256', \
+            '--restrict', \
+            '--selector=' + selector, \
+            '--domain=' + domain, \
+            '--directory=' + work_dir, \
+        ]
+
+        if self.verbose:
+            options.append('--verbose')
+
+        try:
+            counters.increment(Counters.SUBPROCESSES)
+            output = subprocess.check_output(options, stderr=subprocess.STDOUT)
+
+            with open(os.path.join(work_dir, selector + '.private'), 'rb') as f:
+                private_key = f.read()
+
+            with open(os.path.join(work_dir, selector + '.txt'), 'r') as f:
+                txt_value = scrub_txt_record(f.read())
+        finally:
+            shutil.rmtree(work_dir)
+
+        return GeneratedKey(private_key, txt_value,
+                            output.decode('utf-8', 'replace').strip())
+
+    def describe(self):
+        return '{} using {}'.format(KeyGenerator.describe(self), self.genkey)
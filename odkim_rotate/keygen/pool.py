@@ -0,0 +1,161 @@
+import errno
+import json
+import os
+import threading
+import uuid
+
+from odkim_rotate.atomic_file import *
+from odkim_rotate.concurrency import map_concurrently
+from odkim_rotate.keygen.generator import *
+
+class KeyPool:
+    """Spool directory of keys generated ahead of time.
+
+    Keys don't depend on the domain or selector they end up with, so they can
+    be generated whenever the host is idle and taken by a later rotation
+    instead of being generated while it runs. Every type and size of key is
+    kept in its own subdirectory, e.g. "<spool_dir>/rsa-2048", with a file
+    per key. The directories are only accessible by their owner and every
+    key is written atomically, readable only by its owner. Taking a key
+    renames it before reading it, so that two rotations never get the same
+    key.
+    """
+
+    SUFFIX = '.key'
+
+    def __init__(self, spool_dir, key_type=KeyGenerator.RSA, bits=2048):
+        self.spool_dir = spool_dir
+        self.key_type = key_type
+        self.bits = bits
+        self.lock = threading.Lock()
+
+        # Names of keys not yet taken, as last listed.
+        self.names = []
+
+    @property
+    def path(self):
+        if self.key_type == KeyGenerator.RSA:
+            return os.path.join(self.spool_dir, '{}-{}'.format(self.key_type, self.bits))
+        return os.path.join(self.spool_dir, self.key_type)
+
+    def list(self):
+        if not os.path.isdir(self.path):
+            return []
+
+        return sorted(name for name in os.listdir(self.path) if name.endswith(self.SUFFIX))
+
+    def size(self):
+        """Returns the number of keys in the pool.
+        """
+        return len(self.list())
+
+    def add(self, key):
+        """Adds a GeneratedKey to the pool.
+        """
+        self.make_directories()
+
+        data = json.dumps({'private_key': key.private_key.decode('ascii'),
+                           'txt_value': key.txt_value})
+        write_atomically(os.path.join(self.path, uuid.uuid4().hex + self.SUFFIX),
+                         data.encode('utf-8'), 0o600)
+
+    def make_directories(self):
+        for path in [self.spool_dir, self.path]:
+            try:
+                os.makedirs(path, 0o700)
+            except OSError as e:
+                # Keys may be added from several threads at once.
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def take(self):
+        """Removes a key from the pool and returns it as a GeneratedKey, or
+        returns None if the pool is empty.
+        """
+        while True:
+            with self.lock:
+                if not self.names:
+                    self.names = self.list()
+
+                if not self.names:
+                    return None
+
+                name = self.names.pop()
+
+            path = os.path.join(self.path, name)
+            taken = path + '.taken'
+
+            try:
+                os.rename(path, taken)
+            except OSError as e:
+                # Another rotation got there first.
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+
+            try:
+                with open(taken, 'r') as f:
+                    data = json.load(f)
+            finally:
+                os.unlink(taken)
+
+            return GeneratedKey(data['private_key'].encode('ascii'), data['txt_value'])
+
+    def fill(self, generator, target, jobs=1, progress=None):
+        """Generates keys with generator until the pool holds target keys.
+
+        progress, if given, is called with the number of keys added so far
+        after each one. Returns the number of keys added.
+        """
+        needed = max(0, target - self.size())
+        added = [0]
+
+        def add(index):
+            # Keys are generated for a placeholder domain and selector,
+            # neither of which ends up in the key or its TXT record.
+            self.add(generator.generate('pool.invalid', 'pool'))
+
+            with self.lock:
+                added[0] += 1
+
+                if progress is not None:
+                    progress(added[0])
+
+        for index, result, error in map_concurrently(add, range(needed), jobs):
+            if error is not None:
+                raise error
+
+        return needed
+
+class PooledKeyGenerator(KeyGenerator):
+    """Takes keys from a KeyPool, falling back to generator once the pool is
+    empty.
+    """
+
+    def __init__(self, pool, generator):
+        KeyGenerator.__init__(self, generator.key_type, generator.bits)
+        self.pool = pool
+        self.generator = generator
+        self.lock = threading.Lock()
+
+        # Number of keys taken from the pool and generated.
+        self.taken = 0
+        self.generated = 0
+
+    def generate(self, domain, selector):
+        key = self.pool.take()
+
+        with self.lock:
+            if key is not None:
+                self.taken += 1
+            else:
+                self.generated += 1
+
+        if key is None:
+            key = self.generator.generate(domain, selector)
+
+        return key
+
+    def describe(self):
+        return '{}, taken from {} while it lasts'.format(self.generator.describe(),
+                                                        self.pool.path)
@@ -0,0 +1,54 @@
+import base64
+
+from odkim_rotate.keygen.generator import *
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+except ImportError:
+    serialization = None
+
+class PythonKeyGenerator(KeyGenerator):
+    """Generates keys in-process using the cryptography package.
+
+    Avoids running a process and writing files for every key. Supports both
+    RSA and Ed25519 (RFC 8463) keys.
+    """
+
+    def __init__(self, key_type=KeyGenerator.RSA, bits=2048):
+        KeyGenerator.__init__(self, key_type, bits)
+
+        if serialization is None:
+            raise RuntimeError("The 'cryptography' package is required to "
+                               'generate keys in-process')
+
+    def generate(self, domain, selector):
+        if self.key_type == self.ED25519:
+            key = ed25519.Ed25519PrivateKey.generate()
+
+            private_key = key.private_bytes(serialization.Encoding.PEM,
+                                            serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+
+            # Ed25519 records hold the raw 32 byte public key rather than a
+            # SubjectPublicKeyInfo structure.
+            public_key = key.public_key().public_bytes(serialization.Encoding.Raw,
+                                                       serialization.PublicFormat.Raw)
+        else:
+            key = rsa.generate_private_key(public_exponent=65537,
+                                           key_size=self.bits)
+
+            private_key = key.private_bytes(serialization.Encoding.PEM,
+                                            serialization.PrivateFormat.TraditionalOpenSSL,
+                                            serialization.NoEncryption())
+
+            public_key = key.public_key().public_bytes(serialization.Encoding.DER,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+
+        txt_value = 'v=DKIM1; k={}; s=email; p={}'.format(
+            self.key_type, base64.b64encode(public_key).decode('ascii'))
+
+        return GeneratedKey(private_key, txt_value)
+
+    def describe(self):
+        return '{} in-process'.format(KeyGenerator.describe(self))
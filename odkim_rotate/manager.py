@@ -1,16 +1,120 @@
 import datetime
 import os
 import shutil
-import subprocess
 import tempfile
+import threading
+import time
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from collections import OrderedDict
+
+from odkim_rotate.dns.provider import *
+from odkim_rotate.estimate import *
+from odkim_rotate.journal import *
+from odkim_rotate.key_groups import *
+from odkim_rotate.key_install import *
 from odkim_rotate.key_table import *
+from odkim_rotate.metrics import *
+from odkim_rotate.pipeline import *
+from odkim_rotate.preflight import *
 from odkim_rotate import utils
 
+try:
+    input = raw_input
+except NameError:
+    pass
+
 class Manager:
-    def __init__(self, verbose):
+    # Ways of installing keys. Restarting stops Postfix and OpenDKIM while
+    # keys are replaced. Reloading installs the keys alongside the old ones
+    # and has OpenDKIM reload, without stopping either service.
+    RESTART = 'restart'
+    RELOAD = 'reload'
+
+    INSTALL_MODES = [RESTART, RELOAD]
+
+    # Phases of a rotation, in the order they run. A journaled rotation can
+    # be run a phase at a time, e.g. to publish records off-peak and install
+    # the keys later.
+    GENERATE = 'generate'
+    PUBLISH = 'publish'
+    WAIT = 'wait'
+    VERIFY = 'verify'
+    INSTALL = 'install'
+    CLEANUP = 'cleanup'
+
+    PHASES = [GENERATE, PUBLISH, WAIT, VERIFY, INSTALL, CLEANUP]
+
+    # Journal phase every selected entry must have reached before a phase can
+    # run on its own.
+    PHASE_REQUIREMENTS = {
+        PUBLISH: Journal.GENERATED,
+        WAIT: Journal.PUBLISHED,
+        VERIFY: Journal.PROPAGATED,
+        INSTALL: Journal.VERIFIED
+    }
+
+    def __init__(self, verbose, jobs=1, dns_jobs=DnsProvider.concurrency,
+                 verify_jobs=16):
         self.verbose = verbose
+        self.install_mode = self.RESTART
+        self.jobs = jobs
+        self.dns_jobs = dns_jobs
+        self.verify_jobs = verify_jobs
         self.scratch_dir = tempfile.mkdtemp()
+        self.published_records = OrderedDict()
+
+        # Also gives entries whose private keys are kept in the same file the
+        # same key. Entries signing for the same domain always share one.
+        self.group_by_key_path = False
+
+        # Number of keys generated ahead of their publication when both run
+        # together, and of records published ahead of the propagation check.
+        self.queue_size = 256
+
+        # Chooses which KeyTable entries to rotate. When None, every entry is
+        # rotated.
+        self.entry_selector = None
+        self.selected = None
+
+        # Records the progress of the rotation so that it can be resumed after
+        # a failure. When None, an interrupted rotation starts over.
+        self.journal = None
+
+        # Checks for the new TXT records in DNS. When None, the user is asked
+        # to say when the records have propagated instead.
+        self.propagation_checker = None
+
+        # Deletes DNS records of selectors retired by earlier rotations once
+        # the new keys are installed. When None, old records are kept.
+        self.selector_cleaner = None
+
+        # Checks that entries' records can be published and their keys
+        # installed before generating keys for them. When None, every entry
+        # is tried.
+        self.preflight = None
+
+        # Short names of entries left out of the rotation by the pre-flight
+        # check.
+        self.dropped = []
+
+        # Installs the keys on a fleet of nodes instead of this host. When
+        # None, keys are installed locally.
+        self.fleet = None
+
+        # Timings and counters of this run, and where to write them when the
+        # run ends. Either path may be None.
+        self.metrics = RunMetrics()
+        self.metrics_json = None
+        self.metrics_textfile = None
+
+        # Parsed OpenDKIM configuration the paths above were read from, if
+        # any.
+        self.opendkim_config = None
         self.starting_dir = os.getcwd()
 
         # Today's date with microseconds for "randomization."
@@ -19,114 +123,604 @@ class Manager:
     def print_config(self):
         utils.print_verbose('OpenDKIM config: ' + self.opendkim_conf)
         utils.print_verbose('OpenDKIM KeyTable directory: ' + self.opendkim_keys_basedir)
-        utils.print_verbose('OpenDKIM generate key: ' + self.opendkim_genkey)
-        utils.print_verbose('OpenDKIM test key: ' + self.opendkim_genkey)
+        utils.print_verbose('Key generator: ' + self.key_generator.describe())
+        utils.print_verbose('Key verifier: ' + self.key_verifier.describe())
         utils.print_verbose('Private keys ownership: {}:{} ({}:{})'.format(self.key_owner, \
                                                                            self.key_group, \
                                                                            self.key_owner_uid, \
                                                                            self.key_group_gid))
         utils.print_verbose('OpenDKIM KeyTable file: ' + self.keytable_path)
+
+        if self.opendkim_config is not None:
+            utils.print_verbose('OpenDKIM SigningTable: {}'.format(
+                self.opendkim_config.signing_table))
+            utils.print_verbose('OpenDKIM socket: {}'.format(self.opendkim_config.socket))
+
         utils.print_verbose('Using scratch directory ' + self.scratch_dir)
+        utils.print_verbose('Key generation jobs: {}'.format(self.jobs))
+        utils.print_verbose('DNS provider connections: {}'.format(self.dns_jobs))
+        utils.print_verbose('Key verification jobs: {}'.format(self.verify_jobs))
+        utils.print_verbose('Install mode: ' + self.install_mode)
 
-    def generate_keys(self):
-        for short_name, values in self.keytable:
-            utils.print_header('Processing ' + values[KeyTable.DOMAIN])
+        if self.fleet is not None:
+            utils.print_verbose('Fleet nodes: ' + ', '.join(
+                node.transport.describe() for node in self.fleet.nodes))
+
+    def selected_entries(self):
+        """Returns the (short name, values) pairs of the entries to rotate.
+        """
+        if self.selected is None:
+            if self.journal is not None and self.journal.selector is not None:
+                self.selected = [(short_name, self.keytable[short_name])
+                                 for short_name in self.journal.short_names]
+            elif self.entry_selector is None:
+                self.selected = list(self.keytable)
+            else:
+                self.selected = self.entry_selector.select(self.keytable)
+
+        return self.selected
+
+    def pending_entries(self, phase):
+        """Returns the selected entries that haven't completed phase yet.
+        """
+        if self.journal is None:
+            return self.selected_entries()
+
+        return [(short_name, values) for short_name, values in self.selected_entries()
+                if not self.journal.done(short_name, phase)]
+
+    def record_phase(self, short_names, phase, txt_value=None):
+        if self.journal is not None:
+            self.journal.record_many(short_names, phase, txt_value)
+
+    def pending_groups(self, phase):
+        """Returns the selected entries that haven't completed phase yet,
+        grouped by the key they share (see group_entries).
+        """
+        return group_entries(self.pending_entries(phase), self.group_by_key_path)
+
+    def key_directory(self, values):
+        """Returns the directory an entry's key will be installed in, or None
+        if it's installed on a fleet.
+        """
+        if self.fleet is not None:
+            return None
+        if self.install_mode == self.RELOAD:
+            return self.opendkim_keys_basedir
+
+        return os.path.dirname(values[KeyTable.PRIVATE_KEY])
+
+    def checked_groups(self, phase):
+        """Returns pending_groups(phase) without the groups the pre-flight
+        check finds would fail, which are reported and dropped from the
+        rotation (see drop_entries).
+        """
+        groups = self.pending_groups(phase)
+
+        if self.preflight is None or not groups:
+            return groups
+
+        problems = self.preflight.check([entry for group in groups for entry in group],
+                                        self.key_directory)
+        passed = []
+        failed = []
+
+        for group in groups:
+            short_names = [short_name for short_name, values in group]
+
+            if not any(short_name in problems for short_name in short_names):
+                passed.append(group)
+                continue
+
+            for short_name in short_names:
+                utils.print_error('Skipping {}: {}'.format(
+                    short_name, problems.get(short_name,
+                                             'shares its key with an entry that would fail')))
+
+            failed.extend(short_names)
 
-            print('Generating key...')
+        if failed:
+            print('')
+            self.drop_entries(failed)
+
+        return passed
+
+    def drop_entries(self, short_names):
+        """Leaves entries out of the rest of the rotation, and out of the
+        journal so that resuming it doesn't wait on them. They keep their
+        current key and are reported once the rotation is done.
+        """
+        dropped = set(short_names)
+
+        if self.journal is not None and self.journal.selector is not None:
+            self.journal.drop(short_names)
+
+        self.selected = [(short_name, values) for short_name, values in self.selected_entries()
+                         if short_name not in dropped]
+        self.dropped.extend(short_names)
+
+    def generate_key(self, group):
+        """Generates a single key for a group of KeyTable entries.
+
+        The private key is written to "<short name>.private" in the scratch
+        directory for every entry, readable only by the owner. Returns the
+        GeneratedKey.
+        """
+        short_name, values = group[0]
+
+        start = time.time()
+        key = self.key_generator.generate(values[KeyTable.DOMAIN], self.selector)
+
+        for short_name, values in group:
+            path = os.path.join(self.scratch_dir, short_name + '.private')
+
+            # A key left behind by an interrupted rotation that never made it
+            # into the journal is replaced.
+            if os.path.exists(path):
+                os.unlink(path)
+
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+
+            with os.fdopen(fd, 'wb') as f:
+                f.write(key.private_key)
+
+        self.record_phase([short_name for short_name, values in group], Journal.GENERATED,
+                          key.txt_value)
+        self.metrics.record_domain(group[0][1][KeyTable.DOMAIN], 'generate',
+                                   time.time() - start)
+
+        return key
+
+    def generate_keys(self, publish=True):
+        """Generates keys for the selected entries and, if publish is True,
+        publishes their DNS records.
+        """
+        if publish:
+            self.stream_keys()
+            return
+
+        pending = self.checked_groups(Journal.GENERATED)
+
+        utils.print_header('Generating {:,} keys using {} jobs...'.format(len(pending),
+                                                                         self.jobs))
+        print('')
+
+        with self.metrics.phase('generate', len(pending)):
+            results = utils.map_concurrently(self.generate_key, pending, self.jobs)
 
-            options = [
-                self.opendkim_genkey, \
-                '--bits=2048', \
-                #'--hash-algorithms=rsa-sha256', \
-                '--restrict', \
-                '--selector=' + self.selector, \
-                '--domain=' + values[KeyTable.DOMAIN], \
-            ]
+        failures = []
 
-            if self.verbose:
-                options.append('--verbose')
-                print('\x1b[1;30;40m')
+        for group, result, error in results:
+            utils.print_header('Generated key for ' + group[0][1][KeyTable.DOMAIN])
 
-            subprocess.check_call(options)
+            if error is not None:
+                utils.print_error('Unable to generate key: ' + str(error))
+                failures.extend(short_name for short_name, values in group)
+                continue
 
-            if self.verbose:
-                print('\x1b[0m')
+            if self.verbose and result.output:
+                utils.print_verbose(result.output)
 
-            os.rename(self.selector + '.private', short_name + '.private')
-            os.rename(self.selector + '.txt', short_name + '.txt')
+        if failures:
+            raise RuntimeError('Key generation failed for {:,} domains: {}'.format(
+                len(failures), ', '.join(failures)))
 
+    def generated_records(self, group):
+        """Returns the records of a group of entries (see group_records) and
+        the generator's output, generating their key unless an earlier run
+        already did.
+        """
+        txt_values = set()
+
+        if self.journal is not None and all(self.journal.done(short_name, Journal.GENERATED)
+                                            for short_name, values in group):
+            txt_values = set(self.journal.txt_values[short_name] for short_name, values in group)
+
+        if len(txt_values) == 1:
+            txt_value, output = txt_values.pop(), None
+        else:
+            key = self.generate_key(group)
+            txt_value, output = key.txt_value, key.output
+
+        return group_records([(short_name, TxtRecord(values[KeyTable.DOMAIN], self.selector,
+                                                     txt_value))
+                              for short_name, values in group]), output
+
+    def publish_record(self, generated):
+        """Creates the DNS TXT records of generated_records.
+
+        Returns (short names, TxtRecord, error) for every record, along with
+        the generator's output.
+        """
+        records, output = generated
+        results = []
+
+        for short_names, record in records:
+            start = time.time()
+
+            try:
+                self.dns_provider.create_txt_record(record.domain, record.selector,
+                                                    record.value)
+            except Exception as e:
+                results.append((short_names, record, e))
+                continue
+
+            self.metrics.record_domain(record.domain, 'publish', time.time() - start)
+            results.append((short_names, record, None))
+
+        return results, output
+
+    def record_published(self, short_names, record):
+        """Points the entries at the new selector now that their record
+        exists.
+        """
+        print('Added DNS TXT record for ' + record.domain)
+
+        if self.verbose:
+            utils.print_verbose(record.value)
+
+        for short_name in short_names:
+            self.published_records[short_name] = record
             self.keytable.update_selector(short_name, self.selector)
 
-            print('Adding DNS TXT record...')
+        self.record_phase(short_names, Journal.PUBLISHED)
+
+    def stream_keys(self, wait=False):
+        """Generates keys for the selected entries and publishes their DNS
+        records as soon as each key exists, instead of once every key has
+        been generated.
+
+        Generation and publication are stages of a Pipeline with jobs and
+        dns_jobs workers. With wait, every record is handed to the
+        propagation checker as soon as it's published, and False is returned
+        if some records still weren't visible when the checker gave up.
+        """
+        if self.journal is not None:
+            self.restore_published()
+
+        pending = self.checked_groups(Journal.PUBLISHED)
+
+        utils.print_header('Generating {:,} keys using {} jobs and adding DNS TXT records '
+                           'using {} connections...'.format(len(pending), self.jobs,
+                                                            self.dns_jobs))
+        print('')
+
+        pipeline = Pipeline(self.queue_size)
+        pipeline.add_stage('generate', self.generated_records, self.jobs)
+        pipeline.add_stage('publish', self.publish_record, self.dns_jobs)
+
+        generate_failures = []
+        publish_failures = []
+
+        # Published records waiting for the propagation checker, and the
+        # entries they belong to.
+        published = queue.Queue()
+        short_names = {}
+
+        def done(group, results, error, stage):
+            if error is not None:
+                domain = group[0][1][KeyTable.DOMAIN]
+
+                if stage == 'generate':
+                    utils.print_error('Unable to generate key for {}: {}'.format(domain, error))
+                    generate_failures.extend(short_name for short_name, values in group)
+                else:
+                    utils.print_error('Unable to add DNS TXT record for {}: {}'.format(
+                        domain, error))
+                    publish_failures.extend(short_name for short_name, values in group)
+
+                return
+
+            results, output = results
+
+            if self.verbose and output:
+                utils.print_verbose(output)
+
+            for names, record, error in results:
+                if error is not None:
+                    utils.print_error('Unable to add DNS TXT record for {}: {}'.format(
+                        record.domain, error))
+                    publish_failures.extend(names)
+                    continue
+
+                self.record_published(names, record)
+
+                if wait:
+                    short_names[record] = names
+                    published.put(record)
+
+        if wait:
+            # Records published by an earlier run may not have propagated yet.
+            for names, record in self.published_groups(Journal.PROPAGATED):
+                short_names[record] = names
+                published.put(record)
+
+            watcher, stop, stragglers = self.watch_propagation(published, short_names)
+
+        try:
+            pipeline.run(pending, done)
+        finally:
+            self.dns_provider.flush()
+
+            for name, seconds, items in pipeline.stage_seconds():
+                self.metrics.record_phase(name, seconds, items)
+
+            if wait:
+                published.put(None)
+
+                # Failures abort the rotation without waiting for the rest.
+                if generate_failures or publish_failures:
+                    stop.set()
+
+                watcher.join()
+
+        if self.verbose and hasattr(self.dns_provider, 'stats'):
+            for line in self.dns_provider.stats.describe():
+                utils.print_verbose(line)
+
+        if generate_failures:
+            raise RuntimeError('Key generation failed for {:,} domains: {}'.format(
+                len(generate_failures), ', '.join(generate_failures)))
+
+        if publish_failures:
+            raise RuntimeError('Adding DNS TXT records failed for {:,} domains: {}'.format(
+                len(publish_failures), ', '.join(publish_failures)))
+
+        if wait:
+            return self.report_stragglers(stragglers)
+
+    def watch_propagation(self, published, short_names):
+        """Starts waiting for the records put on the published queue to
+        propagate, until None is put on it. short_names maps every record to
+        the entries it belongs to.
+
+        Returns the thread doing so, an Event that stops it early and the
+        list the records that didn't propagate are added to.
+        """
+        utils.print_header('Waiting for DNS TXT records to propagate to {} as they are '
+                           'added...'.format(', '.join(self.propagation_checker.resolvers)))
+
+        stop = threading.Event()
+        stragglers = []
+
+        def propagated(record, seconds):
+            self.metrics.record_domain(record.domain, 'propagate', seconds)
+            self.record_phase(short_names[record], Journal.PROPAGATED)
+
+        def watch():
+            start = time.time()
+
+            try:
+                stragglers.extend(self.propagation_checker.wait_stream(
+                    iter(published.get, None), self.propagation_progress, propagated, stop))
+            finally:
+                self.metrics.record_phase('propagate', time.time() - start,
+                                          len(short_names))
+
+        watcher = threading.Thread(target=watch)
+        watcher.daemon = True
+        watcher.start()
+
+        return watcher, stop, stragglers
+
+    def propagation_progress(self, pending):
+        print('{} {:,} records pending'.format(datetime.datetime.now().strftime('%X'), pending))
+
+    def report_stragglers(self, stragglers):
+        """Reports the records that didn't propagate, returning True if there
+        are none.
+        """
+        print('')
+
+        if stragglers:
+            for record in stragglers:
+                utils.print_error('DNS TXT record for {} has not propagated'.format(record.domain))
+
+            print('')
+            utils.print_error('Rotating keys aborted.')
+            return False
+
+        return True
+
+    def journaled_records(self, phase):
+        """Returns (short name, TxtRecord) pairs for the selected entries
+        the journal has reached phase for.
+        """
+        return [(short_name, TxtRecord(values[KeyTable.DOMAIN], self.selector,
+                                       self.journal.txt_values[short_name]))
+                for short_name, values in self.selected_entries()
+                if self.journal.done(short_name, phase)]
+
+    def published_groups(self, phase):
+        """Returns (short names, TxtRecord) pairs for the published records
+        of the selected entries that haven't completed phase yet.
+        """
+        groups = OrderedDict()
+
+        for short_name, values in self.pending_entries(phase):
+            record = self.published_records.get(short_name)
+
+            if record is not None:
+                groups.setdefault(record, ([], record))[0].append(short_name)
+
+        return list(groups.values())
+
+    def publish_keys(self):
+        """Publishes the DNS records of keys generated by an earlier run.
+        """
+        self.publish_records(self.journaled_records(Journal.GENERATED))
+
+    def restore_published(self):
+        """Picks up the records an earlier run published, pointing their
+        entries at the new selector, without publishing anything.
+        """
+        for short_names, record in group_records(self.journaled_records(Journal.PUBLISHED)):
+            for short_name in short_names:
+                self.published_records[short_name] = record
+                self.keytable.update_selector(short_name, self.selector)
+
+    def publish_records(self, records):
+        """Creates the DNS TXT records for the (short name, TxtRecord) pairs,
+        once for entries that share a record.
+
+        The selector of an entry is only updated once its record exists.
+        """
+        if self.journal is not None:
+            self.restore_published()
+            records = [(short_name, record) for short_name, record in records
+                       if not self.journal.done(short_name, Journal.PUBLISHED)]
+
+        groups = group_records(records)
+
+        print('')
+        utils.print_header('Adding {:,} DNS TXT records using {} connections...'.format(
+            len(groups), self.dns_jobs))
+        print('')
+
+        with self.metrics.phase('publish', len(groups)):
+            results = self.dns_provider.create_txt_records([r for s, r in groups],
+                                                           self.dns_jobs)
+        failures = []
+
+        for (short_names, record), result in zip(groups, results):
+            if result.seconds is not None:
+                self.metrics.record_domain(record.domain, 'publish', result.seconds)
+
+            if result.succeeded:
+                self.record_published(short_names, record)
+            else:
+                utils.print_error('Unable to add DNS TXT record for {}: {}'.format(
+                    record.domain, result.error))
+                failures.extend(short_names)
+
+        if self.verbose and hasattr(self.dns_provider, 'stats'):
+            for line in self.dns_provider.stats.describe():
+                utils.print_verbose(line)
+
+        if failures:
+            raise RuntimeError('Adding DNS TXT records failed for {:,} domains: {}'.format(
+                len(failures), ', '.join(failures)))
+
+    def wait_for_propagation(self):
+        """Waits for the new DNS TXT records to propagate.
+
+        Returns False if some records still weren't visible when the
+        propagation checker gave up.
+        """
+        print('')
+        print('')
+
+        if self.propagation_checker is None:
+            utils.print_header('Wait for DNS changes to propagate before continuing.')
+            utils.print_header('The time is now {}'.format(datetime.datetime.now().strftime('%c')))
+            input('Press any key to continue with checking DNS and installing keys...')
+            print('')
+            print('')
+            self.record_phase([short_name for short_name, values
+                               in self.pending_entries(Journal.PROPAGATED)],
+                              Journal.PROPAGATED)
+            return True
+
+        groups = self.published_groups(Journal.PROPAGATED)
+        records = [record for short_names, record in groups]
+
+        utils.print_header('Waiting for {:,} DNS TXT records to propagate to {}...'.format(
+            len(records), ', '.join(self.propagation_checker.resolvers)))
 
-            with open(short_name + '.txt', 'r') as f:
-                txt_value = utils.scrub_txt_record(f.read())
+        def propagated(record, seconds):
+            self.metrics.record_domain(record.domain, 'propagate', seconds)
 
-            if self.verbose:
-                utils.print_verbose(txt_value)
+        with self.metrics.phase('propagate', len(records)):
+            stragglers = self.propagation_checker.wait(records, self.propagation_progress,
+                                                       propagated)
 
-            self.dns_provider.create_txt_record(values[KeyTable.DOMAIN],
-                                                self.selector, txt_value)
+        self.record_phase([short_name for short_names, record in groups
+                           if record not in stragglers for short_name in short_names],
+                          Journal.PROPAGATED)
+
+        return self.report_stragglers(stragglers)
+
+    def test_key(self, entry):
+        short_name, values = entry
+        start = time.time()
+
+        try:
+            return self.key_verifier.verify(values[KeyTable.DOMAIN],
+                                            values[KeyTable.SELECTOR],
+                                            os.path.join(self.scratch_dir,
+                                                         short_name + '.private'))
+        finally:
+            self.metrics.record_domain(values[KeyTable.DOMAIN], 'verify',
+                                       time.time() - start)
 
     def test_keys(self):
-        utils.print_header('Testing keys...')
+        utils.print_header('Testing keys using {} jobs...'.format(self.verify_jobs))
         print('')
 
-        for short_name, values in self.keytable:
-            utils.print_header('Testing {}...'.format(values[KeyTable.DOMAIN]))
+        pending = self.pending_entries(Journal.VERIFIED)
 
-            options = [
-                self.opendkim_testkey, \
-                '-d', values[KeyTable.DOMAIN], \
-                '-s', values[KeyTable.SELECTOR], \
-                '-k', short_name + '.private' \
-            ]
+        with self.metrics.phase('verify', len(pending)):
+            results = utils.map_concurrently(self.test_key, pending, self.verify_jobs)
+        failures = []
 
-            if self.verbose:
-                options.append('-vvv')
-                print('\x1b[1;30;40m')
+        for (short_name, values), output, error in results:
+            utils.print_header('Testing {}...'.format(values[KeyTable.DOMAIN]))
 
-            result = subprocess.check_call(options)
+            if error is not None:
+                utils.print_error('FAILED! ' + str(error))
+                output = getattr(error, 'output', '')
+                failures.append(values[KeyTable.DOMAIN])
 
-            if self.verbose:
-                print('\x1b[0m')
+            if output and (self.verbose or error is not None):
+                utils.print_verbose(output)
 
-            if result != 0:
-                utils.print_error('FAILED!')
-                # TODO: Show result from opendkim_testkey
-                print('')
-                utils.print_error('Rotating keys aborted.')
-                return False
+        print('')
+
+        self.record_phase([short_name for (short_name, values), output, error in results
+                           if error is None], Journal.VERIFIED)
 
+        if failures:
+            utils.print_error('{:,} of {:,} keys failed testing: {}'.format(
+                len(failures), len(results), ', '.join(failures)))
             print('')
+            utils.print_error('Rotating keys aborted.')
+            return False
 
         return True
 
     def install_keys(self):
+        """Installs the keys and saves the new selectors to the KeyTable.
+
+        Returns True if every key was installed and the KeyTable saved.
+        """
+        if self.fleet is not None:
+            return self.install_keys_on_fleet()
+        if self.install_mode == self.RELOAD:
+            return self.install_keys_with_reload()
+
         print('')
         utils.print_header('Installing keys...')
         print('')
 
+        pending = self.pending_entries(Journal.INSTALLED)
+        installer = self.stage_keys([(short_name, values[KeyTable.PRIVATE_KEY])
+                                     for short_name, values in pending])
+
+        if installer is None:
+            return False
+
         utils.toggle_services(True)
         print('')
 
         try:
-            for short_name, values in self.keytable:
-                utils.print_header('Installing {}...'.format(values[KeyTable.DOMAIN]))
-
-                local_key = short_name + '.private'
-
-                if self.verbose:
-                    utils.print_verbose('Moving {} to {}'.format(local_key,
-                                                                 values[KeyTable.PRIVATE_KEY]))
-
-                os.rename(local_key, values[KeyTable.PRIVATE_KEY])
-                os.chown(values[KeyTable.PRIVATE_KEY], self.key_owner_uid,
-                         self.key_group_gid)
+            installer.install()
+            self.record_phase([short_name for short_name, values in pending],
+                              Journal.INSTALLED)
 
             try:
                 utils.print_header('Saving new selector to KeyTable file...')
                 self.keytable.save_changes()
+                return True
             except Exception as e:
                 utils.print_error('Error: Unable to save new selector to KeyTable file: ' + str(e))
 
@@ -139,39 +733,390 @@ class Manager:
         finally:
             print('')
             utils.toggle_services(False)
+            installer.cleanup()
+
+        return False
+
+    def stage_keys(self, keys):
+        """Stages the keys of the (short name, installed path) pairs next to
+        where they're to be installed, owned by the key owner.
+
+        Returns the KeyInstaller to install them with, or None if staging
+        failed.
+        """
+        installer = KeyInstaller([(os.path.join(self.scratch_dir, short_name + '.private'), path)
+                                  for short_name, path in keys],
+                                 self.key_owner_uid, self.key_group_gid)
 
-    def rotate_keys(self):
         if self.verbose:
-            self.print_config()
+            for short_name, path in keys:
+                utils.print_verbose('Installing {}.private as {}'.format(short_name, path))
 
-        print('Processing {:,} domains...'.format(len(self.keytable)))
-        print('Using selector ' + self.selector)
+        try:
+            installer.stage()
+        except Exception as e:
+            utils.print_error('Error: Unable to stage keys: ' + str(e))
+            installer.cleanup()
+            return None
+
+        if self.verbose:
+            utils.print_verbose('Staged {:,} keys by linking and {:,} by copying them'.format(
+                installer.linked, installer.copied))
+
+        return installer
+
+    def install_keys_with_reload(self):
+        """Installs the keys without stopping Postfix or OpenDKIM.
+
+        The keys are moved to a directory named after the selector in the
+        KeyTable directory, next to the keys in use. Pointing the KeyTable
+        at them is then a single atomic rename of the KeyTable file, after
+        which OpenDKIM is reloaded. The old keys are left in place.
+
+        Returns True if the keys were installed and OpenDKIM reloaded.
+        """
+        print('')
+        utils.print_header('Installing keys without stopping services...')
         print('')
 
+        key_dir = os.path.join(self.opendkim_keys_basedir, self.selector)
+
         try:
-            os.chdir(self.scratch_dir)
-            self.generate_keys()
+            if not os.path.isdir(key_dir):
+                os.mkdir(key_dir, 0o750)
+                os.chown(key_dir, self.key_owner_uid, self.key_group_gid)
+        except Exception as e:
+            utils.print_error('Error: Unable to install key: ' + str(e))
+            return False
+
+        pending = self.pending_entries(Journal.INSTALLED)
+        installer = self.stage_keys([(short_name, os.path.join(key_dir, short_name + '.private'))
+                                     for short_name, values in pending])
+
+        if installer is None:
+            return False
+
+        try:
+            installer.install()
+            self.record_phase([short_name for short_name, values in pending],
+                              Journal.INSTALLED)
+        except Exception as e:
+            utils.print_error('Error: Unable to install key: ' + str(e))
+            return False
+        finally:
+            installer.cleanup()
+
+        for short_name, values in self.selected_entries():
+            self.keytable.update_private_key(short_name,
+                                             os.path.join(key_dir, short_name + '.private'))
+
+        try:
+            utils.print_header('Saving new selector to KeyTable file...')
+            self.keytable.save_changes()
+            utils.reload_opendkim()
+            return True
+        except Exception as e:
+            utils.print_error('Error: Unable to switch to new keys: ' + str(e))
 
             try:
-                input = raw_input
-            except NameError:
-                pass
+                self.keytable.revert_changes()
+                utils.reload_opendkim()
+            except Exception as ex:
+                utils.print_error('Error: Unable to revert changes made to KeyTable file: ' + str(ex))
 
-            print('')
-            print('')
-            utils.print_header('Wait for DNS changes to propagate before continuing.')
-            utils.print_header('The time is now {}'.format(datetime.datetime.now().strftime('%c')))
-            input('Press any key to continue with checking DNS and installing keys...')
-            print('')
-            print('')
+        return False
+
+    def install_keys_on_fleet(self):
+        """Installs the keys and new selectors on every node of the fleet.
 
-            test_results = self.test_keys()
+        Nothing is installed on this host. If any node fails, every node is
+        rolled back so that the fleet keeps signing with the same keys.
 
-            if test_results:
-                self.install_keys()
+        Returns True if every node was updated.
+        """
+        print('')
+        utils.print_header('Installing keys on {:,} nodes...'.format(len(self.fleet.nodes)))
+        print('')
+
+        keys = OrderedDict()
+
+        for short_name, values in self.selected_entries():
+            with open(short_name + '.private', 'rb') as f:
+                keys[short_name] = f.read()
+
+        results = self.fleet.install(self.selector, keys)
+
+        for result in results:
+            if result.succeeded:
+                print('{}: {}'.format(result.node.name, result.phase))
+                continue
+
+            message = '{}: {}'.format(result.node.name, result.phase or 'not staged')
+
+            if result.error is not None:
+                message += ' ({})'.format(result.error)
+            if result.rollback_error is not None:
+                message += '; unable to roll back: {}'.format(result.rollback_error)
+
+            utils.print_error(message)
+
+        print('')
+
+        failures = [result for result in results if not result.succeeded]
+
+        if failures:
+            utils.print_error('Installing keys failed on {:,} of {:,} nodes.'.format(
+                len([result for result in failures if result.error is not None]),
+                len(results)))
+            return False
+
+        self.record_phase(list(keys), Journal.INSTALLED)
+        return True
+
+    def clean_up_selectors(self):
+        """Deletes the TXT records of old selectors of the rotated domains
+        that are past their grace period.
+
+        Failures are reported but don't fail the rotation, as the records are
+        looked for again by the next rotation.
+        """
+        print('')
+        utils.print_header('Deleting DNS records of retired selectors...')
+
+        live_selectors = {}
+
+        for short_name, values in self.keytable:
+            live_selectors.setdefault(values[KeyTable.DOMAIN], set()).add(
+                values[KeyTable.SELECTOR])
+
+        domains = set(values[KeyTable.DOMAIN] for short_name, values
+                      in self.selected_entries())
+        stale, errors = self.selector_cleaner.stale_records(
+            dict((domain, live_selectors[domain]) for domain in domains))
+
+        for domain, error in errors:
+            utils.print_error('Unable to list DNS records of {}: {}'.format(domain, error))
+
+        print('Deleting {:,} records...'.format(len(stale)))
+
+        def progress(batch):
+            for result in batch:
+                if result.succeeded:
+                    if self.verbose:
+                        utils.print_verbose('Deleted {}._domainkey.{}'.format(
+                            result.record.selector, result.record.domain))
+                else:
+                    utils.print_error('Unable to delete {}._domainkey.{}: {}'.format(
+                        result.record.selector, result.record.domain, result.error))
+
+        results = self.selector_cleaner.delete(stale, progress)
+
+        print('Deleted {:,} of {:,} records.'.format(
+            len([result for result in results if result.succeeded]), len(results)))
+
+    def resume_rotation(self):
+        """Picks up an unfinished rotation from the journal, if there is one,
+        or starts a new journal otherwise.
+        """
+        if self.journal.load():
+            shutil.rmtree(self.scratch_dir)
+            self.selector = self.journal.selector
+            self.scratch_dir = self.journal.scratch_dir
+            self.selected = None
+
+            print('Resuming unfinished rotation from ' + self.journal.path)
+        else:
+            shutil.rmtree(self.scratch_dir)
+            self.scratch_dir = self.journal.scratch_dir
+            self.journal.start(self.selector, [short_name for short_name, values
+                                               in self.selected_entries()])
+
+    def rotate_keys(self, phases=None):
+        """Runs phases, a list of PHASES in order, of the rotation.
+
+        By default the whole rotation is run. Running only some phases picks
+        up where an earlier run left off, which requires a journal.
+
+        Returns True if every phase run succeeded for every selected entry,
+        and False if some failed or were left out by the pre-flight checks.
+        """
+        if phases is None:
+            phases = self.PHASES
+
+        if phases == [self.CLEANUP]:
+            return self.clean_up_only()
+
+        if self.journal is not None:
+            if phases[0] != self.GENERATE and not os.path.exists(self.journal.path):
+                utils.print_error('No unfinished rotation in {}. Run "{}" first.'.format(
+                    self.journal.state_dir, self.GENERATE))
+                shutil.rmtree(self.scratch_dir)
+                return False
+
+            self.resume_rotation()
+        elif phases != self.PHASES:
+            raise ValueError('Running part of a rotation requires a journal')
+
+        if self.verbose:
+            self.print_config()
+
+        print('Processing {:,} of {:,} domains...'.format(len(self.selected_entries()),
+                                                          len(self.keytable)))
+        print('Using selector ' + self.selector)
+        print('')
+
+        if not self.selected_entries():
+            print('No domains selected for rotation.')
+            self.finish_rotation()
+            return True
+
+        succeeded = False
+        finished = False
+
+        try:
+            os.chdir(self.scratch_dir)
+            succeeded = self.run_phases(phases)
+            finished = succeeded and self.INSTALL in phases
         finally:
             os.chdir(self.starting_dir)
-            shutil.rmtree(self.scratch_dir)
+
+            if finished:
+                self.keytable.discard_backup()
+
+                if self.selector_cleaner is not None and self.CLEANUP in phases:
+                    with self.metrics.phase('cleanup'):
+                        self.clean_up_selectors()
+
+            self.metrics.finish(succeeded)
+            self.write_metrics()
+
+            # Keep everything needed to resume the rotation unless it's done.
+            if finished or self.journal is None:
+                self.finish_rotation()
+            elif succeeded:
+                print('')
+                print('Run "{}" to continue the rotation.'.format(
+                    self.PHASES[self.PHASES.index(phases[-1]) + 1]))
+            else:
+                utils.print_error('Rotation unfinished. Run again to resume it.')
+
+            if self.dropped:
+                utils.print_error('Left {:,} domains that failed pre-flight checks out of the '
+                                  'rotation: {}'.format(len(self.dropped),
+                                                        ', '.join(self.dropped)))
 
         print('')
+        return succeeded and not self.dropped
+
+    def run_phases(self, phases):
+        """Runs the phases up to and including install.
+
+        Returns False as soon as one fails.
+        """
+        first = [phase for phase in phases if phase != self.CLEANUP][0]
+
+        if first in self.PHASE_REQUIREMENTS:
+            pending = self.pending_entries(self.PHASE_REQUIREMENTS[first])
+
+            if pending:
+                utils.print_error('{:,} domains have not been {} yet. Run "{}" first.'.format(
+                    len(pending), self.PHASE_REQUIREMENTS[first],
+                    self.PHASES[self.PHASES.index(first) - 1]))
+                return False
+
+        propagated = None
+
+        # Generation, publication and, when there's a propagation checker,
+        # the wait run together, each domain moving on as soon as it can.
+        if self.GENERATE in phases and self.PUBLISH in phases:
+            propagated = self.stream_keys(self.WAIT in phases and
+                                          self.propagation_checker is not None)
+        elif self.GENERATE in phases:
+            self.generate_keys(False)
+        elif self.PUBLISH in phases:
+            self.publish_keys()
+        else:
+            self.restore_published()
+
+        if self.WAIT in phases:
+            if propagated is None:
+                propagated = self.wait_for_propagation()
+
+            if not propagated:
+                return False
+
+        if self.VERIFY in phases and not self.test_keys():
+            return False
+
+        if self.INSTALL in phases:
+            with self.metrics.phase('install', len(self.selected_entries())):
+                return self.install_keys()
+
+        return True
+
+    def clean_up_only(self):
+        """Deletes the DNS records of retired selectors, outside a rotation.
+        """
+        if self.selector_cleaner is None:
+            raise ValueError('No selector cleaner configured')
+
+        with self.metrics.phase('cleanup'):
+            self.clean_up_selectors()
+
+        self.metrics.finish(True)
+        self.write_metrics()
 
+        # Any unfinished rotation in the journal is left alone.
+        shutil.rmtree(self.scratch_dir)
+        return True
+
+    def dry_run(self, history=None):
+        """Describes the rotation that would run and estimates its cost,
+        without generating keys or touching DNS or the KeyTable.
+
+        history is the metrics report of an earlier run to base the estimate
+        on, if any.
+        """
+        if self.verbose:
+            self.print_config()
+
+        entries = self.selected_entries()
+        keys = len(group_entries(entries, self.group_by_key_path))
+        records = len(set(values[KeyTable.DOMAIN].lower() for short_name, values in entries))
+
+        print('Would rotate {:,} of {:,} domains with {:,} new keys.'.format(
+            len(entries), len(self.keytable), keys))
+
+        for line in RotationEstimate(self, len(entries), history, keys, records).describe():
+            print(line)
+
+        shutil.rmtree(self.scratch_dir)
+
+    def write_metrics(self):
+        """Writes the run's timings and counters where configured.
+
+        Failing to write them is reported but doesn't affect the rotation.
+        """
+        self.metrics.selector = self.selector
+
+        if self.verbose:
+            for name, phase in self.metrics.phases.items():
+                utils.print_verbose('{}: {:,} domains in {:.2f}s'.format(
+                    name, phase['items'], phase['seconds']))
+
+            for name, count in sorted(self.metrics.counts().items()):
+                utils.print_verbose('{}: {:,}'.format(name.replace('_', ' '), count))
+
+        try:
+            if self.metrics_json is not None:
+                self.metrics.write_json(self.metrics_json)
+            if self.metrics_textfile is not None:
+                self.metrics.write_prometheus(self.metrics_textfile)
+        except (IOError, OSError) as e:
+            utils.print_error('Unable to write metrics: ' + str(e))
+
+    def finish_rotation(self):
+        if self.journal is not None:
+            self.journal.finish()
+        else:
+            shutil.rmtree(self.scratch_dir)
@@ -0,0 +1,175 @@
+import json
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from odkim_rotate.atomic_file import *
+
+class Counters:
+    """Process-wide counts of costly operations, e.g. subprocesses started.
+
+    Safe to update from several threads at once.
+    """
+
+    SUBPROCESSES = 'subprocesses'
+    API_REQUESTS = 'api_requests'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def increment(self, name, count=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+counters = Counters()
+
+class RunMetrics:
+    """Timings and counters of a single rotation.
+
+    Times how long each phase took and how long each domain spent in each
+    phase, along with how many subprocesses and API requests the run cost.
+    The report can be written as JSON or in the Prometheus text format for
+    node_exporter's textfile collector. Safe to update from several threads
+    at once.
+    """
+
+    PROMETHEUS_PREFIX = 'odkim_rotate'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.finished = None
+        self.succeeded = None
+        self.selector = None
+
+        # Phase name to {'seconds': ..., 'items': ...}, in the order the
+        # phases ran.
+        self.phases = OrderedDict()
+
+        # Domain to {phase name: seconds}.
+        self.domains = {}
+
+        self.counters_at_start = counters.snapshot()
+
+    @contextmanager
+    def phase(self, name, items=None):
+        """Times the code run within the with block as phase name.
+
+        items is the number of domains the phase handled.
+        """
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.time() - start, items)
+
+    def record_phase(self, name, seconds, items=None):
+        with self.lock:
+            phase = self.phases.setdefault(name, {'seconds': 0.0, 'items': 0})
+            phase['seconds'] += seconds
+            phase['items'] += items or 0
+
+    def record_domain(self, domain, phase, seconds):
+        with self.lock:
+            timings = self.domains.setdefault(domain, {})
+            timings[phase] = timings.get(phase, 0.0) + seconds
+
+    def finish(self, succeeded):
+        self.finished = time.time()
+        self.succeeded = succeeded
+
+    def counts(self):
+        """Returns the counters' increase since the run started.
+        """
+        now = counters.snapshot()
+        return dict((name, count - self.counters_at_start.get(name, 0))
+                    for name, count in now.items())
+
+    def slowest_domains(self, phase, count=10):
+        """Returns (domain, seconds) for the count slowest domains in phase.
+        """
+        with self.lock:
+            timings = [(domain, phases[phase]) for domain, phases in self.domains.items()
+                       if phase in phases]
+
+        return sorted(timings, key=lambda timing: -timing[1])[:count]
+
+    def report(self):
+        finished = self.finished or time.time()
+
+        with self.lock:
+            phases = OrderedDict((name, dict(phase)) for name, phase in self.phases.items())
+            domains = dict((domain, dict(timings)) for domain, timings in self.domains.items())
+
+        return OrderedDict([
+            ('selector', self.selector),
+            ('started', self.started),
+            ('finished', finished),
+            ('seconds', finished - self.started),
+            ('succeeded', self.succeeded),
+            ('phases', phases),
+            ('slowest_domains', OrderedDict((name, self.slowest_domains(name))
+                                            for name in phases)),
+            ('counters', self.counts()),
+            ('domains', domains)
+        ])
+
+    def write_json(self, path):
+        write_atomically(path, json.dumps(self.report(), indent=2).encode('utf-8'), 0o644)
+
+    def prometheus_lines(self):
+        report = self.report()
+        prefix = self.PROMETHEUS_PREFIX
+        lines = []
+
+        def metric(name, help_text, metric_type, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, metric_type))
+
+            for labels, value in samples:
+                label_text = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+                lines.append('{}_{}{} {}'.format(prefix, name,
+                                                 '{' + label_text + '}' if labels else '',
+                                                 repr(float(value))))
+
+        metric('last_run_timestamp_seconds', 'When the last rotation finished.', 'gauge',
+               [((), report['finished'])])
+        metric('last_run_success', 'Whether the last rotation finished successfully.',
+               'gauge', [((), 1 if report['succeeded'] else 0)])
+        metric('last_run_duration_seconds', 'How long the last rotation took.', 'gauge',
+               [((), report['seconds'])])
+        metric('last_run_domains', 'Number of domains the last rotation rotated.', 'gauge',
+               [((), len(report['domains']))])
+        metric('phase_duration_seconds', 'How long each phase of the last rotation took.',
+               'gauge', [((('phase', name),), phase['seconds'])
+                         for name, phase in report['phases'].items()])
+        metric('phase_items', 'Number of domains each phase of the last rotation handled.',
+               'gauge', [((('phase', name),), phase['items'])
+                         for name, phase in report['phases'].items()])
+        metric('phase_domain_max_seconds', 'Longest time a single domain spent in each '
+               'phase of the last rotation.', 'gauge',
+               [((('phase', name),), slowest[0][1])
+                for name, slowest in report['slowest_domains'].items() if slowest])
+        metric('last_run_operations', 'Subprocesses started and API requests made by the '
+               'last rotation.', 'gauge',
+               [((('operation', name),), count)
+                for name, count in sorted(report['counters'].items())])
+
+        return lines
+
+    def write_prometheus(self, path):
+        """Writes the metrics for node_exporter's textfile collector.
+
+        The file is replaced atomically so that the collector never reads
+        half of it.
+        """
+        write_atomically(path, ('\n'.join(self.prometheus_lines()) + '\n').encode('utf-8'),
+                         0o644)
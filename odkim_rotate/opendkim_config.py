@@ -0,0 +1,183 @@
+import os
+import threading
+
+class OpenDkimConfigError(ValueError):
+    """Raised when an OpenDKIM configuration file can't be read.
+    """
+
+class OpenDkimConfig:
+    """Parsed OpenDKIM configuration file.
+
+    Each line holds a parameter name and its value separated by whitespace.
+    Names are case-insensitive, "#" starts a comment and "Include" reads the
+    parameters of another file in its place. When a parameter is given more
+    than once the last value wins.
+
+    See http://www.opendkim.org/opendkim.conf.5.html
+    """
+
+    # Prefixes of data sets that are read from a file.
+    FILE_DATA_SET_PREFIXES = ['file:', 'refile:']
+
+    TRUE_VALUES = ['true', 'yes', 't', 'y', '1']
+    FALSE_VALUES = ['false', 'no', 'f', 'n', '0']
+
+    def __init__(self, path):
+        self.path = path
+
+        # Lower case parameter name to (name, value) as written.
+        self.parameters = {}
+
+        # Modification times of every file read, so that changes to any of
+        # them can be noticed.
+        self.mtimes = {}
+
+        self.read_file(path, [])
+
+    def read_file(self, path, including):
+        path = os.path.abspath(path)
+
+        if path in including:
+            raise OpenDkimConfigError('OpenDKIM config {} includes itself'.format(path))
+
+        try:
+            with open(path, 'r') as f:
+                self.mtimes[path] = os.fstat(f.fileno()).st_mtime
+                lines = f.readlines()
+        except (IOError, OSError) as e:
+            raise OpenDkimConfigError('Could not read OpenDKIM config {}: {}'.format(path, e))
+
+        for line in lines:
+            line = line.split('#', 1)[0].strip()
+
+            if not line:
+                continue
+
+            parts = line.split(None, 1)
+            name = parts[0]
+            value = parts[1].strip() if len(parts) > 1 else ''
+
+            if name.lower() == 'include':
+                self.read_file(os.path.join(os.path.dirname(path), value),
+                               including + [path])
+            else:
+                self.parameters[name.lower()] = (name, value)
+
+    def is_stale(self):
+        """Returns whether any of the files read have changed since.
+        """
+        for path, mtime in self.mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+
+        return False
+
+    def __contains__(self, name):
+        return name.lower() in self.parameters
+
+    def __getitem__(self, name):
+        return self.parameters[name.lower()][1]
+
+    def get(self, name, default=None):
+        if name in self:
+            return self[name]
+        return default
+
+    def get_boolean(self, name, default=False):
+        value = self.get(name)
+
+        if value is None:
+            return default
+        if value.lower() in self.TRUE_VALUES:
+            return True
+        if value.lower() in self.FALSE_VALUES:
+            return False
+
+        raise OpenDkimConfigError("OpenDKIM config {} has invalid boolean {} '{}'".format(
+            self.path, name, value))
+
+    def require(self, name):
+        if name not in self:
+            raise OpenDkimConfigError("Could not find '{}' parameter in OpenDKIM config at {}".format(
+                name, self.path))
+        return self[name]
+
+    @property
+    def keytable(self):
+        return self.get('KeyTable')
+
+    @property
+    def signing_table(self):
+        return self.get('SigningTable')
+
+    @property
+    def socket(self):
+        return self.get('Socket')
+
+    @property
+    def user_id(self):
+        """Returns the (user, group) OpenDKIM runs as.
+
+        Either is None when not configured.
+        """
+        value = self.get('UserID')
+
+        if not value:
+            return None, None
+
+        user, _, group = value.partition(':')
+        return user, group or None
+
+    def data_set_file(self, name):
+        """Returns the path of the file a data set parameter is read from, or
+        None if it isn't set or isn't kept in a file.
+        """
+        value = self.get(name)
+
+        if not value:
+            return None
+
+        for prefix in self.FILE_DATA_SET_PREFIXES:
+            if value.startswith(prefix):
+                return value[len(prefix):]
+
+        if ':' in value.split('/', 1)[0]:
+            return None
+
+        return value
+
+    def key_directory(self, default=None):
+        """Returns the directory private keys are kept in.
+
+        That is the directory of the KeyTable file, or of the single KeyFile
+        when there is no KeyTable.
+        """
+        path = self.data_set_file('KeyTable') or self.get('KeyFile')
+
+        if path is None:
+            return default
+
+        return os.path.dirname(path)
+
+configs = {}
+configs_lock = threading.Lock()
+
+def load_opendkim_config(path):
+    """Returns the parsed OpenDKIM configuration at path.
+
+    Files are parsed once and shared between callers until any of them
+    changes.
+    """
+    key = os.path.abspath(path)
+
+    with configs_lock:
+        config = configs.get(key)
+
+        if config is None or config.is_stale():
+            config = OpenDkimConfig(path)
+            configs[key] = config
+
+        return config
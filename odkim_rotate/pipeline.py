@@ -0,0 +1,151 @@
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class PipelineStage:
+    def __init__(self, name, func, workers):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.lock = threading.Lock()
+        self.running = self.workers
+        self.started = None
+        self.finished = None
+        self.items = 0
+
+    @property
+    def seconds(self):
+        """Seconds from the stage taking its first item until it had done its
+        last one.
+        """
+        if self.started is None:
+            return 0.0
+
+        return (self.finished or time.time()) - self.started
+
+class Pipeline:
+    """Passes items through a series of stages, each run by its own pool of
+    worker threads, without waiting for a stage to finish with every item
+    before the next stage starts on them.
+
+    Stages are connected by queues holding at most queue_size items, so that
+    a fast stage blocks instead of running arbitrarily far ahead of a slow
+    one. The first stage's func is called with every item, and every other
+    stage's func with what the previous stage returned. An item that fails
+    in a stage goes no further.
+    """
+
+    # Marks the end of a stage's input.
+    END = object()
+
+    def __init__(self, queue_size=64):
+        self.queue_size = queue_size
+        self.stages = []
+
+    def add_stage(self, name, func, workers=1):
+        self.stages.append(PipelineStage(name, func, workers))
+
+    def run(self, items, done=None):
+        """Runs every item through the stages.
+
+        done, if given, is called from the calling thread with (item, result,
+        error, stage name) as every item leaves the pipeline, either having
+        gone through the last stage or having failed in the named stage.
+        Returns a list of those tuples in the same order as items.
+        """
+        items = list(items)
+        inputs = [queue.Queue(self.queue_size) for stage in self.stages]
+        finished = queue.Queue()
+        threads = []
+
+        def feed():
+            for index, item in enumerate(items):
+                inputs[0].put((index, item, item))
+
+            inputs[0].put(self.END)
+
+        threads.append(threading.Thread(target=feed))
+
+        for i, stage in enumerate(self.stages):
+            output = inputs[i + 1] if i + 1 < len(self.stages) else finished
+
+            for worker in range(stage.workers):
+                threads.append(threading.Thread(target=self.work,
+                                                args=(stage, inputs[i], output, finished)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        results = [None] * len(items)
+        last = self.stages[-1].name
+
+        while True:
+            entry = finished.get()
+
+            if entry is self.END:
+                break
+
+            if len(entry) == 3:
+                index, item, value = entry
+                result = (item, value, None, last)
+            else:
+                index, item, value, error, stage_name = entry
+                result = (item, None, error, stage_name)
+
+            results[index] = result
+
+            if done is not None:
+                done(*result)
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def work(self, stage, input, output, finished):
+        while True:
+            entry = input.get()
+
+            if entry is self.END:
+                # Leave the marker for the stage's other workers, and pass it
+                # on once they've all stopped.
+                input.put(self.END)
+
+                with stage.lock:
+                    stage.running -= 1
+                    last_worker = stage.running == 0
+
+                    if last_worker:
+                        stage.finished = time.time()
+
+                if last_worker:
+                    output.put(self.END)
+
+                return
+
+            with stage.lock:
+                if stage.started is None:
+                    stage.started = time.time()
+
+            index, item, value = entry
+
+            try:
+                value = stage.func(value)
+            except Exception as e:
+                finished.put((index, item, None, e, stage.name))
+                continue
+
+            with stage.lock:
+                stage.items += 1
+
+            output.put((index, item, value))
+
+    def stage_seconds(self):
+        """Returns (name, seconds, items) of every stage, in order.
+        """
+        return [(stage.name, stage.seconds, stage.items) for stage in self.stages]
@@ -0,0 +1,61 @@
+import os
+
+from collections import OrderedDict
+
+from odkim_rotate.dns.provider import find_zone
+from odkim_rotate.key_table import *
+
+class Preflight:
+    """Finds the KeyTable entries a rotation would fail for, before any key
+    is generated for them.
+
+    The zones the DNS provider hosts are listed once, and every entry's
+    domain, or one of its parent domains, has to be among them. Should some
+    not be, the zones are listed again in case the provider had cached them.
+    The directory every entry's key is to be installed in has to be
+    writable, and each directory is only checked once.
+    """
+
+    def __init__(self, dns_provider):
+        self.dns_provider = dns_provider
+
+    def check(self, entries, key_directory=None):
+        """Returns an OrderedDict of short name to problem for the (short
+        name, values) pairs that would fail.
+
+        key_directory, if given, is called with an entry's values and returns
+        the directory its key will be installed in, or None if it can't be
+        checked from this host.
+        """
+        problems = OrderedDict()
+        zones = self.dns_provider.hosted_zones()
+
+        if zones is not None:
+            if any(find_zone(values[KeyTable.DOMAIN], zones) is None
+                   for short_name, values in entries):
+                zones = self.dns_provider.hosted_zones(True)
+
+            for short_name, values in entries:
+                if find_zone(values[KeyTable.DOMAIN], zones) is None:
+                    problems[short_name] = 'the DNS provider hosts no zone for {}'.format(
+                        values[KeyTable.DOMAIN])
+
+        if key_directory is not None:
+            writable = {}
+
+            for short_name, values in entries:
+                directory = key_directory(values)
+
+                if short_name in problems or directory is None:
+                    continue
+
+                if directory not in writable:
+                    writable[directory] = self.writable(directory)
+
+                if not writable[directory]:
+                    problems[short_name] = 'key directory {} is not writable'.format(directory)
+
+        return problems
+
+    def writable(self, directory):
+        return os.path.isdir(directory) and os.access(directory, os.W_OK | os.X_OK)
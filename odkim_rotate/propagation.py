@@ -0,0 +1,164 @@
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from odkim_rotate.concurrency import map_concurrently
+from odkim_rotate.dns.resolver import *
+
+def normalize_txt_value(value):
+    """Removes whitespace so that records differing only in spacing match.
+    """
+    return ''.join(value.split())
+
+class PropagationChecker:
+    """Waits for newly created DKIM TXT records to be visible in DNS.
+
+    Every pending record is looked up on every resolver, with several
+    lookups in flight at once. Records are rechecked with an exponential
+    backoff until all of them resolve to their expected value on all
+    resolvers, or the deadline passes.
+    """
+
+    # Marks the end of the records passed to wait_stream.
+    END = object()
+
+    def __init__(self, resolvers, deadline=3600, initial_delay=5,
+                 max_delay=300, jobs=16, query_timeout=2.0):
+        self.resolvers = resolvers
+
+        # Seconds to wait in total before giving up.
+        self.deadline = deadline
+
+        # Seconds to wait before rechecking, doubling every time up to
+        # max_delay.
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+
+        self.jobs = jobs
+        self.query_timeout = query_timeout
+
+    def is_propagated(self, record):
+        """Returns True if every resolver answers with the record's value.
+        """
+        name = '{}._domainkey.{}'.format(record.selector, record.domain)
+        expected = normalize_txt_value(record.value)
+
+        for resolver in self.resolvers:
+            try:
+                values = query_txt(name, resolver, self.query_timeout)
+            except DnsQueryError:
+                return False
+
+            if expected not in [normalize_txt_value(v) for v in values]:
+                return False
+
+        return True
+
+    def wait(self, records, progress=None, propagated=None):
+        """Waits for the TxtRecords to propagate.
+
+        progress, if given, is called with the number of records still
+        pending after each round of checks. propagated, if given, is called
+        with every record and the seconds it took to propagate once it has.
+        Returns the records that still hadn't propagated when the deadline
+        passed; an empty list means every record propagated.
+        """
+        return self.wait_stream(iter(records), progress, propagated)
+
+    def wait_stream(self, records, progress=None, propagated=None, stop=None):
+        """Like wait, but takes records from an iterator as they arrive, e.g.
+        while they're still being published.
+
+        Every record gets the full deadline from its arrival, and the backoff
+        starts over whenever new records arrive. Returns once the iterator is
+        exhausted and every record has propagated or timed out, or as soon
+        as stop, a threading.Event, is set, with every record not yet seen
+        to propagate among the stragglers.
+        """
+        if stop is None:
+            stop = threading.Event()
+
+        arrived = queue.Queue()
+
+        def feed():
+            try:
+                for record in records:
+                    arrived.put(record)
+            finally:
+                arrived.put(self.END)
+
+        feeder = threading.Thread(target=feed)
+        feeder.daemon = True
+        feeder.start()
+
+        # (record, time it arrived) pairs.
+        pending = []
+        stragglers = []
+        delay = self.initial_delay
+        exhausted = False
+
+        while not stop.is_set():
+            arrivals = []
+
+            # With nothing left to check, block until more records arrive.
+            if not pending and not exhausted:
+                try:
+                    arrivals.append(arrived.get(timeout=self.initial_delay))
+                except queue.Empty:
+                    continue
+
+            arrivals.extend(self.drain(arrived))
+
+            if arrivals and arrivals[-1] is self.END:
+                arrivals.pop()
+                exhausted = True
+
+            if arrivals:
+                pending.extend((record, time.time()) for record in arrivals)
+                delay = self.initial_delay
+
+            if pending:
+                results = map_concurrently(self.is_propagated,
+                                           [record for record, start in pending], self.jobs)
+                still_pending = []
+
+                for (record, start), (_, visible, error) in zip(pending, results):
+                    if visible:
+                        if propagated is not None:
+                            propagated(record, time.time() - start)
+                    elif time.time() + delay > start + self.deadline:
+                        stragglers.append(record)
+                    else:
+                        still_pending.append((record, start))
+
+                pending = still_pending
+
+                if progress is not None:
+                    progress(len(pending))
+
+            if exhausted and not pending:
+                break
+
+            if pending:
+                stop.wait(delay)
+                delay = min(delay * 2, self.max_delay)
+
+        if stop.is_set():
+            stragglers.extend(record for record, start in pending)
+            stragglers.extend(record for record in self.drain(arrived)
+                              if record is not self.END)
+
+        return stragglers
+
+    def drain(self, arrived):
+        records = []
+
+        while True:
+            try:
+                records.append(arrived.get_nowait())
+            except queue.Empty:
+                return records
@@ -0,0 +1,100 @@
+import datetime
+import fnmatch
+import os
+import re
+
+from odkim_rotate.key_table import *
+
+def selector_date(selector):
+    """Returns the date a selector created by this script was generated on,
+    or None if it doesn't start with one.
+    """
+    try:
+        return datetime.datetime.strptime(selector[:8], '%Y%m%d')
+    except ValueError:
+        return None
+
+# Selectors as this script generates them, the date followed by microseconds.
+ISSUED_SELECTOR = re.compile(r'^\d{14}$')
+
+def issued_selector_date(selector):
+    """Returns the date a selector was generated on if it has exactly the
+    form this script generates, or None for any other selector, even one that
+    starts with a date, e.g. that of a third-party sender.
+    """
+    if not ISSUED_SELECTOR.match(selector):
+        return None
+
+    return selector_date(selector)
+
+class EntrySelector:
+    """Chooses which KeyTable entries to rotate.
+
+    Entries are matched against shell-style patterns on either their short
+    name or domain. An entry is selected when it matches one of the include
+    patterns (or there are none), matches none of the exclude patterns, and
+    its key is at least older_than_days old. At most limit entries are
+    selected, oldest keys first, so that repeated runs work through a large
+    KeyTable a batch at a time.
+    """
+
+    def __init__(self, include=None, exclude=None, older_than_days=None,
+                 limit=None):
+        self.include = include or []
+        self.exclude = exclude or []
+        self.older_than_days = older_than_days
+        self.limit = limit
+
+    def key_date(self, values):
+        """Returns when the entry's key was created, or None if unknown.
+
+        Selectors created by this script start with the date the key was
+        generated. Otherwise the modification time of the private key is
+        used.
+        """
+        key_date = selector_date(values[KeyTable.SELECTOR])
+
+        if key_date is not None:
+            return key_date
+
+        try:
+            return datetime.datetime.fromtimestamp(
+                os.path.getmtime(values[KeyTable.PRIVATE_KEY]))
+        except OSError:
+            return None
+
+    def matches(self, patterns, short_name, values):
+        return any(fnmatch.fnmatch(short_name, pattern) or
+                   fnmatch.fnmatch(values[KeyTable.DOMAIN], pattern)
+                   for pattern in patterns)
+
+    def select(self, keytable, now=None):
+        """Returns the selected (short name, values) pairs in KeyTable order.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+
+        candidates = []
+
+        for index, (short_name, values) in enumerate(keytable):
+            if self.include and not self.matches(self.include, short_name, values):
+                continue
+
+            if self.matches(self.exclude, short_name, values):
+                continue
+
+            key_date = self.key_date(values)
+
+            # Keys of unknown age are treated as old enough to rotate.
+            if self.older_than_days is not None and key_date is not None and \
+                    (now - key_date).days < self.older_than_days:
+                continue
+
+            candidates.append((key_date or datetime.datetime.min, index,
+                               short_name, values))
+
+        if self.limit is not None:
+            candidates = sorted(candidates)[:self.limit]
+
+        return [(short_name, values) for key_date, index, short_name, values
+                in sorted(candidates, key=lambda candidate: candidate[1])]
@@ -0,0 +1,139 @@
+import re
+import sqlite3
+
+from collections import OrderedDict
+
+from odkim_rotate.key_table import *
+
+class DataSourceName:
+    """OpenDKIM SQL data set name.
+
+    Has the form
+    "dsn:backend://[user[:pwd]@][port+]host/dbase[/key=val[?key=val...]]".
+    The "table", "keycol" and "datacol" keys name the table, the column of
+    short names and the domain, selector and private key columns. For the
+    sqlite3 backend dbase is the path to the database file, relative to "/".
+
+    See "DATA SETS" in http://www.opendkim.org/opendkim.conf.5.html
+    """
+
+    PATTERN = re.compile(r'^dsn:(?P<backend>\w+)://'
+                         r'(?:(?P<user>[^:@/]*)(?::(?P<password>[^@/]*))?@)?'
+                         r'(?:(?P<port>\d+)\+)?(?P<host>[^/]*)'
+                         r'/(?P<rest>.*)$')
+
+    def __init__(self, dsn):
+        match = self.PATTERN.match(dsn)
+
+        if match is None:
+            raise ValueError("Invalid data set name '{}'".format(dsn))
+
+        self.backend = match.group('backend')
+        self.user = match.group('user')
+        self.password = match.group('password')
+        self.host = match.group('host')
+        self.port = match.group('port')
+
+        # Options are the last path component, when it has a "=" in it.
+        dbase, _, options = match.group('rest').rpartition('/')
+
+        if '=' not in options:
+            dbase, options = match.group('rest'), ''
+
+        self.dbase = dbase
+        self.options = dict(option.split('=', 1) for option in options.split('?') if option)
+
+class SqlKeyTable(BaseKeyTable):
+    """KeyTable dataset stored in an SQL database.
+
+    Entries are read in batches through a cursor rather than all at once.
+    Saving updates the selector and private key of changed entries in a
+    single transaction, so that OpenDKIM sees either all or none of them.
+
+    Only the sqlite3 backend is supported, using the sqlite3 module.
+    """
+
+    # Number of rows fetched from the database at a time.
+    BATCH_SIZE = 1000
+
+    # Columns used when the data set name doesn't say otherwise.
+    DEFAULT_TABLE = 'keytable'
+    DEFAULT_KEY_COLUMN = 'id'
+    DEFAULT_DATA_COLUMNS = 'domain,selector,private_key'
+
+    IDENTIFIER = re.compile(r'^\w+$')
+
+    def __init__(self, dsn):
+        self.dsn = DataSourceName(dsn)
+        self.entries = {}
+        self.original_conf_file = {}
+        self.saved = False
+
+        # Short name to the value of its key column, which needn't be text.
+        self.keys = {}
+
+        if self.dsn.backend != 'sqlite3':
+            raise ValueError("Unsupported KeyTable database backend '{}'".format(
+                self.dsn.backend))
+
+        self.table = self.identifier(self.dsn.options.get('table', self.DEFAULT_TABLE))
+        self.key_column = self.identifier(self.dsn.options.get('keycol',
+                                                               self.DEFAULT_KEY_COLUMN))
+        self.data_columns = [self.identifier(column) for column in
+                             self.dsn.options.get('datacol',
+                                                  self.DEFAULT_DATA_COLUMNS).split(',')]
+
+        if len(self.data_columns) != 3:
+            raise ValueError('KeyTable datacol must name the domain, selector and '
+                             'private key columns')
+
+        self.connection = sqlite3.connect('/' + self.dsn.dbase.lstrip('/'))
+
+        cursor = self.connection.execute('SELECT {}, {} FROM {} ORDER BY {}'.format(
+            self.key_column, ', '.join(self.data_columns), self.table, self.key_column))
+
+        # Short names are always text, e.g. for an INTEGER key column, so that
+        # they aren't taken for positions when indexing. Entries are ordered
+        # by the key column's own values.
+        self.entries = OrderedDict()
+
+        while True:
+            rows = cursor.fetchmany(self.BATCH_SIZE)
+
+            if not rows:
+                break
+
+            for key, domain, selector, private_key in rows:
+                short_name = key if isinstance(key, TEXT_TYPES) else str(key)
+                values = KeyTableEntry(domain, selector, private_key)
+                self.entries[short_name] = values
+                self.original_conf_file[short_name] = values.copy()
+                self.keys[short_name] = key
+
+        self.short_names = list(self.entries)
+
+    def identifier(self, name):
+        if not self.IDENTIFIER.match(name):
+            raise ValueError("Invalid KeyTable column or table name '{}'".format(name))
+        return '"{}"'.format(name)
+
+    def save_changes(self):
+        self.write_entries(self.entries)
+        self.saved = True
+
+    def revert_changes(self):
+        if self.saved:
+            self.write_entries(self.original_conf_file)
+            self.saved = False
+
+    def write_entries(self, entries):
+        sql = 'UPDATE {} SET {} = ?, {} = ? WHERE {} = ?'.format(
+            self.table, self.data_columns[1], self.data_columns[2], self.key_column)
+
+        rows = [(entries[short_name][self.SELECTOR], entries[short_name][self.PRIVATE_KEY],
+                 self.keys[short_name]) for short_name in self.changed_entries()]
+
+        # The connection as a context manager commits, or rolls back if any
+        # update fails.
+        with self.connection:
+            self.connection.executemany(sql, rows)
@@ -2,13 +2,30 @@ from __future__ import print_function
 
 import subprocess
 
+from odkim_rotate.atomic_file import *
+from odkim_rotate.concurrency import *
 from odkim_rotate.dns.linode_provider import *
+from odkim_rotate.dns.local_provider import *
+from odkim_rotate.dns.registry import *
+from odkim_rotate.fleet.installer import *
+from odkim_rotate.fleet.local_transport import *
+from odkim_rotate.fleet.ssh_transport import *
+from odkim_rotate.keygen.opendkim_generator import *
+from odkim_rotate.keygen.pool import *
+from odkim_rotate.keygen.python_generator import *
+from odkim_rotate.metrics import *
+from odkim_rotate.opendkim_config import *
+from odkim_rotate.sql_key_table import *
+from odkim_rotate.verify.dns_verifier import *
+from odkim_rotate.verify.opendkim_verifier import *
 
 def toggle_services(stop):
     action = 'stop' if stop else 'start'
     postfix_options = ['systemctl', action, 'postfix']
     opendkim_options = ['systemctl', action, 'opendkim']
 
+    counters.increment(Counters.SUBPROCESSES, 2)
+
     if stop:
         print_header('Stopping services...')
         print('Stopping Postfix...')
@@ -22,6 +39,16 @@ def toggle_services(stop):
         print('Starting Postfix...')
         subprocess.check_call(postfix_options)
 
+def reload_opendkim():
+    """Asks OpenDKIM to reload its configuration, KeyTable and keys.
+
+    OpenDKIM carries on signing with the old configuration until the reload
+    is complete, so no mail is refused.
+    """
+    print_header('Reloading OpenDKIM...')
+    counters.increment(Counters.SUBPROCESSES)
+    subprocess.check_call(['systemctl', 'reload', 'opendkim'])
+
 def print_verbose(message):
     print('\x1b[1;30;40m{}\x1b[0m'.format(message))
 
@@ -34,33 +61,75 @@ def print_error(message):
 def get_keytable_path(opendkim_conf):
     """Returns the path to the KeyTable file from the OpenDKIM config.
     """
-    param = 'KeyTable'
+    return load_opendkim_config(opendkim_conf).require('KeyTable')
+
+def open_keytable(dataset):
+    """Returns the KeyTable for an OpenDKIM data set, either a file or a
+    "dsn:" SQL database.
+    """
+    if dataset.startswith('dsn:'):
+        return SqlKeyTable(dataset)
 
-    with open(opendkim_conf, 'r') as f:
-        for line in f:
-            if line.startswith(param):
-                return line.replace(param, '').strip()
+    return KeyTable(dataset)
 
-    msg = "Could not find '{}' parameter in OpenDKIM config at {}".format(param, opendkim_conf)
-    raise RuntimeError(msg)
+def create_dns_provider(dns_provider, concurrency=DnsProvider.concurrency,
+                        domain_cache=None, **options):
+    """Factory method to generate a DNS provider to create entries at.
 
-def scrub_txt_record(txt_value):
-    txt = ''
+    Providers are looked up in the registry, which holds the built in ones
+    and any installed packages add through entry points. options are passed
+    on to the provider's factory.
+    """
+    factory = get_dns_provider_factory(dns_provider)
+    return factory(concurrency, domain_cache, **options)
 
-    for line in txt_value.strip().split('\n'):
-        first = line.index('"') + 1
-        last = line.rindex('"')
-        txt += line[first:last]
+def create_linode_provider(concurrency, domain_cache=None, **options):
+    return LinodeDnsProvider(concurrency, domain_cache)
 
-    return txt
+def create_local_provider(concurrency, domain_cache=None, zone_dir=None, **options):
+    return LocalDnsProvider(concurrency, zone_dir)
 
-def create_dns_provider(dns_provider):
-    """Factory method to generate a DNS provider to create entries at.
+register_dns_provider('linode', create_linode_provider)
+register_dns_provider('local', create_local_provider)
+
+def create_key_generator(key_generator, key_type, bits, verbose=False):
+    """Factory method to generate a key generator to create new keys with.
     """
 
-    if dns_provider == 'linode':
-        return LinodeDnsProvider()
+    if key_generator == 'opendkim':
+        return OpenDkimKeyGenerator(key_type, bits, verbose=verbose)
+    elif key_generator == 'python':
+        return PythonKeyGenerator(key_type, bits)
 
-    msg = "Unknown DNS provider '{}' specified".format(dns_provider)
+    msg = "Unknown key generator '{}' specified".format(key_generator)
     raise NameError(msg)
 
+def create_key_verifier(key_verifier, resolvers, verbose=False):
+    """Factory method to generate a key verifier to test new keys with.
+    """
+
+    if key_verifier == 'opendkim':
+        return OpenDkimKeyVerifier(verbose=verbose)
+    elif key_verifier == 'dns':
+        return DnsKeyVerifier(resolvers)
+
+    msg = "Unknown key verifier '{}' specified".format(key_verifier)
+    raise NameError(msg)
+
+def create_transport(node):
+    """Factory method to reach a fleet node given as "local:/path",
+    "ssh://[user@]host[:port]" or a bare ssh host name.
+    """
+
+    if node.startswith('local:'):
+        return LocalDirectoryTransport(node[len('local:'):])
+
+    if node.startswith('ssh://'):
+        node = node[len('ssh://'):]
+    elif '://' in node:
+        msg = "Unknown transport for node '{}' specified".format(node)
+        raise NameError(msg)
+
+    user, _, host = node.rpartition('@')
+    host, _, port = host.partition(':')
+    return SshTransport(host, user or None, int(port) if port else None)
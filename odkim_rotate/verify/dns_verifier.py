@@ -0,0 +1,80 @@
+import base64
+
+from odkim_rotate.dns.resolver import *
+from odkim_rotate.verify.verifier import *
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+except ImportError:
+    serialization = None
+
+def parse_dkim_record(txt_value):
+    """Returns the tags of a DKIM key record as a dictionary.
+    """
+    tags = {}
+
+    for tag in txt_value.split(';'):
+        name, _, value = tag.partition('=')
+
+        if name.strip():
+            tags[name.strip()] = ''.join(value.split())
+
+    return tags
+
+class DnsKeyVerifier(KeyVerifier):
+    """Verifies keys in-process by comparing the public key derived from the
+    private key with the one published in DNS.
+
+    Doesn't run a process for every key. Requires the cryptography package.
+    """
+
+    def __init__(self, resolvers, query_timeout=2.0):
+        if serialization is None:
+            raise RuntimeError("The 'cryptography' package is required to "
+                               'verify keys in-process')
+
+        self.resolvers = resolvers
+        self.query_timeout = query_timeout
+
+    def verify(self, domain, selector, private_key_path):
+        with open(private_key_path, 'rb') as f:
+            expected = self.encoded_public_key(f.read())
+
+        name = '{}._domainkey.{}'.format(selector, domain)
+
+        for resolver in self.resolvers:
+            try:
+                values = query_txt(name, resolver, self.query_timeout)
+            except DnsQueryError as e:
+                raise KeyVerificationError(str(e))
+
+            records = [parse_dkim_record(value) for value in values]
+            keys = [record.get('p', '') for record in records if record.get('v') == 'DKIM1']
+
+            if not keys:
+                raise KeyVerificationError('No DKIM key record found for {} on {}'.format(
+                    name, resolver))
+
+            if expected not in keys:
+                raise KeyVerificationError('Public key for {} on {} does not match '
+                                           'private key'.format(name, resolver))
+
+        return 'Public key for {} matches private key'.format(name)
+
+    def encoded_public_key(self, private_key_pem):
+        """Returns the base64 encoded public key as published in a DKIM record.
+        """
+        key = serialization.load_pem_private_key(private_key_pem, None)
+
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            public_key = key.public_key().public_bytes(serialization.Encoding.Raw,
+                                                       serialization.PublicFormat.Raw)
+        else:
+            public_key = key.public_key().public_bytes(serialization.Encoding.DER,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+
+        return base64.b64encode(public_key).decode('ascii')
+
+    def describe(self):
+        return 'in-process using ' + ', '.join(self.resolvers)
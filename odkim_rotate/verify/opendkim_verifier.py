@@ -0,0 +1,36 @@
+import subprocess
+
+from odkim_rotate.metrics import counters, Counters
+from odkim_rotate.verify.verifier import *
+
+class OpenDkimKeyVerifier(KeyVerifier):
+    """Verifies keys by running opendkim-testkey.
+    """
+
+    def __init__(self, testkey='/usr/bin/opendkim-testkey', verbose=False):
+        self.testkey = testkey
+        self.verbose = verbose
+
+    def verify(self, domain, selector, private_key_path):
+        options = [
+            self.testkey, \
+            '-d', domain, \
+            '-s', selector, \
+            '-k', private_key_path \
+        ]
+
+        if self.verbose:
+            options.append('-vvv')
+
+        try:
+            counters.increment(Counters.SUBPROCESSES)
+            output = subprocess.check_output(options, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            output = e.output.decode('utf-8', 'replace').strip()
+            raise KeyVerificationError('opendkim-testkey exited with status {}'.format(
+                e.returncode), output)
+
+        return output.decode('utf-8', 'replace').strip()
+
+    def describe(self):
+        return self.testkey
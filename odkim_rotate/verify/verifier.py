@@ -0,0 +1,24 @@
+class KeyVerificationError(RuntimeError):
+    """Raised when a key fails verification.
+    """
+
+    def __init__(self, message, output=''):
+        RuntimeError.__init__(self, message)
+
+        # Anything the verifier printed that explains the failure.
+        self.output = output
+
+class KeyVerifier:
+    """Checks that a private key matches the public key published in DNS.
+    """
+
+    def verify(self, domain, selector, private_key_path):
+        """Raises KeyVerificationError if the key doesn't verify.
+
+        Returns anything the verifier wants shown in verbose mode. Must be
+        safe to call from several threads at once.
+        """
+        raise NotImplementedError()
+
+    def describe(self):
+        raise NotImplementedError()
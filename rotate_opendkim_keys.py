@@ -1,36 +1,361 @@
 #!/usr/bin/env python
 
+import argparse
 import grp
+import json
+import multiprocessing
 import os
 import pwd
 import sys
 
+from odkim_rotate.cleanup import *
+from odkim_rotate.config_file import *
+from odkim_rotate.journal import *
 from odkim_rotate.key_table import *
 from odkim_rotate.manager import *
+from odkim_rotate.preflight import *
+from odkim_rotate.propagation import *
+from odkim_rotate.selection import *
 from odkim_rotate.utils import *
 
-def main(verbose):
-    manager = Manager(verbose)
-    manager.opendkim_conf = '/etc/opendkim.conf'
-    manager.opendkim_keys_basedir = '/etc/dkimkeys'
-    manager.opendkim_genkey = '/usr/bin/opendkim-genkey'
-    manager.opendkim_testkey = '/usr/bin/opendkim-testkey'
-    manager.key_owner = 'opendkim'
-    manager.key_owner_uid = pwd.getpwnam(manager.key_owner).pw_uid
-    manager.key_group = 'opendkim'
-    manager.key_group_gid = grp.getgrnam(manager.key_group).gr_gid
+FILL_POOL = 'fill-pool'
 
-    manager.dns_provider = create_dns_provider('linode')
-    manager.keytable_path = get_keytable_path(manager.opendkim_conf)
+# Subcommands and what they do. Without one the whole rotation is run.
+COMMANDS = [
+    ('rotate', 'run the whole rotation (default)'),
+    (Manager.GENERATE, 'generate keys for the selected entries'),
+    (Manager.PUBLISH, 'publish the DNS records of the generated keys'),
+    (Manager.WAIT, 'wait for the DNS records to propagate'),
+    (Manager.VERIFY, 'test the keys against DNS'),
+    (Manager.INSTALL, 'install the keys and update the KeyTable'),
+    (Manager.CLEANUP, 'delete DNS records of retired selectors'),
+    (FILL_POOL, 'generate keys ahead of time into --key-pool')
+]
 
-    manager.keytable = KeyTable(manager.keytable_path)
+def parse_args(argv):
+    # The config file provides the defaults for the remaining options, so it
+    # has to be known before they are parsed.
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument('--config')
+    config_args = config_parser.parse_known_args(argv)[0]
 
-    manager.rotate_keys()
+    parser = argparse.ArgumentParser(description='Rotate OpenDKIM keys.')
+    add_options(parser)
+
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND',
+                                       help='part of the rotation to run: ' +
+                                            ', '.join(name for name, help_text in COMMANDS))
+
+    for name, help_text in COMMANDS:
+        # Options can also follow the command. They only override those given
+        # before it when they're actually used.
+        subparser = subparsers.add_parser(name, help=help_text, description=help_text)
+        add_options(subparser)
+
+        for action in subparser._actions:
+            action.default = argparse.SUPPRESS
+
+    if config_args.config:
+        try:
+            parser.set_defaults(**read_config_file(config_args.config, parser))
+        except ValueError as e:
+            parser.error(str(e))
+
+    # Subcommands can't be optional on Python 2, so the default one is added
+    # when none is given. What's left once the options and their values are
+    # parsed starts with the command, if there is one.
+    options_parser = argparse.ArgumentParser(add_help=False)
+    add_options(options_parser)
+    remaining = options_parser.parse_known_args(argv)[1]
+
+    if not remaining or remaining[0] not in [name for name, help_text in COMMANDS]:
+        argv = list(argv) + ['rotate']
+
+    args = parser.parse_args(argv)
+
+    if args.wait_prompt and args.command in ['rotate', Manager.WAIT] and \
+            not args.dry_run and not sys.stdin.isatty():
+        parser.error('--wait-prompt needs a terminal; let the script check '
+                     'DNS instead when running unattended')
+
+    if args.command == Manager.CLEANUP and args.cleanup_grace is None:
+        parser.error('cleanup needs --cleanup-grace')
+
+    if args.command == FILL_POOL and args.key_pool is None:
+        parser.error('fill-pool needs --key-pool')
+
+    return args
+
+def add_options(parser):
+    parser.add_argument('--config', metavar='PATH',
+                        help='INI file with a [rotate] section to read '
+                             'options from, named as on the command line '
+                             'without the dashes, e.g. "dns-jobs = 16". '
+                             'Command line options take precedence')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='show how many domains would be rotated and '
+                             'estimate how long it would take, without '
+                             'generating keys or touching DNS or the KeyTable. '
+                             'The --metrics-json report of an earlier run, if '
+                             'there is one, makes the estimate more accurate')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show configuration and command output')
+    parser.add_argument('--opendkim-conf', default='/etc/opendkim.conf',
+                        metavar='PATH',
+                        help='OpenDKIM configuration to read the KeyTable, '
+                             'key directory and user from (default: '
+                             '/etc/opendkim.conf)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of keys to generate at once '
+                             '(default: number of CPUs)')
+    parser.add_argument('--dns-provider', choices=dns_provider_names(),
+                        default='linode',
+                        help='where to publish the new DNS records. The local '
+                             'provider keeps them in memory, or in zone files '
+                             'with --zone-dir (default: linode)')
+    parser.add_argument('--zone-dir', metavar='PATH',
+                        help='directory the local DNS provider writes a '
+                             '<domain>.zone file to for every domain')
+    parser.add_argument('--dns-jobs', type=int, default=DnsProvider.concurrency,
+                        help='number of DNS records to create at once '
+                             '(default: {})'.format(DnsProvider.concurrency))
+    parser.add_argument('--domain-cache', metavar='PATH',
+                        help='file to keep the DNS provider\'s domain IDs in '
+                             'between runs, e.g. '
+                             '/var/cache/odkim-rotate/domains.json')
+    parser.add_argument('--domain-cache-ttl', type=int, default=86400,
+                        metavar='SECONDS',
+                        help='age after which the domain cache is ignored '
+                             '(default: 86400)')
+    parser.add_argument('--resolver', action='append', metavar='ADDRESS',
+                        help='nameserver to check for the new DNS records, as '
+                             'host or host:port; may be repeated. Using the '
+                             'DNS provider\'s own nameservers avoids waiting '
+                             'on cached answers (default: nameservers in '
+                             '/etc/resolv.conf)')
+    parser.add_argument('--propagation-timeout', type=int, default=3600,
+                        metavar='SECONDS',
+                        help='time to wait for the new DNS records to '
+                             'propagate before giving up (default: 3600)')
+    parser.add_argument('--wait-prompt', action='store_true',
+                        help='ask before continuing rather than checking '
+                             'that the new DNS records have propagated')
+    parser.add_argument('--verify-jobs', type=int, default=16,
+                        help='number of keys to test at once (default: 16)')
+    parser.add_argument('--key-verifier', choices=['opendkim', 'dns'],
+                        default='opendkim',
+                        help='run opendkim-testkey for every key or compare '
+                             'the keys with DNS in-process (default: opendkim)')
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                        help='only rotate entries whose short name or domain '
+                             'matches the shell-style pattern; may be repeated')
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                        help='skip entries whose short name or domain matches '
+                             'the shell-style pattern; may be repeated')
+    parser.add_argument('--older-than', type=int, metavar='DAYS',
+                        help='only rotate keys at least this many days old')
+    parser.add_argument('--limit', type=int, metavar='COUNT',
+                        help='rotate at most this many entries, oldest keys '
+                             'first')
+    parser.add_argument('--state-dir', default='/var/lib/odkim-rotate',
+                        metavar='PATH',
+                        help='directory to keep the keys and progress of a '
+                             'rotation in until it finishes, so that an '
+                             'interrupted rotation can be resumed (default: '
+                             '/var/lib/odkim-rotate)')
+    parser.add_argument('--discard-unfinished', action='store_true',
+                        help='start a new rotation rather than resuming an '
+                             'unfinished one')
+    parser.add_argument('--install-mode', choices=Manager.INSTALL_MODES,
+                        default=Manager.RESTART,
+                        help='stop Postfix and OpenDKIM while replacing keys, '
+                             'or install keys next to the old ones and reload '
+                             'OpenDKIM without stopping anything (default: '
+                             'restart)')
+    parser.add_argument('--cleanup-grace', type=int, metavar='DAYS',
+                        help='after installing, delete the DNS records of '
+                             'selectors replaced at least this many days ago '
+                             '(default: keep old records)')
+    parser.add_argument('--cleanup-batch-size', type=int,
+                        default=DnsProvider.delete_batch_size, metavar='COUNT',
+                        help='number of DNS records to delete per batch '
+                             '(default: {})'.format(DnsProvider.delete_batch_size))
+    parser.add_argument('--metrics-json', metavar='PATH',
+                        help='write the duration of every phase and domain, '
+                             'and the number of processes started and API '
+                             'requests made, to this file as JSON')
+    parser.add_argument('--metrics-textfile', metavar='PATH',
+                        help='write the same metrics in the Prometheus text '
+                             'format, e.g. for node_exporter\'s textfile '
+                             'collector at /var/lib/node_exporter/'
+                             'odkim_rotate.prom')
+    parser.add_argument('--node', action='append', metavar='NODE',
+                        help='install the keys on this OpenDKIM node instead '
+                             'of this host, as ssh://[user@]host[:port], a '
+                             'bare ssh host or local:DIRECTORY; may be '
+                             'repeated. Keys are generated and published '
+                             'once and every node is rolled back if any fails')
+    parser.add_argument('--node-keytable', metavar='PATH',
+                        help='KeyTable file on the nodes (default: the local '
+                             'KeyTable file)')
+    parser.add_argument('--node-key-dir', metavar='PATH',
+                        help='directory to install keys under on the nodes '
+                             '(default: the local key directory)')
+    parser.add_argument('--node-jobs', type=int, default=8,
+                        help='number of nodes to update at once (default: 8)')
+    parser.add_argument('--key-generator', choices=['opendkim', 'python'],
+                        default='opendkim',
+                        help='run opendkim-genkey for every key or generate '
+                             'keys in-process (default: opendkim)')
+    parser.add_argument('--key-type', choices=KeyGenerator.KEY_TYPES,
+                        default=KeyGenerator.RSA,
+                        help='type of key to generate (default: rsa)')
+    parser.add_argument('--bits', type=int, default=2048,
+                        help='size of RSA keys (default: 2048)')
+    parser.add_argument('--group-by-key-path', action='store_true',
+                        help='also give entries whose private keys are kept '
+                             'in the same file the same new key. Entries '
+                             'signing for the same domain always share one')
+    parser.add_argument('--key-pool', metavar='PATH',
+                        help='directory of keys generated ahead of time by '
+                             'fill-pool, e.g. /var/lib/odkim-rotate/pool. '
+                             'Rotations take keys from it and only generate '
+                             'keys once it\'s empty')
+    parser.add_argument('--key-pool-size', type=int, default=1000,
+                        metavar='COUNT',
+                        help='number of keys fill-pool keeps in the pool '
+                             '(default: 1000)')
+
+def main(args):
+    """Runs the rotation, or the part of it args.command names.
+
+    Returns True if it succeeded.
+    """
+    key_generator = create_key_generator(args.key_generator, args.key_type,
+                                         args.bits, args.verbose)
+
+    if args.key_pool:
+        pool = KeyPool(args.key_pool, args.key_type, args.bits)
+
+        if args.command == FILL_POOL:
+            return fill_key_pool(pool, key_generator, args.key_pool_size, args.jobs)
+
+        key_generator = PooledKeyGenerator(pool, key_generator)
+
+    manager = Manager(args.verbose, args.jobs, args.dns_jobs,
+                      args.verify_jobs)
+    manager.opendkim_config = load_opendkim_config(args.opendkim_conf)
+    manager.opendkim_conf = args.opendkim_conf
+    manager.opendkim_keys_basedir = manager.opendkim_config.key_directory('/etc/dkimkeys')
+    manager.install_mode = args.install_mode
+    manager.group_by_key_path = args.group_by_key_path
+    manager.metrics_json = args.metrics_json
+    manager.metrics_textfile = args.metrics_textfile
+    manager.key_generator = key_generator
+    key_owner, key_group = manager.opendkim_config.user_id
+    manager.key_owner = key_owner or 'opendkim'
+    owner = pwd.getpwnam(manager.key_owner)
+    manager.key_owner_uid = owner.pw_uid
+
+    if key_group is not None:
+        manager.key_group = key_group
+        manager.key_group_gid = grp.getgrnam(key_group).gr_gid
+    else:
+        manager.key_group_gid = owner.pw_gid
+        manager.key_group = grp.getgrgid(owner.pw_gid).gr_name
+
+    resolvers = args.resolver or read_resolv_conf()
+    manager.key_verifier = create_key_verifier(args.key_verifier, resolvers,
+                                               args.verbose)
+
+    manager.keytable_path = manager.opendkim_config.require('KeyTable')
+    manager.keytable = open_keytable(manager.keytable_path)
+    manager.entry_selector = EntrySelector(args.include, args.exclude,
+                                           args.older_than, args.limit)
+
+    if args.node:
+        nodes = [FleetNode(node, create_transport(node),
+                           args.node_keytable or manager.keytable_path,
+                           args.node_key_dir or manager.opendkim_keys_basedir)
+                 for node in args.node]
+        manager.fleet = FleetInstaller(nodes, args.node_jobs, manager.key_owner,
+                                       manager.key_group)
+
+    if args.cleanup_grace is not None:
+        manager.selector_cleaner = SelectorCleaner(None, args.cleanup_grace,
+                                                   args.dns_jobs, args.cleanup_batch_size)
+
+    if args.dry_run:
+        manager.dry_run(read_metrics_report(args.metrics_json))
+        return True
+
+    domain_cache = None
+
+    if args.domain_cache:
+        domain_cache = DomainCache(args.domain_cache, args.domain_cache_ttl)
+
+    manager.dns_provider = create_dns_provider(args.dns_provider, args.dns_jobs, domain_cache,
+                                               zone_dir=args.zone_dir)
+
+    manager.preflight = Preflight(manager.dns_provider)
+
+    if manager.selector_cleaner is not None:
+        manager.selector_cleaner.dns_provider = manager.dns_provider
+
+    if not args.wait_prompt:
+        manager.propagation_checker = PropagationChecker(resolvers,
+                                                         args.propagation_timeout)
+
+    manager.journal = Journal(args.state_dir)
+
+    if args.discard_unfinished and manager.journal.load():
+        manager.journal.finish()
+        manager.journal = Journal(args.state_dir)
+
+    if args.command == 'rotate':
+        return manager.rotate_keys()
+
+    return manager.rotate_keys([args.command])
+
+def fill_key_pool(pool, key_generator, size, jobs):
+    """Tops the pool up to size keys.
+
+    Returns True if it succeeded.
+    """
+    print_header('Filling {} with {} keys using {} jobs...'.format(
+        pool.path, key_generator.describe(), jobs))
+
+    def progress(added):
+        if added % 100 == 0:
+            print('{:,} keys added'.format(added))
+
+    try:
+        added = pool.fill(key_generator, size, jobs, progress)
+    except Exception as e:
+        print_error('Unable to generate key: ' + str(e))
+        return False
+
+    print('Added {:,} keys, {:,} in the pool'.format(added, pool.size()))
+    return True
+
+def read_metrics_report(path):
+    """Returns the metrics report at path, or None if there isn't one.
+    """
+    if path is None:
+        return None
+
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
 
 if __name__ == '__main__':
     if os.getenv('USER') != 'root':
         print('Error: script must be run as root')
         sys.exit(os.EX_USAGE)
 
-    main(len(sys.argv) == 2 and sys.argv[1] == '-v')
+    if not main(parse_args(sys.argv[1:])):
+        sys.exit(1)
 
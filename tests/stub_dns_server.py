@@ -0,0 +1,71 @@
+import socket
+import struct
+import threading
+
+class StubDnsServer:
+    """Minimal UDP nameserver answering TXT queries from a dictionary.
+
+    records maps names to lists of TXT values. A value may be a list of
+    strings to answer with multiple character-strings. Names not in records
+    get an NXDOMAIN response.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.queries = []
+        self.lock = threading.Lock()
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = '127.0.0.1:{}'.format(self.sock.getsockname()[1])
+
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.sock.close()
+
+    def serve(self):
+        while True:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except socket.error:
+                return
+
+            self.sock.sendto(self.answer(query), client)
+
+    def answer(self, query):
+        query_id = struct.unpack_from('!H', query)[0]
+
+        labels = []
+        offset = 12
+
+        while True:
+            length = struct.unpack_from('!B', query, offset)[0]
+
+            if length == 0:
+                break
+
+            labels.append(query[offset + 1:offset + 1 + length].decode('ascii'))
+            offset = offset + length + 1
+
+        question = query[12:offset + 5]
+        name = '.'.join(labels).lower()
+
+        with self.lock:
+            self.queries.append(name)
+            values = self.records.get(name)
+
+        if values is None:
+            return struct.pack('!HHHHHH', query_id, 0x8183, 1, 0, 0, 0) + question
+
+        answers = b''
+
+        for value in values:
+            strings = value if isinstance(value, list) else [value]
+            rdata = b''.join(struct.pack('!B', len(s)) + s.encode('ascii') for s in strings)
+            answers += struct.pack('!HHHIH', 0xC00C, 16, 1, 300, len(rdata)) + rdata
+
+        return struct.pack('!HHHHHH', query_id, 0x8180, 1, len(values), 0, 0) + \
+            question + answers
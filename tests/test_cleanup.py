@@ -0,0 +1,96 @@
+import datetime
+import unittest
+
+from odkim_rotate.cleanup import SelectorCleaner
+from odkim_rotate.dns.provider import DnsProvider, TxtRecord
+
+class FakeDnsProvider(DnsProvider):
+    def __init__(self, records):
+        self.records = records
+        self.deleted = []
+
+    def list_txt_records(self, domain):
+        if domain not in self.records:
+            raise KeyError('Domain {} not found'.format(domain))
+
+        return [TxtRecord(domain, selector, 'v=DKIM1', index)
+                for index, selector in enumerate(self.records[domain])]
+
+    def delete_txt_record(self, record):
+        if record.selector.endswith('locked'):
+            raise RuntimeError('Permission denied')
+
+        self.deleted.append((record.domain, record.selector))
+
+class SelectorCleanerTests(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2017, 7, 1)
+
+    def stale(self, records, live, grace_days=7):
+        cleaner = SelectorCleaner(FakeDnsProvider(records), grace_days)
+        stale, errors = cleaner.stale_records(live, self.now)
+
+        self.assertEqual([], errors)
+        return sorted((record.domain, record.selector) for record in stale)
+
+    def test_retired_past_grace(self):
+        records = {'example.com': ['20170101000000', '20170401000000', '20170628000000',
+                                   'mail']}
+        live = {'example.com': set(['20170628000000'])}
+
+        # The January selector was replaced in April. The April one was only
+        # replaced three days ago, and "mail" can't be dated.
+        self.assertEqual([('example.com', '20170101000000')], self.stale(records, live))
+
+    def test_grace_period(self):
+        records = {'example.com': ['20170101000000', '20170401000000', '20170628000000']}
+        live = {'example.com': set(['20170628000000'])}
+
+        self.assertEqual([('example.com', '20170101000000'),
+                          ('example.com', '20170401000000')],
+                         self.stale(records, live, grace_days=0))
+        self.assertEqual([], self.stale(records, live, grace_days=365))
+
+    def test_newer_than_live_kept(self):
+        records = {'example.com': ['20170101000000', '20170301000000', '20170601000000']}
+        live = {'example.com': set(['20170301000000'])}
+
+        self.assertEqual([('example.com', '20170101000000')], self.stale(records, live))
+
+    def test_every_live_selector_kept(self):
+        records = {'example.com': ['20170101000000', '20170301000000']}
+        live = {'example.com': set(['20170101000000', '20170301000000'])}
+
+        self.assertEqual([], self.stale(records, live, grace_days=0))
+
+    def test_foreign_selectors_kept(self):
+        # Selectors of other senders that merely start with a date.
+        records = {'example.com': ['20161025', '20170101abc', '201701010000001',
+                                   '20170101000000', '20170628000000']}
+        live = {'example.com': set(['20170628000000'])}
+
+        self.assertEqual([('example.com', '20170101000000')],
+                         self.stale(records, live, grace_days=0))
+
+    def test_list_errors(self):
+        cleaner = SelectorCleaner(FakeDnsProvider({'example.com': ['20170101000000']}), 0)
+        stale, errors = cleaner.stale_records({'example.com': set(['20170628000000']),
+                                               'missing.test': set(['20170628000000'])},
+                                              self.now)
+
+        self.assertEqual(['example.com'], [record.domain for record in stale])
+        self.assertEqual(['missing.test'], [domain for domain, error in errors])
+
+    def test_delete_in_batches(self):
+        provider = FakeDnsProvider({})
+        cleaner = SelectorCleaner(provider, jobs=2, batch_size=2)
+        records = [TxtRecord('example.com', selector, 'v=DKIM1')
+                   for selector in ['20170101', '20170102locked', '20170103']]
+        batches = []
+
+        results = cleaner.delete(records, batches.append)
+
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+        self.assertEqual([True, False, True], [result.succeeded for result in results])
+        self.assertEqual([('example.com', '20170101'), ('example.com', '20170103')],
+                         provider.deleted)
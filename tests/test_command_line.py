@@ -0,0 +1,27 @@
+import unittest
+
+from rotate_opendkim_keys import parse_args
+
+class ParseArgsTests(unittest.TestCase):
+    def test_default_command(self):
+        args = parse_args(['-v'])
+
+        self.assertEqual('rotate', args.command)
+        self.assertTrue(args.verbose)
+
+    def test_command_name_as_option_value(self):
+        args = parse_args(['--include', 'cleanup', '--state-dir', 'install'])
+
+        self.assertEqual('rotate', args.command)
+        self.assertEqual(['cleanup'], args.include)
+        self.assertEqual('install', args.state_dir)
+
+    def test_command(self):
+        args = parse_args(['--dns-jobs', '4', 'publish', '-v'])
+
+        self.assertEqual('publish', args.command)
+        self.assertEqual(4, args.dns_jobs)
+        self.assertTrue(args.verbose)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import tempfile
+import unittest
+
+from odkim_rotate.config_file import read_config_file
+
+class ReadConfigFileTests(unittest.TestCase):
+    def setUp(self):
+        self.parser = argparse.ArgumentParser()
+        self.parser.add_argument('--config')
+        self.parser.add_argument('-v', '--verbose', action='store_true')
+        self.parser.add_argument('--dns-jobs', type=int, default=8)
+        self.parser.add_argument('--resolver', action='append')
+        self.parser.add_argument('--install-mode', choices=['restart', 'reload'])
+
+        self.path = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def read(self, contents):
+        with open(self.path, 'w') as f:
+            f.write(contents)
+
+        return read_config_file(self.path, self.parser)
+
+    def test_options(self):
+        defaults = self.read('[rotate]\n'
+                             'verbose = yes\n'
+                             'dns-jobs = 16\n'
+                             'resolver = ns1.linode.com ns2.linode.com\n'
+                             'install_mode = reload\n')
+
+        self.assertEqual({'verbose': True, 'dns_jobs': 16,
+                          'resolver': ['ns1.linode.com', 'ns2.linode.com'],
+                          'install_mode': 'reload'}, defaults)
+
+    def test_command_line_wins(self):
+        self.parser.set_defaults(**self.read('[rotate]\ndns-jobs = 16\n'))
+
+        self.assertEqual(16, self.parser.parse_args([]).dns_jobs)
+        self.assertEqual(4, self.parser.parse_args(['--dns-jobs', '4']).dns_jobs)
+
+    def test_no_section(self):
+        self.assertEqual({}, self.read('[other]\nfoo = bar\n'))
+
+    def test_unknown_option(self):
+        self.assertRaises(ValueError, self.read, '[rotate]\nfoo = bar\n')
+        self.assertRaises(ValueError, self.read, '[rotate]\nconfig = /etc/other.conf\n')
+
+    def test_invalid_values(self):
+        self.assertRaises(ValueError, self.read, '[rotate]\ndns-jobs = many\n')
+        self.assertRaises(ValueError, self.read, '[rotate]\ninstall-mode = sometimes\n')
+        self.assertRaises(ValueError, self.read, '[rotate]\nverbose = perhaps\n')
+
+    def test_missing_file(self):
+        self.assertRaises(ValueError, read_config_file, self.path + '.missing', self.parser)
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+from odkim_rotate.fleet.installer import *
+from odkim_rotate.fleet.local_transport import LocalDirectoryTransport
+from odkim_rotate.fleet.ssh_transport import SshTransport
+from odkim_rotate.utils import create_transport
+
+KEY_TABLE = ('apple   apple.test:201701:/etc/dkimkeys/apple.private\n'
+             'banana  banana.test:201701:/etc/dkimkeys/banana.private\n')
+
+class FleetInstallerTests(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.nodes = [self.create_node('node{}'.format(i)) for i in range(3)]
+        self.keys = OrderedDict([('apple', b'apple key'), ('banana', b'banana key')])
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def create_node(self, name, reload_succeeds=True):
+        root = os.path.join(self.work_dir, name)
+        os.makedirs(os.path.join(root, 'etc', 'dkimkeys'))
+
+        with open(os.path.join(root, 'etc', 'dkimkeys', 'key.table'), 'w') as f:
+            f.write(KEY_TABLE)
+
+        reload_command = [sys.executable, '-c',
+                          'import sys; sys.exit({})'.format(0 if reload_succeeds else 1)]
+
+        return FleetNode(name, LocalDirectoryTransport(root), '/etc/dkimkeys/key.table',
+                         '/etc/dkimkeys', reload_command)
+
+    def read(self, node, path):
+        return node.transport.read_file(path).decode('utf-8')
+
+    def test_install(self):
+        results = FleetInstaller(self.nodes, 2).install('201801', self.keys)
+
+        self.assertEqual(['node0', 'node1', 'node2'], [result.node.name for result in results])
+        self.assertTrue(all(result.succeeded for result in results))
+
+        for node in self.nodes:
+            self.assertEqual('apple   apple.test:201801:/etc/dkimkeys/201801/apple.private',
+                             self.read(node, '/etc/dkimkeys/key.table').splitlines()[0])
+            self.assertEqual('banana key',
+                             self.read(node, '/etc/dkimkeys/201801/banana.private'))
+
+    def test_entries_missing_from_node_are_ignored(self):
+        results = FleetInstaller(self.nodes, 2).install(
+            '201801', OrderedDict([('cherry', b'cherry key')]))
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(KEY_TABLE, self.read(self.nodes[0], '/etc/dkimkeys/key.table'))
+
+    def test_staging_failure_changes_nothing(self):
+        os.unlink(os.path.join(self.work_dir, 'node1', 'etc', 'dkimkeys', 'key.table'))
+
+        results = FleetInstaller(self.nodes, 2).install('201801', self.keys)
+
+        self.assertFalse(any(result.succeeded for result in results))
+        self.assertIsNotNone(results[1].error)
+        self.assertIsNone(results[0].error)
+        self.assertEqual(FleetInstaller.ROLLED_BACK, results[0].phase)
+
+        for node in [self.nodes[0], self.nodes[2]]:
+            self.assertEqual(KEY_TABLE, self.read(node, '/etc/dkimkeys/key.table'))
+            self.assertFalse(os.path.exists(node.transport.local_path(
+                '/etc/dkimkeys/201801/apple.private')))
+
+    def test_reload_failure_rolls_back_every_node(self):
+        self.nodes[2] = self.create_node('broken', reload_succeeds=False)
+
+        results = FleetInstaller(self.nodes, 3).install('201801', self.keys)
+
+        self.assertFalse(any(result.succeeded for result in results))
+        self.assertIsNotNone(results[2].error)
+        self.assertEqual([FleetInstaller.ROLLED_BACK] * 2,
+                         [result.phase for result in results[:2]])
+
+        for node in self.nodes:
+            self.assertEqual(KEY_TABLE, self.read(node, '/etc/dkimkeys/key.table'))
+
+class CreateTransportTests(unittest.TestCase):
+    def test_local(self):
+        transport = create_transport('local:/srv/node1')
+
+        self.assertIsInstance(transport, LocalDirectoryTransport)
+        self.assertEqual('/srv/node1', transport.root)
+
+    def test_ssh(self):
+        transport = create_transport('ssh://root@mx1.test:2222')
+
+        self.assertIsInstance(transport, SshTransport)
+        self.assertEqual(('mx1.test', 'root', 2222),
+                         (transport.host, transport.user, transport.port))
+
+    def test_bare_host(self):
+        transport = create_transport('mx2.test')
+
+        self.assertEqual(('mx2.test', None, None),
+                         (transport.host, transport.user, transport.port))
+        self.assertEqual('ssh://mx2.test', transport.describe())
+
+    def test_unknown(self):
+        with self.assertRaises(NameError):
+            create_transport('ftp://mx1.test')
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from odkim_rotate.journal import Journal
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = os.path.join(tempfile.mkdtemp(), 'state')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.state_dir))
+
+    def test_no_journal(self):
+        self.assertFalse(Journal(self.state_dir).load())
+
+    def test_round_trip(self):
+        journal = Journal(self.state_dir)
+        journal.start('20170101', ['apple', 'banana'])
+        journal.record('apple', Journal.GENERATED, 'v=DKIM1; p=apple')
+        journal.record_many(['apple', 'banana'], Journal.PUBLISHED)
+
+        self.assertTrue(os.path.isdir(journal.scratch_dir))
+
+        loaded = Journal(self.state_dir)
+
+        self.assertTrue(loaded.load())
+        self.assertEqual('20170101', loaded.selector)
+        self.assertEqual(['apple', 'banana'], loaded.short_names)
+        self.assertTrue(loaded.done('apple', Journal.GENERATED))
+        self.assertTrue(loaded.done('banana', Journal.PUBLISHED))
+        self.assertFalse(loaded.done('banana', Journal.GENERATED))
+        self.assertEqual({'apple': 'v=DKIM1; p=apple'}, loaded.txt_values)
+
+    def test_non_ascii(self):
+        journal = Journal(self.state_dir)
+        journal.start('20170101', [u'b\u00fccher'])
+        journal.record(u'b\u00fccher', Journal.GENERATED, u'v=DKIM1; n=\u00fc')
+
+        loaded = Journal(self.state_dir)
+
+        self.assertTrue(loaded.load())
+        self.assertEqual([u'b\u00fccher'], loaded.short_names)
+        self.assertEqual({u'b\u00fccher': u'v=DKIM1; n=\u00fc'}, loaded.txt_values)
+
+    def test_truncated_last_line(self):
+        journal = Journal(self.state_dir)
+        journal.start('20170101', ['apple'])
+        journal.record('apple', Journal.GENERATED, 'v=DKIM1; p=apple')
+
+        with open(journal.path, 'a') as f:
+            f.write('{"short_name": "apple", "pha')
+
+        loaded = Journal(self.state_dir)
+
+        self.assertTrue(loaded.load())
+        self.assertTrue(loaded.done('apple', Journal.GENERATED))
+        self.assertFalse(loaded.done('apple', Journal.PUBLISHED))
+
+    def test_drop(self):
+        journal = Journal(self.state_dir)
+        journal.start('20170101', ['apple', 'banana', 'cherry'])
+        journal.drop(['banana'])
+
+        self.assertEqual(['apple', 'cherry'], journal.short_names)
+
+        loaded = Journal(self.state_dir)
+        loaded.load()
+        self.assertEqual(['apple', 'cherry'], loaded.short_names)
+
+    def test_finish(self):
+        journal = Journal(self.state_dir)
+        journal.start('20170101', ['apple'])
+        journal.finish()
+
+        self.assertFalse(os.path.exists(journal.scratch_dir))
+        self.assertFalse(Journal(self.state_dir).load())
@@ -0,0 +1,49 @@
+import unittest
+
+from odkim_rotate.dns.provider import TxtRecord
+from odkim_rotate.key_groups import group_entries, group_records
+from odkim_rotate.key_table import KeyTableEntry
+
+def entry(short_name, domain, private_key):
+    return short_name, KeyTableEntry(domain, '20170101', private_key)
+
+class GroupEntriesTests(unittest.TestCase):
+    def setUp(self):
+        self.entries = [entry('a', 'example.com', '/keys/a.private'),
+                        entry('b', 'example.org', '/keys/shared.private'),
+                        entry('c', 'Example.com', '/keys/c.private'),
+                        entry('d', 'example.net', '/keys/shared.private'),
+                        entry('e', 'example.edu', '/keys/e.private')]
+
+    def names(self, groups):
+        return [[short_name for short_name, values in group] for group in groups]
+
+    def test_by_domain(self):
+        self.assertEqual([['a', 'c'], ['b'], ['d'], ['e']],
+                         self.names(group_entries(self.entries)))
+
+    def test_by_key_path(self):
+        self.assertEqual([['a', 'c'], ['b', 'd'], ['e']],
+                         self.names(group_entries(self.entries, True)))
+
+    def test_chained(self):
+        # b and d share nothing directly, only through c.
+        entries = [entry('a', 'one.test', '/keys/a'),
+                   entry('b', 'two.test', '/keys/b'),
+                   entry('c', 'one.test', '/keys/b'),
+                   entry('d', 'three.test', '/keys/a')]
+
+        self.assertEqual([['a', 'b', 'c', 'd']], self.names(group_entries(entries, True)))
+
+class GroupRecordsTests(unittest.TestCase):
+    def test_group_records(self):
+        records = [('a', TxtRecord('example.com', 'sel', 'p=1')),
+                   ('b', TxtRecord('example.org', 'sel', 'p=1')),
+                   ('c', TxtRecord('EXAMPLE.com', 'sel', 'p=1')),
+                   ('d', TxtRecord('example.com', 'sel', 'p=2'))]
+
+        groups = group_records(records)
+
+        self.assertEqual([['a', 'c'], ['b'], ['d']],
+                         [short_names for short_names, record in groups])
+        self.assertIs(records[0][1], groups[0][1])
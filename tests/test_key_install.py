@@ -0,0 +1,167 @@
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from odkim_rotate import key_install
+from odkim_rotate.key_install import KeyInstaller
+
+class KeyInstallerTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.scratch_dir = os.path.join(self.tmp_dir, 'scratch')
+        self.key_dir = os.path.join(self.tmp_dir, 'keys')
+        os.mkdir(self.scratch_dir)
+        os.mkdir(self.key_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, path, data):
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def read(self, path):
+        with open(path, 'r') as f:
+            return f.read()
+
+    def make_installer(self, names):
+        keys = []
+
+        for name in names:
+            source = os.path.join(self.scratch_dir, name + '.private')
+            self.write(source, name + ' key')
+            keys.append((source, os.path.join(self.key_dir, name + '.private')))
+
+        return KeyInstaller(keys, os.getuid(), os.getgid())
+
+    def staging_dir(self):
+        return os.path.join(self.key_dir, KeyInstaller.STAGING_DIR)
+
+    def test_install(self):
+        self.write(os.path.join(self.key_dir, 'example.private'), 'old key')
+        installer = self.make_installer(['example', 'other'])
+
+        installer.stage()
+
+        # Nothing is installed until install.
+        self.assertEqual('old key', self.read(os.path.join(self.key_dir, 'example.private')))
+        self.assertFalse(os.path.exists(os.path.join(self.key_dir, 'other.private')))
+
+        installer.install()
+        installer.cleanup()
+
+        for name in ['example', 'other']:
+            path = os.path.join(self.key_dir, name + '.private')
+            st = os.stat(path)
+
+            self.assertEqual(name + ' key', self.read(path))
+            self.assertEqual(0o600, stat.S_IMODE(st.st_mode))
+            self.assertEqual(os.getuid(), st.st_uid)
+
+        self.assertEqual(2, installer.linked)
+        self.assertEqual(0, installer.copied)
+        self.assertFalse(os.path.exists(self.staging_dir()))
+
+        # The keys installed are left in place.
+        self.assertEqual('example key',
+                         self.read(os.path.join(self.scratch_dir, 'example.private')))
+
+    def test_staged_keys_synced(self):
+        installer = self.make_installer(['example', 'other'])
+
+        with mock.patch('odkim_rotate.key_install.os.fsync') as fsync:
+            installer.stage()
+
+            # Every key, then the staging directory once.
+            self.assertEqual(3, fsync.call_count)
+
+            installer.install()
+
+            # The key directory once for all the renames.
+            self.assertEqual(4, fsync.call_count)
+
+        installer.cleanup()
+
+    def test_without_dir_fd(self):
+        # Python 2 has no dir_fd arguments, so paths are used instead.
+        self.write(os.path.join(self.key_dir, 'example.private'), 'old key')
+        installer = self.make_installer(['example'])
+
+        with mock.patch.object(key_install, 'DIR_FD', False):
+            installer.stage()
+            installer.install()
+            installer.cleanup()
+
+        path = os.path.join(self.key_dir, 'example.private')
+        self.assertEqual('example key', self.read(path))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(path).st_mode))
+        self.assertFalse(os.path.exists(self.staging_dir()))
+
+    def test_cross_device(self):
+        installer = self.make_installer(['example'])
+
+        def cross_device_link(*args, **kwargs):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        with mock.patch('os.link', cross_device_link):
+            installer.stage()
+
+        installer.install()
+        installer.cleanup()
+
+        self.assertEqual(0, installer.linked)
+        self.assertEqual(1, installer.copied)
+        self.assertEqual('example key',
+                         self.read(os.path.join(self.key_dir, 'example.private')))
+
+    def test_other_device_is_copied(self):
+        installer = self.make_installer(['example'])
+
+        # Directories on another device are copied to without trying to link.
+        installer.open_directory(self.key_dir)
+        dir_fd, staging_fd, device = installer.directories[self.key_dir]
+        installer.directories[self.key_dir] = (dir_fd, staging_fd, device + 1)
+
+        with mock.patch('os.link') as link:
+            installer.stage()
+
+        self.assertFalse(link.called)
+        installer.install()
+        installer.cleanup()
+
+        self.assertEqual(1, installer.copied)
+        self.assertEqual('example key',
+                         self.read(os.path.join(self.key_dir, 'example.private')))
+
+    def test_stale_staging_is_cleared(self):
+        os.mkdir(self.staging_dir())
+        self.write(os.path.join(self.staging_dir(), 'example.private'), 'stale key')
+
+        installer = self.make_installer(['example'])
+        installer.stage()
+        installer.install()
+        installer.cleanup()
+
+        self.assertEqual('example key',
+                         self.read(os.path.join(self.key_dir, 'example.private')))
+        self.assertFalse(os.path.exists(self.staging_dir()))
+
+    def test_cleanup_without_install(self):
+        installer = self.make_installer(['example'])
+
+        installer.stage()
+        installer.cleanup()
+
+        self.assertEqual([], os.listdir(self.key_dir))
+        self.assertEqual({}, dict(installer.directories))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
+import io
 import os
 import shutil
 import tempfile
 import unittest
 
-from odkim_rotate.key_table import KeyTable
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from odkim_rotate.key_table import KeyTable, KeyTableError
 
 class KeyTableTests(unittest.TestCase):
     def setUp(self):
@@ -12,6 +18,13 @@ class KeyTableTests(unittest.TestCase):
     def tearDown(self):
         os.unlink(self.key_table_file)
 
+        # Saving keeps the file as it was read next to it.
+        backup = os.path.join(os.path.dirname(self.key_table_file),
+                              '.' + os.path.basename(self.key_table_file) + '.orig')
+
+        if os.path.exists(backup):
+            os.unlink(backup)
+
     def write_key_file_contents(self, keyfile):
         with open(self.key_table_file, 'w') as f:
             for short_name in keyfile:
@@ -89,44 +102,49 @@ class KeyTableTests(unittest.TestCase):
         finally:
             shutil.rmtree(key_dir)
 
-    def test_short_name_padding(self):
+    def test_unchanged_lines_verbatim(self):
         key_dir = tempfile.mkdtemp()
 
         try:
-            keyfile = {
-                'unitedmonkey': {
-                    KeyTable.DOMAIN: 'foo.test',
-                    KeyTable.SELECTOR: '20170101',
-                    KeyTable.PRIVATE_KEY: key_dir + '/foo.test'
-                },
-                'bar': {
-                    KeyTable.DOMAIN: 'bar.test',
-                    KeyTable.SELECTOR: '20170201',
-                    KeyTable.PRIVATE_KEY: key_dir + '/bar.test'
-                },
-                'apple': {
-                    KeyTable.DOMAIN: 'apple.test',
-                    KeyTable.SELECTOR: '20170201',
-                    KeyTable.PRIVATE_KEY: key_dir + '/apple.test'
-                }}
+            lines = [
+                'apple\tapple.test:20170201:{}/apple.test\n'.format(key_dir),
+                'bar            bar.test:20170201:{}/bar.test  \n'.format(key_dir),
+                'unitedmonkey  foo.test:20170101:{}/foo.test\n'.format(key_dir)
+            ]
+
+            with open(self.key_table_file, 'w') as f:
+                f.write(''.join(lines))
 
-            self.write_key_file_contents(keyfile)
             keytable = KeyTable(self.key_table_file)
 
             self.assertEqual(3, len(keytable))
 
             keytable.save_changes()
 
-            selector_format = '{:' + \
-                              str(len('unitedmonkey') + KeyTable.SELECTOR_PADDING) + \
-                              '}{}'
+            with open(self.key_table_file) as f:
+                self.assertEqual(''.join(lines), f.read())
+        finally:
+            shutil.rmtree(key_dir)
+
+    def test_changed_line_keeps_spacing(self):
+        key_dir = tempfile.mkdtemp()
+
+        try:
+            with open(self.key_table_file, 'w') as f:
+                f.write('apple         apple.test:20170201:{}/apple.test\n'.format(key_dir))
+                f.write('unitedmonkey  foo.test:20170101:{}/foo.test\n'.format(key_dir))
+
+            keytable = KeyTable(self.key_table_file)
+            keytable.update_selector('apple', '20170301')
+            keytable.save_changes()
 
             with open(self.key_table_file) as f:
                 lines = f.read().splitlines()
 
-            for selector, i in [('apple', 0), ('bar', 1), ('unitedmonkey', 2)]:
-                beginningtext = selector_format.format(selector, keyfile[selector][KeyTable.DOMAIN])
-                self.assertTrue(lines[i].startswith(beginningtext))
+            self.assertEqual('apple         apple.test:20170301:{}/apple.test'.format(key_dir),
+                             lines[0])
+            self.assertEqual('unitedmonkey  foo.test:20170101:{}/foo.test'.format(key_dir),
+                             lines[1])
         finally:
             shutil.rmtree(key_dir)
 
@@ -152,3 +170,229 @@ class KeyTableTests(unittest.TestCase):
         finally:
             shutil.rmtree(key_dir)
 
+    def test_nested_iteration(self):
+        keyfile = {}
+
+        for name in ['apple', 'bar', 'foo']:
+            keyfile[name] = {
+                KeyTable.DOMAIN: name + '.test',
+                KeyTable.SELECTOR: '20170101',
+                KeyTable.PRIVATE_KEY: '/keys/' + name
+            }
+
+        self.write_key_file_contents(keyfile)
+        keytable = KeyTable(self.key_table_file)
+
+        pairs = [(outer, inner) for outer, v in keytable for inner, w in keytable]
+
+        self.assertEqual(9, len(pairs))
+        self.assertEqual(('apple', 'foo'), pairs[2])
+        self.assertEqual(('foo', 'foo'), pairs[8])
+
+        # Iteration can be started again after finishing.
+        self.assertEqual(['apple', 'bar', 'foo'], [short_name for short_name, v in keytable])
+
+    def test_index_by_own_short_names(self):
+        with io.open(self.key_table_file, 'w', encoding='utf-8') as f:
+            f.write(u'apple  apple.test:20170101:/keys/apple\n'
+                    u'b\u00fccher  b\u00fccher.test:20170101:/keys/b\u00fccher\n')
+
+        keytable = KeyTable(self.key_table_file)
+
+        for short_name, values in keytable:
+            self.assertEqual(values, keytable[short_name])
+
+        self.assertEqual(u'b\u00fccher.test', keytable[u'b\u00fccher'][KeyTable.DOMAIN])
+
+    def test_index(self):
+        keyfile = {
+            'apple': {
+                KeyTable.DOMAIN: 'apple.test',
+                KeyTable.SELECTOR: '20170101',
+                KeyTable.PRIVATE_KEY: '/keys/apple'
+            }}
+
+        self.write_key_file_contents(keyfile)
+        keytable = KeyTable(self.key_table_file)
+
+        self.assertEqual('apple.test', keytable[-1][KeyTable.DOMAIN])
+        self.assertEqual('apple.test', keytable[0].domain)
+
+        with self.assertRaises(IndexError):
+            keytable[1]
+
+        with self.assertRaises(KeyError):
+            keytable['banana']
+
+        with self.assertRaises(KeyError):
+            keytable[0]['dkim']
+
+class KeyTableFormatTests(unittest.TestCase):
+    CONTENTS = (
+        '# Generated KeyTable\n'
+        '\n'
+        'zebra     zebra.test:20170101:/keys/zebra.private   # oldest\n'
+        '*@apple.test\tapple.test:20170101:/keys/apple.private\n'
+        '  # indented comment\n'
+        'mango     mango.test:20170101:/keys/mango:colon.private'
+    )
+
+    def setUp(self):
+        self.key_table_file = tempfile.mkstemp()[1]
+
+    def tearDown(self):
+        os.unlink(self.key_table_file)
+
+        # Saving keeps the file as it was read next to it.
+        backup = os.path.join(os.path.dirname(self.key_table_file),
+                              '.' + os.path.basename(self.key_table_file) + '.orig')
+
+        if os.path.exists(backup):
+            os.unlink(backup)
+
+    def write(self, contents):
+        with open(self.key_table_file, 'w') as f:
+            f.write(contents)
+
+    def read(self):
+        with open(self.key_table_file) as f:
+            return f.read()
+
+    def test_comments_and_order_preserved(self):
+        self.write(self.CONTENTS)
+        keytable = KeyTable(self.key_table_file)
+
+        self.assertEqual(['*@apple.test', 'mango', 'zebra'],
+                         [short_name for short_name, values in keytable])
+        self.assertEqual('/keys/mango:colon.private', keytable['mango'][KeyTable.PRIVATE_KEY])
+
+        keytable.save_changes()
+        self.assertEqual(self.CONTENTS, self.read())
+
+        keytable.update_selector('zebra', '20170301')
+        keytable.update_selector('mango', '20170301')
+        keytable.save_changes()
+
+        self.assertEqual(self.CONTENTS.replace('zebra.test:20170101', 'zebra.test:20170301')
+                                      .replace('mango.test:20170101', 'mango.test:20170301'),
+                         self.read())
+
+    def test_refile_prefix(self):
+        self.write(self.CONTENTS)
+        keytable = KeyTable('refile:' + self.key_table_file)
+
+        self.assertEqual(3, len(keytable))
+        self.assertEqual(self.key_table_file, keytable.file_path)
+
+    def test_malformed_lines(self):
+        self.write('# comment\n'
+                   'apple apple.test:20170101:/keys/apple\n'
+                   'banana\n'
+                   'cherry cherry.test:20170101\n'
+                   'apple apple.test:20170101:/keys/apple\n')
+
+        with self.assertRaises(KeyTableError) as cm:
+            KeyTable(self.key_table_file)
+
+        self.assertEqual([3, 4, 5], [line_number for line_number, message in cm.exception.errors])
+
+    def test_memory_mapped(self):
+        self.write(self.CONTENTS)
+
+        with mock.patch.object(KeyTable, 'MMAP_THRESHOLD', 0):
+            keytable = KeyTable(self.key_table_file)
+
+        self.assertEqual(3, len(keytable))
+        keytable.save_changes()
+        self.assertEqual(self.CONTENTS, self.read())
+
+class KeyTableSaveTests(unittest.TestCase):
+    CONTENTS = ('apple   apple.test:20170101:/keys/apple.private\n'
+                'banana  banana.test:20170101:/keys/banana.private\n')
+
+    def setUp(self):
+        self.key_dir = tempfile.mkdtemp()
+        self.key_table_file = os.path.join(self.key_dir, 'key.table')
+
+        with open(self.key_table_file, 'w') as f:
+            f.write(self.CONTENTS)
+
+        os.chmod(self.key_table_file, 0o640)
+
+        self.keytable = KeyTable(self.key_table_file)
+        self.keytable.update_selector('banana', '20170201')
+
+    def tearDown(self):
+        shutil.rmtree(self.key_dir)
+
+    def read(self):
+        with open(self.key_table_file) as f:
+            return f.read()
+
+    def assertUnchanged(self):
+        self.assertEqual(self.CONTENTS, self.read())
+        self.assertEqual(['key.table'], [name for name in os.listdir(self.key_dir)
+                                         if not name.endswith('.orig')])
+
+    def test_save(self):
+        self.keytable.save_changes()
+
+        self.assertEqual(self.CONTENTS.replace('banana.test:20170101', 'banana.test:20170201'),
+                         self.read())
+        self.assertEqual(0o640, os.stat(self.key_table_file).st_mode & 0o777)
+
+    def test_fsync_failure(self):
+        with mock.patch('odkim_rotate.atomic_file.os.fsync') as fsync:
+            fsync.side_effect = OSError('disk full')
+
+            with self.assertRaises(OSError):
+                self.keytable.save_changes()
+
+        self.assertUnchanged()
+
+    def test_rename_failure(self):
+        with mock.patch('odkim_rotate.atomic_file.os.rename') as rename:
+            rename.side_effect = OSError('read-only file system')
+
+            with self.assertRaises(OSError):
+                self.keytable.save_changes()
+
+        self.assertUnchanged()
+
+    def test_revert_is_rename(self):
+        inode = os.stat(self.key_table_file).st_ino
+
+        self.keytable.save_changes()
+        self.assertNotEqual(inode, os.stat(self.key_table_file).st_ino)
+
+        with mock.patch('odkim_rotate.key_table.write_atomically') as write_atomically:
+            self.keytable.revert_changes()
+
+        self.assertEqual(0, write_atomically.call_count)
+        self.assertEqual(inode, os.stat(self.key_table_file).st_ino)
+        self.assertEqual(['key.table'], os.listdir(self.key_dir))
+        self.assertUnchanged()
+
+    def test_revert_without_backup(self):
+        with mock.patch('os.link') as link:
+            link.side_effect = OSError('hard links not supported')
+            self.keytable.save_changes()
+
+        self.keytable.revert_changes()
+
+        self.assertUnchanged()
+
+    def test_stale_backup_replaced(self):
+        with open(self.keytable.backup_path, 'w') as f:
+            f.write('stale\n')
+
+        self.keytable.save_changes()
+        self.keytable.revert_changes()
+
+        self.assertUnchanged()
+
+    def test_discard_backup(self):
+        self.keytable.save_changes()
+        self.keytable.discard_backup()
+
+        self.assertEqual(['key.table'], os.listdir(self.key_dir))
@@ -0,0 +1,327 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import requests
+
+from odkim_rotate.dns.domain_cache import DomainCache
+from odkim_rotate.dns.linode_provider import LinodeApiError, LinodeDnsProvider
+from odkim_rotate.dns.provider import TxtRecord
+
+def linode_response(data=None, errors=None):
+    response = mock.Mock()
+    response.status_code = 200
+    response.request.body = 'api_action=test'
+    response.content = b'{}'
+    response.json.return_value = {
+        'ERRORARRAY': errors or [],
+        'DATA': data if data is not None else {}
+    }
+    return response
+
+def http_error(status_code):
+    response = linode_response()
+    response.status_code = status_code
+    response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
+
+DOMAIN_LIST_DATA = [{'DOMAIN': 'example.com', 'DOMAINID': 1},
+                    {'DOMAIN': 'example.org', 'DOMAINID': 2}]
+
+DOMAIN_LIST = linode_response(DOMAIN_LIST_DATA)
+
+RATE_LIMITED = linode_response(errors=[{'ERRORCODE': 14,
+                                        'ERRORMESSAGE': 'API rate limit exceeded'}])
+
+class LinodeDnsProviderTests(unittest.TestCase):
+    def setUp(self):
+        os.environ['LINODE_API_KEY'] = 'foo'
+        self.provider = LinodeDnsProvider()
+        self.provider.retry_delay = 0
+
+        patcher = mock.patch.object(self.provider.session, 'post')
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retry_rate_limited(self):
+        self.post.side_effect = [DOMAIN_LIST, RATE_LIMITED, RATE_LIMITED, linode_response()]
+
+        self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual(4, self.post.call_count)
+        self.assertEqual(4, self.provider.stats.requests)
+
+    def test_retry_gateway_errors(self):
+        self.provider.retry_delay = 0
+        self.post.side_effect = [DOMAIN_LIST, http_error(429), linode_response(),
+                                 http_error(502), linode_response()]
+
+        # Rate limiting is retried for any action, gateway errors only for
+        # actions that can safely be repeated.
+        self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+        self.assertEqual([], self.provider.list_txt_records('example.com'))
+        self.assertEqual(5, self.post.call_count)
+
+    def test_create_not_repeated(self):
+        self.provider.retry_delay = 0
+        self.post.side_effect = [DOMAIN_LIST, http_error(504), linode_response()]
+
+        # Linode may have created the record before the gateway timed out.
+        with self.assertRaises(requests.HTTPError):
+            self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual(2, self.post.call_count)
+
+    def test_retry_limit(self):
+        self.provider.max_retries = 2
+        self.post.side_effect = [DOMAIN_LIST] + [RATE_LIMITED] * 3
+
+        with self.assertRaises(LinodeApiError):
+            self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual(4, self.post.call_count)
+
+    def test_no_retry_other_errors(self):
+        self.post.side_effect = [DOMAIN_LIST,
+                                 linode_response(errors=[{'ERRORCODE': 8,
+                                                          'ERRORMESSAGE': 'Validation error'}])]
+
+        with self.assertRaises(LinodeApiError) as cm:
+            self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual([8], cm.exception.codes)
+        self.assertEqual(2, self.post.call_count)
+
+    def test_create_txt_records(self):
+        self.post.side_effect = lambda url, data, timeout: \
+            DOMAIN_LIST if data['api_action'] == 'domain.list' else linode_response()
+
+        records = [TxtRecord('example.com', '20170101', 'v=DKIM1'),
+                   TxtRecord('missing.test', '20170101', 'v=DKIM1'),
+                   TxtRecord('example.org', '20170101', 'v=DKIM1')]
+
+        results = self.provider.create_txt_records(records, 3)
+
+        self.assertEqual(records, [result.record for result in results])
+        self.assertEqual([True, False, True], [result.succeeded for result in results])
+        self.assertIsInstance(results[1].error, KeyError)
+
+        # One domain.list and one domain.resource.create per hosted domain.
+        self.assertEqual(3, self.post.call_count)
+
+    def test_list_txt_records(self):
+        self.post.side_effect = [DOMAIN_LIST, linode_response([
+            {'RESOURCEID': 10, 'TYPE': 'txt', 'NAME': '20170101._domainkey',
+             'TARGET': 'v=DKIM1; p=old'},
+            {'RESOURCEID': 11, 'TYPE': 'txt', 'NAME': '', 'TARGET': 'v=spf1 -all'},
+            {'RESOURCEID': 12, 'TYPE': 'a', 'NAME': 'mail', 'TARGET': '192.0.2.1'}
+        ])]
+
+        records = self.provider.list_txt_records('example.org')
+
+        self.assertEqual([('example.org', '20170101', 'v=DKIM1; p=old', 10)],
+                         [(record.domain, record.selector, record.value, record.record_id)
+                          for record in records])
+        self.assertEqual(2, self.post.call_args[1]['data']['DomainID'])
+
+    def test_subdomain(self):
+        self.post.side_effect = [DOMAIN_LIST, linode_response(), linode_response([
+            {'RESOURCEID': 10, 'TYPE': 'TXT', 'NAME': '20170101._domainkey',
+             'TARGET': 'v=DKIM1; p=apex'},
+            {'RESOURCEID': 11, 'TYPE': 'TXT', 'NAME': '20170101._domainkey.mail',
+             'TARGET': 'v=DKIM1; p=mail'},
+            {'RESOURCEID': 12, 'TYPE': 'TXT', 'NAME': '20170101._domainkey.eu.mail',
+             'TARGET': 'v=DKIM1; p=eu'}
+        ])]
+
+        # Subdomains are published in their parent domain's zone.
+        self.provider.create_txt_record('mail.example.com', '20170101', 'v=DKIM1')
+        data = self.post.call_args[1]['data']
+        self.assertEqual((1, '20170101._domainkey.mail'), (data['DomainID'], data['Name']))
+
+        records = self.provider.list_txt_records('mail.example.com')
+        self.assertEqual([('mail.example.com', '20170101', 11)],
+                         [(record.domain, record.selector, record.record_id)
+                          for record in records])
+
+    def test_hosted_zones(self):
+        self.post.side_effect = [linode_response([{'DOMAIN': 'Example.COM', 'DOMAINID': 1}])]
+
+        self.assertEqual(set(['example.com']), self.provider.hosted_zones())
+        self.assertEqual(set(['example.com']), self.provider.hosted_zones(True))
+        self.assertEqual(1, self.post.call_count)
+
+    def test_delete_txt_record(self):
+        self.post.side_effect = [DOMAIN_LIST, linode_response(), NOT_FOUND]
+        record = TxtRecord('example.com', '20170101', 'v=DKIM1', 10)
+
+        self.provider.delete_txt_record(record)
+        data = self.post.call_args[1]['data']
+        self.assertEqual(('domain.resource.delete', 1, 10),
+                         (data['api_action'], data['DomainID'], data['ResourceID']))
+
+        # Deleting a record that's already gone isn't an error.
+        self.provider.delete_txt_record(record)
+
+NOT_FOUND = linode_response(errors=[{'ERRORCODE': 5,
+                                     'ERRORMESSAGE': 'Object not found'}])
+
+class DomainCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = DomainCache(os.path.join(self.cache_dir, 'cache', 'domains.json'))
+
+        os.environ['LINODE_API_KEY'] = 'foo'
+        self.provider = LinodeDnsProvider(domain_cache=self.cache)
+
+        patcher = mock.patch.object(self.provider.session, 'post')
+        self.post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def domain_ids(self):
+        return [call[1]['data'].get('DomainID') for call in self.post.call_args_list]
+
+    def test_saved_and_loaded(self):
+        self.post.side_effect = [DOMAIN_LIST, linode_response()]
+        self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual({'example.com': 1, 'example.org': 2}, self.cache.load())
+
+        provider = LinodeDnsProvider(domain_cache=self.cache)
+
+        with mock.patch.object(provider.session, 'post') as post:
+            post.return_value = linode_response()
+            provider.create_txt_record('example.org', '20170101', 'v=DKIM1')
+
+            self.assertEqual(1, post.call_count)
+            self.assertEqual(2, post.call_args[1]['data']['DomainID'])
+
+    def test_expired(self):
+        self.cache.save({'example.com': 1})
+        self.cache.ttl = -1
+
+        self.assertIsNone(self.cache.load())
+
+    def test_missing_domain_refreshes(self):
+        self.cache.save({'example.com': 1})
+        self.post.side_effect = [DOMAIN_LIST, linode_response()]
+
+        self.provider.create_txt_record('example.org', '20170101', 'v=DKIM1')
+
+        self.assertEqual([None, 2], self.domain_ids())
+
+    def test_stale_domain_id_refreshes(self):
+        self.cache.save({'example.com': 42})
+        self.post.side_effect = [NOT_FOUND, DOMAIN_LIST, linode_response()]
+
+        self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual([42, None, 1], self.domain_ids())
+        self.assertEqual(1, self.cache.load()['example.com'])
+
+    def test_stale_domain_id_invalidates_cache(self):
+        self.cache.save({'example.com': 42})
+        self.post.side_effect = [NOT_FOUND, RuntimeError('Connection refused')]
+
+        with self.assertRaises(RuntimeError):
+            self.provider.list_txt_records('example.com')
+
+        self.assertIsNone(self.cache.load())
+
+    def test_stale_domain_id_refreshes_delete(self):
+        self.cache.save({'example.com': 42})
+        self.post.side_effect = [NOT_FOUND, DOMAIN_LIST, linode_response()]
+
+        self.provider.delete_txt_record(TxtRecord('example.com', '20170101', 'v=DKIM1', 10))
+
+        self.assertEqual([42, None, 1], self.domain_ids())
+
+    def test_not_found_after_refresh(self):
+        self.post.side_effect = [DOMAIN_LIST, NOT_FOUND]
+
+        with self.assertRaises(LinodeApiError):
+            self.provider.create_txt_record('example.com', '20170101', 'v=DKIM1')
+
+        self.assertEqual(2, self.post.call_count)
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class FakeLinodeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.client_ports.add(self.client_address[1])
+
+        body = json.dumps({'ERRORARRAY': [], 'DATA': DOMAIN_LIST_DATA}).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ConnectionPoolingTests(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeLinodeHandler)
+        self.server.client_ports = set()
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        os.environ['LINODE_API_KEY'] = 'foo'
+        self.provider = LinodeDnsProvider(pool_size=2)
+        self.provider.api_url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.provider.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_reused(self):
+        for selector in ['20170101', '20170201', '20170301']:
+            self.provider.create_txt_record('example.com', selector, 'v=DKIM1')
+
+        stats = self.provider.stats
+
+        # domain.list plus three domain.resource.create over one connection.
+        self.assertEqual(1, len(self.server.client_ports))
+        self.assertEqual(4, stats.requests)
+        self.assertEqual(1, stats.connections_opened)
+        self.assertEqual(3, stats.connections_reused)
+        self.assertEqual(4, sum(stats.latency_histogram))
+        self.assertGreater(stats.bytes_sent, 0)
+        self.assertGreater(stats.bytes_received, 0)
+
+    def test_pool_size(self):
+        records = [TxtRecord('example.com', str(i), 'v=DKIM1') for i in range(20)]
+
+        results = self.provider.create_txt_records(records, 2)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertLessEqual(len(self.server.client_ports), 2)
+        self.assertEqual(self.provider.stats.connections_opened,
+                         len(self.server.client_ports))
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from odkim_rotate.dns import registry
+from odkim_rotate.dns.local_provider import LocalDnsProvider
+from odkim_rotate.dns.provider import TxtRecord
+from odkim_rotate.utils import create_dns_provider
+
+class LocalDnsProviderTests(unittest.TestCase):
+    def setUp(self):
+        self.zone_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.zone_dir)
+
+    def test_create_and_list(self):
+        provider = LocalDnsProvider()
+        provider.create_txt_record('example.com', '20170101', 'v=DKIM1; p=abc')
+
+        records = provider.list_txt_records('example.com')
+
+        self.assertEqual([('example.com', '20170101', 'v=DKIM1; p=abc')],
+                         [(r.domain, r.selector, r.value) for r in records])
+        self.assertEqual([], provider.list_txt_records('example.org'))
+
+    def test_unknown_domain(self):
+        provider = LocalDnsProvider(domains=['example.com'])
+
+        results = provider.create_txt_records([TxtRecord('example.com', 's1', 'v=DKIM1'),
+                                               TxtRecord('missing.test', 's1', 'v=DKIM1')])
+
+        self.assertEqual([True, False], [result.succeeded for result in results])
+        self.assertIsInstance(results[1].error, KeyError)
+
+    def test_zone_files(self):
+        value = 'v=DKIM1; k=rsa; n="quoted\\\\"; p=' + 'A' * 400
+        provider = LocalDnsProvider(zone_dir=self.zone_dir)
+        provider.create_txt_records([TxtRecord('example.com', '20170101', value),
+                                     TxtRecord('example.com', '20170201', 'v=DKIM1; p=b')])
+
+        with open(os.path.join(self.zone_dir, 'example.com.zone')) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual('$ORIGIN example.com.', lines[0])
+        self.assertTrue(lines[1].startswith('20170101._domainkey 300 IN TXT ( "v=DKIM1'))
+
+        reloaded = LocalDnsProvider(zone_dir=self.zone_dir)
+
+        self.assertEqual([('20170101', value), ('20170201', 'v=DKIM1; p=b')],
+                         [(r.selector, r.value) for r in
+                          reloaded.list_txt_records('example.com')])
+
+    def test_delete(self):
+        provider = LocalDnsProvider(zone_dir=self.zone_dir)
+        provider.create_txt_records([TxtRecord('example.com', selector, 'v=DKIM1')
+                                     for selector in ['s1', 's2', 's3']])
+
+        records = provider.list_txt_records('example.com')
+        batches = []
+        results = provider.delete_txt_records(records[:2], batch_size=1,
+                                              progress=batches.append)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(2, len(batches))
+        self.assertEqual(['s3'], [r.selector for r in
+                                  LocalDnsProvider(zone_dir=self.zone_dir)
+                                  .list_txt_records('example.com')])
+
+class RegistryTests(unittest.TestCase):
+    def tearDown(self):
+        registry.dns_providers.pop('test', None)
+
+    def test_builtin(self):
+        self.assertIn('linode', registry.dns_provider_names())
+        self.assertIsInstance(create_dns_provider('local', 4), LocalDnsProvider)
+
+    def test_register(self):
+        registry.register_dns_provider(
+            'test', lambda concurrency, domain_cache, **options: (concurrency, options))
+
+        self.assertEqual((3, {'zone_dir': '/tmp'}),
+                         create_dns_provider('test', 3, zone_dir='/tmp'))
+
+    def test_lazy_entry_point(self):
+        class EntryPoint:
+            name = 'test'
+
+            def load(self):
+                return lambda concurrency, domain_cache, **options: 'loaded'
+
+        registry.dns_providers['test'] = EntryPoint()
+
+        self.assertEqual('loaded', create_dns_provider('test'))
+        self.assertEqual('loaded', create_dns_provider('test'))
@@ -0,0 +1,593 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+from collections import OrderedDict
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from odkim_rotate.cleanup import SelectorCleaner
+from odkim_rotate.dns.local_provider import LocalDnsProvider
+from odkim_rotate.dns.provider import DnsProvider, TxtRecord
+from odkim_rotate.estimate import RotationEstimate
+from odkim_rotate.fleet.installer import FleetInstaller, FleetNode
+from odkim_rotate.fleet.local_transport import LocalDirectoryTransport
+from odkim_rotate.journal import Journal
+from odkim_rotate.key_table import KeyTable
+from odkim_rotate.keygen.opendkim_generator import OpenDkimKeyGenerator
+from odkim_rotate.keygen.pool import KeyPool, PooledKeyGenerator
+from odkim_rotate.manager import Manager
+from odkim_rotate.preflight import Preflight
+from odkim_rotate.verify.opendkim_verifier import OpenDkimKeyVerifier
+
+FAKE_GENKEY = """#!{python}
+import os
+import sys
+
+args = dict(arg[2:].split('=', 1) for arg in sys.argv[1:] if '=' in arg)
+
+if args['domain'].startswith('fail'):
+    sys.exit(1)
+
+path = os.path.join(args['directory'], args['selector'])
+
+with open(path + '.private', 'w') as f:
+    f.write('private key for ' + args['domain'])
+
+with open(path + '.txt', 'w') as f:
+    f.write('{{}}._domainkey IN TXT ( "v=DKIM1; k=rsa; "\\n\\t  "p={{}}" )'.format(
+        args['selector'], args['domain']))
+"""
+
+FAKE_TESTKEY = """#!{python}
+import sys
+
+domain = sys.argv[sys.argv.index('-d') + 1]
+
+if domain.startswith('bad'):
+    print('key not secure for ' + domain)
+    sys.exit(1)
+"""
+
+class FakeDnsProvider(DnsProvider):
+    zones = None
+
+    def __init__(self):
+        self.records = []
+
+    def hosted_zones(self, refresh=False):
+        return self.zones
+
+    def create_txt_record(self, domain, selector, value):
+        if domain.startswith('unpublishable'):
+            raise KeyError('Domain {} not found'.format(domain))
+
+        self.records.append((domain, selector, value))
+
+    def list_txt_records(self, domain):
+        return [TxtRecord(d, selector, value) for d, selector, value in self.records
+                if d == domain]
+
+    def delete_txt_record(self, record):
+        self.records = [r for r in self.records if r[:2] != (record.domain, record.selector)]
+
+class ManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.key_table_file = os.path.join(self.work_dir, 'key.table')
+
+        genkey = self.write_script('opendkim-genkey', FAKE_GENKEY)
+        testkey = self.write_script('opendkim-testkey', FAKE_TESTKEY)
+
+        # Keep the progress output of Manager out of the test results.
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+        self.manager = Manager(False, 4)
+        self.manager.key_generator = OpenDkimKeyGenerator(genkey=genkey)
+        self.manager.key_verifier = OpenDkimKeyVerifier(testkey=testkey)
+        self.manager.dns_provider = FakeDnsProvider()
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+        shutil.rmtree(self.manager.scratch_dir, ignore_errors=True)
+        shutil.rmtree(self.work_dir)
+
+    def write_script(self, name, script):
+        path = os.path.join(self.work_dir, name)
+
+        with open(path, 'w') as f:
+            f.write(script.format(python=sys.executable))
+
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+    def new_manager(self):
+        manager = Manager(False, 4)
+        manager.key_generator = self.manager.key_generator
+        manager.key_verifier = self.manager.key_verifier
+        manager.dns_provider = FakeDnsProvider()
+        manager.keytable = self.manager.keytable
+        return manager
+
+    def load_key_table(self, domains):
+        with open(self.key_table_file, 'w') as f:
+            for short_name, domain in domains:
+                f.write('{}  {}:20170101:{}/{}.private\n'.format(
+                    short_name, domain, self.work_dir, short_name))
+
+        self.manager.keytable = KeyTable(self.key_table_file)
+
+class GenerateKeysTests(ManagerTestCase):
+    def test_generate_keys(self):
+        domains = [('name{}'.format(i), 'domain{}.test'.format(i)) for i in range(20)]
+        self.load_key_table(domains)
+
+        self.manager.generate_keys()
+
+        self.assertEqual(sorted(os.listdir(self.manager.scratch_dir)),
+                         sorted(n + '.private' for n, d in domains))
+
+        for short_name, domain in domains:
+            with open(os.path.join(self.manager.scratch_dir, short_name + '.private')) as f:
+                self.assertEqual('private key for ' + domain, f.read())
+
+            mode = os.stat(os.path.join(self.manager.scratch_dir, short_name + '.private')).st_mode
+            self.assertEqual(0o600, stat.S_IMODE(mode))
+
+            self.assertEqual(self.manager.selector,
+                             self.manager.keytable[short_name][KeyTable.SELECTOR])
+
+        self.assertEqual(len(domains), len(self.manager.dns_provider.records))
+        self.assertIn(('domain3.test', self.manager.selector, 'v=DKIM1; k=rsa; p=domain3.test'),
+                      self.manager.dns_provider.records)
+
+        metrics = self.manager.metrics
+        self.assertEqual(['generate', 'publish'], list(metrics.phases))
+        self.assertEqual(20, metrics.phases['generate']['items'])
+        self.assertEqual(20, len(metrics.domains))
+        self.assertEqual(set(['generate', 'publish']), set(metrics.domains['domain3.test']))
+        self.assertEqual(20, metrics.counts()['subprocesses'])
+
+    def test_generation_failure_keeps_selector(self):
+        self.load_key_table([('good', 'good.test'), ('bad', 'fail.test')])
+
+        with self.assertRaises(RuntimeError):
+            self.manager.generate_keys()
+
+        # Domains whose keys were generated aren't held back.
+        self.assertEqual([('good.test', self.manager.selector, 'v=DKIM1; k=rsa; p=good.test')],
+                         self.manager.dns_provider.records)
+        self.assertEqual(self.manager.selector, self.manager.keytable['good'][KeyTable.SELECTOR])
+        self.assertEqual('20170101', self.manager.keytable['bad'][KeyTable.SELECTOR])
+
+    def test_publish_failure_keeps_selector(self):
+        self.load_key_table([('good', 'good.test'), ('bad', 'unpublishable.test')])
+
+        with self.assertRaises(RuntimeError):
+            self.manager.generate_keys()
+
+        self.assertEqual([('good.test', self.manager.selector, 'v=DKIM1; k=rsa; p=good.test')],
+                         self.manager.dns_provider.records)
+        self.assertEqual(self.manager.selector, self.manager.keytable['good'][KeyTable.SELECTOR])
+        self.assertEqual('20170101', self.manager.keytable['bad'][KeyTable.SELECTOR])
+
+class SharedDomainTests(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+
+        self.load_key_table([('apple', 'apple.test'), ('www-apple', 'apple.test'),
+                             ('banana', 'banana.test'), ('shop-apple', 'apple.test')])
+
+    def test_generate_keys(self):
+        self.manager.generate_keys()
+
+        self.assertEqual(['apple.test', 'banana.test'],
+                         sorted(record[0] for record in self.manager.dns_provider.records))
+        self.assertEqual(2, self.manager.metrics.counts()['subprocesses'])
+
+        keys = {}
+
+        for short_name in ['apple', 'www-apple', 'shop-apple', 'banana']:
+            with open(os.path.join(self.manager.scratch_dir, short_name + '.private')) as f:
+                keys[short_name] = f.read()
+
+            self.assertEqual(self.manager.selector,
+                             self.manager.keytable[short_name][KeyTable.SELECTOR])
+
+        self.assertEqual('private key for apple.test', keys['www-apple'])
+        self.assertEqual('private key for apple.test', keys['shop-apple'])
+        self.assertEqual('private key for banana.test', keys['banana'])
+
+    def test_phases(self):
+        self.manager.journal = Journal(os.path.join(self.work_dir, 'state'))
+        self.manager.resume_rotation()
+        self.manager.propagation_checker = FakePropagationChecker()
+
+        self.manager.generate_keys(False)
+        self.manager.publish_keys()
+        self.assertTrue(self.manager.wait_for_propagation())
+
+        self.assertEqual(2, len(self.manager.dns_provider.records))
+        self.assertEqual(['apple.test', 'banana.test'],
+                         sorted(self.manager.propagation_checker.seen))
+        self.assertTrue(self.manager.journal.done('shop-apple', Journal.PROPAGATED))
+
+class PreflightTests(ManagerTestCase):
+    def test_skipped(self):
+        self.load_key_table([('apple', 'apple.test'), ('www-apple', 'www.apple.test'),
+                             ('banana', 'banana.test'), ('alias', 'banana.test')])
+        self.manager.dns_provider = LocalDnsProvider(domains=['apple.test'])
+        self.manager.preflight = Preflight(self.manager.dns_provider)
+
+        self.manager.generate_keys()
+
+        # No keys are generated for domains that can't be published.
+        self.assertEqual(['alias', 'banana'], self.manager.dropped)
+        self.assertEqual(2, self.manager.metrics.counts()['subprocesses'])
+        self.assertEqual(['apple.test', 'www.apple.test'],
+                         sorted(record.domain for record in
+                                self.manager.dns_provider.list_txt_records('apple.test') +
+                                self.manager.dns_provider.list_txt_records('www.apple.test')))
+        self.assertEqual('20170101', self.manager.keytable['alias'][KeyTable.SELECTOR])
+
+class TestKeysTests(ManagerTestCase):
+    def test_all_pass(self):
+        self.load_key_table([('name{}'.format(i), 'domain{}.test'.format(i)) for i in range(10)])
+
+        self.assertTrue(self.manager.test_keys())
+
+    def test_failures_collected(self):
+        self.load_key_table([('bad1', 'bad1.test'), ('good', 'good.test'), ('bad2', 'bad2.test')])
+
+        tested = []
+        test_key = self.manager.test_key
+
+        def record_test_key(entry):
+            tested.append(entry[0])
+            return test_key(entry)
+
+        self.manager.test_key = record_test_key
+
+        self.assertFalse(self.manager.test_keys())
+        self.assertEqual(['bad1', 'bad2', 'good'], sorted(tested))
+
+class ResumeTests(ManagerTestCase):
+    def test_resume_after_publish_failure(self):
+        self.load_key_table([('good', 'good.test'), ('bad', 'unpublishable.test')])
+        state_dir = os.path.join(self.work_dir, 'state')
+
+        self.manager.journal = Journal(state_dir)
+        self.manager.resume_rotation()
+        selector = self.manager.selector
+
+        with self.assertRaises(RuntimeError):
+            self.manager.generate_keys()
+
+        # The domain gets fixed at the DNS provider and the rotation rerun.
+        manager = self.new_manager()
+        manager.journal = Journal(state_dir)
+        manager.resume_rotation()
+
+        generated = []
+        generate = manager.key_generator.generate
+
+        def record_generate(domain, selector):
+            generated.append(domain)
+            return generate(domain, selector)
+
+        manager.key_generator.generate = record_generate
+        manager.dns_provider.create_txt_record = \
+            lambda domain, selector, value: manager.dns_provider.records.append(domain)
+
+        manager.generate_keys()
+
+        self.assertEqual(selector, manager.selector)
+        self.assertEqual([], generated)
+        self.assertEqual(['unpublishable.test'], manager.dns_provider.records)
+        self.assertEqual(['good', 'bad'], list(manager.published_records))
+        self.assertEqual(selector, manager.keytable['good'][KeyTable.SELECTOR])
+        self.assertEqual(selector, manager.keytable['bad'][KeyTable.SELECTOR])
+
+        self.assertTrue(manager.test_keys())
+        self.assertTrue(manager.journal.done('bad', Journal.VERIFIED))
+
+        manager.finish_rotation()
+        self.assertFalse(os.path.exists(state_dir + '/journal'))
+
+class InstallWithReloadTests(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+
+        self.manager.install_mode = Manager.RELOAD
+        self.manager.opendkim_keys_basedir = self.work_dir
+        self.manager.key_owner_uid = os.getuid()
+        self.manager.key_group_gid = os.getgid()
+
+        self.load_key_table([('apple', 'apple.test'), ('banana', 'banana.test')])
+        self.manager.generate_keys()
+
+        os.chdir(self.manager.scratch_dir)
+
+    def tearDown(self):
+        os.chdir(self.manager.starting_dir)
+        ManagerTestCase.tearDown(self)
+
+    def test_install(self):
+        with mock.patch('odkim_rotate.utils.reload_opendkim') as reload_opendkim, \
+                mock.patch('odkim_rotate.utils.toggle_services') as toggle_services:
+            self.assertTrue(self.manager.install_keys())
+
+        self.assertEqual(1, reload_opendkim.call_count)
+        self.assertEqual(0, toggle_services.call_count)
+
+        key_dir = os.path.join(self.work_dir, self.manager.selector)
+
+        with open(self.key_table_file) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual('apple  apple.test:{}:{}/apple.private'.format(
+            self.manager.selector, key_dir), lines[0])
+
+        with open(os.path.join(key_dir, 'banana.private')) as f:
+            self.assertEqual('private key for banana.test', f.read())
+
+    def test_reload_failure_reverts(self):
+        with open(self.key_table_file) as f:
+            original = f.read()
+
+        with mock.patch('odkim_rotate.utils.reload_opendkim') as reload_opendkim:
+            reload_opendkim.side_effect = [RuntimeError('reload failed'), None]
+            self.assertFalse(self.manager.install_keys())
+
+        self.assertEqual(2, reload_opendkim.call_count)
+
+        with open(self.key_table_file) as f:
+            self.assertEqual(original, f.read())
+
+class InstallOnFleetTests(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+
+        self.load_key_table([('apple', 'apple.test'), ('banana', 'banana.test')])
+
+        with open(self.key_table_file) as f:
+            self.original = f.read()
+
+        self.node_dir = os.path.join(self.work_dir, 'node')
+        os.makedirs(os.path.join(self.node_dir, 'keys'))
+        shutil.copy(self.key_table_file, os.path.join(self.node_dir, 'key.table'))
+
+        node = FleetNode('node', LocalDirectoryTransport(self.node_dir), '/key.table',
+                         '/keys', [sys.executable, '-c', ''])
+        self.manager.fleet = FleetInstaller([node])
+        self.manager.generate_keys()
+
+        os.chdir(self.manager.scratch_dir)
+
+    def tearDown(self):
+        os.chdir(self.manager.starting_dir)
+        ManagerTestCase.tearDown(self)
+
+    def test_install(self):
+        with mock.patch('odkim_rotate.utils.reload_opendkim') as reload_opendkim, \
+                mock.patch('odkim_rotate.utils.toggle_services') as toggle_services:
+            self.assertTrue(self.manager.install_keys())
+
+        self.assertEqual(0, reload_opendkim.call_count)
+        self.assertEqual(0, toggle_services.call_count)
+
+        with open(os.path.join(self.node_dir, 'key.table')) as f:
+            self.assertIn(':{}:/keys/{}/apple.private'.format(self.manager.selector,
+                                                              self.manager.selector),
+                          f.read())
+
+        with open(os.path.join(self.node_dir, 'keys', self.manager.selector,
+                               'banana.private')) as f:
+            self.assertEqual('private key for banana.test', f.read())
+
+        # The local KeyTable is left alone.
+        with open(self.key_table_file) as f:
+            self.assertEqual(self.original, f.read())
+
+class CleanUpSelectorsTests(ManagerTestCase):
+    def test_clean_up(self):
+        self.load_key_table([('apple', 'apple.test'), ('banana', 'banana.test')])
+        self.manager.dns_provider.records = [('apple.test', '20160101000000', 'v=DKIM1; p=older'),
+                                             ('apple.test', '20170101000000', 'v=DKIM1; p=old'),
+                                             ('cherry.test', '20160101000000', 'v=DKIM1; p=other')]
+        self.manager.selector_cleaner = SelectorCleaner(self.manager.dns_provider, 7)
+
+        self.manager.clean_up_selectors()
+
+        # Only records of the rotated domains retired over a week ago go.
+        self.assertEqual([('apple.test', '20170101000000'), ('cherry.test', '20160101000000')],
+                         [record[:2] for record in self.manager.dns_provider.records])
+
+class FakePropagationChecker:
+    resolvers = ['fake']
+
+    def __init__(self):
+        self.seen = []
+
+    def wait(self, records, progress=None, propagated=None):
+        return self.wait_stream(iter(records), progress, propagated)
+
+    def wait_stream(self, records, progress=None, propagated=None, stop=None):
+        stragglers = []
+
+        for record in records:
+            self.seen.append(record.domain)
+
+            if record.domain.startswith('slow'):
+                stragglers.append(record)
+            elif propagated is not None:
+                propagated(record, 0.0)
+
+        return stragglers
+
+class StreamKeysTests(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+
+        self.manager.journal = Journal(os.path.join(self.work_dir, 'state'))
+        self.manager.propagation_checker = FakePropagationChecker()
+
+    def test_stream(self):
+        domains = [('name{}'.format(i), 'domain{}.test'.format(i)) for i in range(20)]
+        self.load_key_table(domains)
+        self.manager.resume_rotation()
+
+        self.assertTrue(self.manager.stream_keys(True))
+
+        self.assertEqual(20, len(self.manager.dns_provider.records))
+        self.assertEqual(sorted(d for n, d in domains),
+                         sorted(self.manager.propagation_checker.seen))
+
+        for short_name, domain in domains:
+            self.assertTrue(self.manager.journal.done(short_name, Journal.PROPAGATED))
+            self.assertEqual(self.manager.selector,
+                             self.manager.keytable[short_name][KeyTable.SELECTOR])
+
+        self.assertEqual(['generate', 'publish', 'propagate'],
+                         list(self.manager.metrics.phases))
+        self.assertEqual(set(['generate', 'publish', 'propagate']),
+                         set(self.manager.metrics.domains['domain3.test']))
+
+    def test_stragglers(self):
+        self.load_key_table([('fast', 'fast.test'), ('slow', 'slow.test')])
+        self.manager.resume_rotation()
+
+        self.assertFalse(self.manager.stream_keys(True))
+
+        self.assertTrue(self.manager.journal.done('fast', Journal.PROPAGATED))
+        self.assertTrue(self.manager.journal.done('slow', Journal.PUBLISHED))
+        self.assertFalse(self.manager.journal.done('slow', Journal.PROPAGATED))
+
+    def test_rotate(self):
+        self.load_key_table([('apple', 'apple.test'), ('banana', 'banana.test')])
+        self.manager.install_mode = Manager.RELOAD
+        self.manager.opendkim_keys_basedir = self.work_dir
+        self.manager.key_owner_uid = os.getuid()
+        self.manager.key_group_gid = os.getgid()
+
+        with mock.patch('odkim_rotate.utils.reload_opendkim'):
+            with mock.patch.object(self.manager, 'wait_for_propagation') as wait:
+                self.assertTrue(self.manager.rotate_keys())
+
+        # Records were checked as they were published instead.
+        self.assertFalse(wait.called)
+        self.assertEqual(['apple.test', 'banana.test'],
+                         sorted(self.manager.propagation_checker.seen))
+
+class PhaseAtATimeTests(ManagerTestCase):
+    def setUp(self):
+        ManagerTestCase.setUp(self)
+
+        self.load_key_table([('apple', 'apple.test'), ('banana', 'banana.test')])
+        self.state_dir = os.path.join(self.work_dir, 'state')
+
+    def run_phase(self, phase, zones=None):
+        # Every phase runs in a new process, with the KeyTable as saved.
+        manager = self.new_manager()
+        manager.dns_provider.zones = zones
+        manager.preflight = Preflight(manager.dns_provider)
+        manager.keytable = KeyTable(self.key_table_file)
+        manager.journal = Journal(self.state_dir)
+        manager.propagation_checker = FakePropagationChecker()
+        manager.install_mode = Manager.RELOAD
+        manager.opendkim_keys_basedir = self.work_dir
+        manager.key_owner_uid = os.getuid()
+        manager.key_group_gid = os.getgid()
+        self.manager = manager
+
+        with mock.patch('odkim_rotate.utils.reload_opendkim'):
+            return manager.rotate_keys([phase])
+
+    def test_phases(self):
+        self.assertTrue(self.run_phase(Manager.GENERATE))
+        self.assertEqual([], self.manager.dns_provider.records)
+        selector = self.manager.selector
+
+        self.assertTrue(self.run_phase(Manager.PUBLISH))
+        self.assertEqual(['apple.test', 'banana.test'],
+                         [record[0] for record in self.manager.dns_provider.records])
+
+        self.assertTrue(self.run_phase(Manager.WAIT))
+        self.assertTrue(self.run_phase(Manager.VERIFY))
+        self.assertTrue(self.run_phase(Manager.INSTALL))
+
+        keytable = KeyTable(self.key_table_file)
+        self.assertEqual(selector, keytable['apple'][KeyTable.SELECTOR])
+        self.assertFalse(os.path.exists(os.path.join(self.state_dir, 'journal')))
+
+    def test_preflight_failure(self):
+        zones = set(['apple.test'])
+
+        # The run reports the entry it left out as a failure.
+        self.assertFalse(self.run_phase(Manager.GENERATE, zones))
+        selector = self.manager.selector
+
+        # The rest of the rotation goes on without the entry that failed.
+        self.assertTrue(self.run_phase(Manager.PUBLISH, zones))
+        self.assertEqual(['apple.test'],
+                         [record[0] for record in self.manager.dns_provider.records])
+
+        for phase in [Manager.WAIT, Manager.VERIFY, Manager.INSTALL]:
+            self.assertTrue(self.run_phase(phase, zones))
+
+        keytable = KeyTable(self.key_table_file)
+        self.assertEqual(selector, keytable['apple'][KeyTable.SELECTOR])
+        self.assertEqual('20170101', keytable['banana'][KeyTable.SELECTOR])
+        self.assertFalse(os.path.exists(os.path.join(self.state_dir, 'journal')))
+
+    def test_out_of_order(self):
+        self.assertFalse(self.run_phase(Manager.PUBLISH))
+        self.assertFalse(os.path.exists(os.path.join(self.state_dir, 'journal')))
+
+        self.assertTrue(self.run_phase(Manager.GENERATE))
+        self.assertFalse(self.run_phase(Manager.VERIFY))
+
+        # The rotation is still there to continue.
+        self.assertTrue(self.run_phase(Manager.PUBLISH))
+
+class DryRunTests(ManagerTestCase):
+    def test_dry_run(self):
+        self.load_key_table([('name{}'.format(i), 'domain{}.test'.format(i)) for i in range(10)])
+        self.manager.jobs = 2
+        self.manager.dns_jobs = 5
+        self.manager.fleet = None
+
+        history = {'domains': {'old.test': {'generate': 1.0, 'publish': 2.0}},
+                   'phases': {'propagate': {'seconds': 60.0, 'items': 1}}}
+        estimate = RotationEstimate(self.manager, 10, history)
+        phases = estimate.phases()
+
+        self.assertEqual(5.0, phases['generate'])
+        self.assertEqual(4.0, phases['publish'])
+        self.assertEqual(60.0, phases['propagate'])
+        self.assertEqual(sum(phases.values()) - 4.0, estimate.total_seconds())
+        self.assertEqual(OrderedDict([('subprocesses', 24), ('api_requests', 10)]),
+                         estimate.operations())
+
+        self.manager.dry_run(history)
+
+        self.assertFalse(os.path.exists(self.manager.scratch_dir))
+        self.assertEqual([], self.manager.dns_provider.records)
+        self.assertEqual('20170101', KeyTable(self.key_table_file)['name0'][KeyTable.SELECTOR])
+
+        # Keys in the pool needn't be generated.
+        pool = KeyPool(os.path.join(self.work_dir, 'pool'))
+        pool.fill(self.manager.key_generator, 4)
+        self.manager.key_generator = PooledKeyGenerator(pool, self.manager.key_generator)
+        estimate = RotationEstimate(self.manager, 10, history)
+        self.assertEqual(3.0, estimate.phases()['generate'])
+        self.assertEqual(20, estimate.operations()['subprocesses'])
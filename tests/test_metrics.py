@@ -0,0 +1,67 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from odkim_rotate.metrics import Counters, RunMetrics, counters
+
+class RunMetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+        counters.increment(Counters.API_REQUESTS, 5)
+        self.metrics = RunMetrics()
+        self.metrics.selector = '20170101'
+
+        with self.metrics.phase('generate', 2):
+            self.metrics.record_domain('a.test', 'generate', 0.5)
+            self.metrics.record_domain('b.test', 'generate', 1.5)
+
+        self.metrics.record_phase('publish', 0.25, 2)
+        self.metrics.record_domain('a.test', 'publish', 0.25)
+        counters.increment(Counters.API_REQUESTS, 2)
+        counters.increment(Counters.SUBPROCESSES)
+        self.metrics.finish(True)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_counts_since_start(self):
+        counts = self.metrics.counts()
+
+        self.assertEqual(2, counts[Counters.API_REQUESTS])
+        self.assertEqual(1, counts[Counters.SUBPROCESSES])
+
+    def test_report(self):
+        report = self.metrics.report()
+
+        self.assertEqual(['generate', 'publish'], list(report['phases']))
+        self.assertEqual(2, report['phases']['generate']['items'])
+        self.assertEqual([('b.test', 1.5), ('a.test', 0.5)],
+                         report['slowest_domains']['generate'])
+        self.assertEqual({'generate': 0.5, 'publish': 0.25}, report['domains']['a.test'])
+        self.assertTrue(report['succeeded'])
+
+    def test_write_json(self):
+        path = os.path.join(self.work_dir, 'report.json')
+        self.metrics.write_json(path)
+
+        with open(path) as f:
+            report = json.load(f)
+
+        self.assertEqual('20170101', report['selector'])
+        self.assertEqual(0.25, report['phases']['publish']['seconds'])
+
+    def test_write_prometheus(self):
+        path = os.path.join(self.work_dir, 'odkim_rotate.prom')
+        self.metrics.write_prometheus(path)
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn('# TYPE odkim_rotate_phase_duration_seconds gauge', lines)
+        self.assertIn('odkim_rotate_phase_duration_seconds{phase="publish"} 0.25', lines)
+        self.assertIn('odkim_rotate_phase_domain_max_seconds{phase="generate"} 1.5', lines)
+        self.assertIn('odkim_rotate_last_run_success 1.0', lines)
+        self.assertIn('odkim_rotate_last_run_operations{operation="api_requests"} 2.0', lines)
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from odkim_rotate.opendkim_config import *
+
+class OpenDkimConfigTests(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.conf = self.write('opendkim.conf',
+                               '# Main configuration\n'
+                               'Syslog              yes\n'
+                               'KeyTableFoo         /nowhere\n'
+                               'keytable            refile:/etc/dkimkeys/key.table  # keys\n'
+                               'SigningTable        refile:/etc/dkimkeys/signing.table\n'
+                               'UserID              opendkim:mail\n'
+                               'Include             local.conf\n')
+        self.write('local.conf', 'Socket  local:/run/opendkim/opendkim.sock\n'
+                                 'Syslog  no\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.work_dir, name)
+
+        with open(path, 'w') as f:
+            f.write(contents)
+
+        return path
+
+    def test_parameters(self):
+        config = OpenDkimConfig(self.conf)
+
+        self.assertEqual('refile:/etc/dkimkeys/key.table', config.keytable)
+        self.assertEqual('refile:/etc/dkimkeys/signing.table', config['SIGNINGTABLE'])
+        self.assertEqual('/nowhere', config.get('KeyTableFoo'))
+        self.assertIsNone(config.get('Selector'))
+
+    def test_include(self):
+        config = OpenDkimConfig(self.conf)
+
+        self.assertEqual('local:/run/opendkim/opendkim.sock', config.socket)
+        self.assertFalse(config.get_boolean('Syslog'))
+
+    def test_include_loop(self):
+        self.write('local.conf', 'Include opendkim.conf\n')
+        self.assertRaises(OpenDkimConfigError, OpenDkimConfig, self.conf)
+
+    def test_user_id(self):
+        self.assertEqual(('opendkim', 'mail'), OpenDkimConfig(self.conf).user_id)
+
+        self.write('opendkim.conf', 'UserID opendkim\n')
+        self.assertEqual(('opendkim', None), OpenDkimConfig(self.conf).user_id)
+
+    def test_key_directory(self):
+        self.assertEqual('/etc/dkimkeys', OpenDkimConfig(self.conf).key_directory())
+
+        self.write('opendkim.conf', 'KeyTable dsn:sqlite3://localhost/var/db/dkim.db\n')
+        self.assertEqual('/default', OpenDkimConfig(self.conf).key_directory('/default'))
+
+        self.write('opendkim.conf', 'KeyFile /etc/mail/dkim.key\n')
+        self.assertEqual('/etc/mail', OpenDkimConfig(self.conf).key_directory())
+
+    def test_require(self):
+        self.write('opendkim.conf', 'Syslog yes\n')
+        self.assertRaises(OpenDkimConfigError, OpenDkimConfig(self.conf).require, 'KeyTable')
+
+    def test_missing_file(self):
+        self.assertRaises(OpenDkimConfigError, OpenDkimConfig,
+                          os.path.join(self.work_dir, 'missing.conf'))
+
+    def test_load_is_cached(self):
+        config = load_opendkim_config(self.conf)
+        self.assertIs(config, load_opendkim_config(self.conf))
+
+        # Changing an included file invalidates the cached config.
+        local = os.path.join(self.work_dir, 'local.conf')
+        os.utime(local, (0, 0))
+
+        reloaded = load_opendkim_config(self.conf)
+        self.assertIsNot(config, reloaded)
+        self.assertIs(reloaded, load_opendkim_config(self.conf))
@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+from odkim_rotate.pipeline import Pipeline
+
+class PipelineTests(unittest.TestCase):
+    def test_run(self):
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add_stage('double', lambda n: n * 2, 3)
+        pipeline.add_stage('format', str, 2)
+
+        results = pipeline.run(range(50))
+
+        self.assertEqual([(n, str(n * 2), None, 'format') for n in range(50)], results)
+        self.assertEqual([('double', 50), ('format', 50)],
+                         [(name, items) for name, seconds, items in pipeline.stage_seconds()])
+
+    def test_failures(self):
+        def check(n):
+            if n % 3 == 0:
+                raise ValueError(n)
+
+            return n
+
+        pipeline = Pipeline()
+        pipeline.add_stage('check', check, 2)
+        pipeline.add_stage('negate', lambda n: -n)
+
+        finished = []
+        results = pipeline.run(range(6), lambda *result: finished.append(result))
+
+        self.assertEqual(['check', 'negate', 'negate', 'check', 'negate', 'negate'],
+                         [stage for item, result, error, stage in results])
+        self.assertEqual([None, -1, -2, None, -4, -5],
+                         [result for item, result, error, stage in results])
+        self.assertIsInstance(results[3][2], ValueError)
+        self.assertEqual(sorted(results, key=repr), sorted(finished, key=repr))
+
+    def test_stages_overlap(self):
+        # The second stage starts before the first has done every item.
+        first_done = threading.Event()
+        overlapped = []
+
+        def first(n):
+            if n == 9:
+                time.sleep(0.2)
+                first_done.set()
+
+            return n
+
+        def second(n):
+            overlapped.append(not first_done.is_set())
+            return n
+
+        pipeline = Pipeline(queue_size=1)
+        pipeline.add_stage('first', first)
+        pipeline.add_stage('second', second)
+        pipeline.run(range(10))
+
+        self.assertEqual(9, overlapped.count(True))
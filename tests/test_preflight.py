@@ -0,0 +1,88 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from odkim_rotate.dns.local_provider import LocalDnsProvider
+from odkim_rotate.dns.provider import DnsProvider, find_zone, record_name
+from odkim_rotate.key_table import KeyTableEntry
+from odkim_rotate.preflight import Preflight
+
+class ZoneTests(unittest.TestCase):
+    def test_find_zone(self):
+        zones = set(['example.com', 'mail.example.org'])
+
+        self.assertEqual('example.com', find_zone('example.com', zones))
+        self.assertEqual('example.com', find_zone('Mail.Example.COM.', zones))
+        self.assertEqual('mail.example.org', find_zone('eu.mail.example.org', zones))
+        self.assertIsNone(find_zone('example.org', zones))
+        self.assertIsNone(find_zone('notexample.com', zones))
+
+    def test_record_name(self):
+        self.assertEqual('sel._domainkey', record_name('example.com', 'sel', 'example.com'))
+        self.assertEqual('sel._domainkey.eu.mail',
+                         record_name('eu.mail.example.com', 'sel', 'example.com'))
+
+class CachingDnsProvider(DnsProvider):
+    def __init__(self, cached, current):
+        self.cached = cached
+        self.current = current
+        self.refreshed = False
+
+    def hosted_zones(self, refresh=False):
+        self.refreshed = self.refreshed or refresh
+        return set(self.current if refresh else self.cached)
+
+class PreflightTests(unittest.TestCase):
+    def setUp(self):
+        self.key_dir = tempfile.mkdtemp()
+        self.entries = [
+            ('apple', KeyTableEntry('apple.test', '20170101',
+                                    os.path.join(self.key_dir, 'apple.private'))),
+            ('mail', KeyTableEntry('mail.apple.test', '20170101',
+                                   os.path.join(self.key_dir, 'mail.private'))),
+            ('banana', KeyTableEntry('banana.test', '20170101',
+                                     os.path.join(self.key_dir, 'banana.private')))
+        ]
+
+    def tearDown(self):
+        os.chmod(self.key_dir, stat.S_IRWXU)
+        shutil.rmtree(self.key_dir)
+
+    def test_zones(self):
+        preflight = Preflight(LocalDnsProvider(domains=['apple.test']))
+
+        self.assertEqual({'banana': 'the DNS provider hosts no zone for banana.test'},
+                         dict(preflight.check(self.entries)))
+
+    def test_zones_refreshed(self):
+        provider = CachingDnsProvider(['apple.test'], ['apple.test', 'banana.test'])
+
+        self.assertEqual({}, dict(Preflight(provider).check(self.entries)))
+        self.assertTrue(provider.refreshed)
+
+    def test_unknown_zones(self):
+        # Providers that can't list their zones are left to fail later.
+        self.assertEqual({}, dict(Preflight(LocalDnsProvider()).check(self.entries)))
+
+    @unittest.skipIf(os.getuid() == 0, 'root can write to any directory')
+    def test_key_directory(self):
+        os.chmod(self.key_dir, stat.S_IRUSR | stat.S_IXUSR)
+        preflight = Preflight(LocalDnsProvider())
+
+        problems = preflight.check(self.entries, lambda values: os.path.dirname(
+            values.private_key))
+
+        self.assertEqual(['apple', 'mail', 'banana'], list(problems))
+
+    def test_missing_key_directory(self):
+        preflight = Preflight(LocalDnsProvider(domains=['apple.test']))
+        missing = os.path.join(self.key_dir, 'missing')
+
+        problems = preflight.check(self.entries, lambda values: missing
+                                   if values.domain == 'apple.test' else self.key_dir)
+
+        self.assertEqual({'apple': 'key directory {} is not writable'.format(missing),
+                          'banana': 'the DNS provider hosts no zone for banana.test'},
+                         dict(problems))
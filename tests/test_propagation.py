@@ -0,0 +1,117 @@
+import threading
+import unittest
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from odkim_rotate.dns.provider import TxtRecord
+from odkim_rotate.dns.resolver import DnsQueryError, parse_nameserver, query_txt
+from odkim_rotate.propagation import PropagationChecker
+from tests.stub_dns_server import StubDnsServer
+
+class QueryTxtTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubDnsServer()
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_multiple_strings(self):
+        self.server.records['sel._domainkey.example.com'] = [['v=DKIM1; k=rsa; ', 'p=abc']]
+
+        self.assertEqual(['v=DKIM1; k=rsa; p=abc'],
+                         query_txt('sel._domainkey.example.com', self.server.address))
+
+    def test_nxdomain(self):
+        self.assertEqual([], query_txt('missing.example.com', self.server.address))
+
+    def test_timeout(self):
+        self.server.close()
+
+        with self.assertRaises(DnsQueryError):
+            query_txt('example.com', self.server.address, timeout=0.1)
+
+    def test_parse_nameserver(self):
+        self.assertEqual(('192.0.2.1', 53), parse_nameserver('192.0.2.1'))
+        self.assertEqual(('192.0.2.1', 5353), parse_nameserver('192.0.2.1:5353'))
+        self.assertEqual(('2001:db8::1', 53), parse_nameserver('2001:db8::1'))
+        self.assertEqual(('2001:db8::1', 5353), parse_nameserver('[2001:db8::1]:5353'))
+
+class PropagationCheckerTests(unittest.TestCase):
+    def setUp(self):
+        self.servers = [StubDnsServer(), StubDnsServer()]
+        self.checker = PropagationChecker([s.address for s in self.servers],
+                                          deadline=2, initial_delay=0.05,
+                                          max_delay=0.2, query_timeout=0.5)
+        self.records = [TxtRecord('example.com', 'sel', 'v=DKIM1; p=one'),
+                        TxtRecord('example.org', 'sel', 'v=DKIM1; p=two')]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def publish(self, server, record):
+        name = '{}._domainkey.{}'.format(record.selector, record.domain)
+        server.records[name] = [record.value]
+
+    def test_propagated(self):
+        for server in self.servers:
+            for record in self.records:
+                self.publish(server, record)
+
+        self.assertEqual([], self.checker.wait(self.records))
+
+    def test_propagates_while_waiting(self):
+        for record in self.records:
+            self.publish(self.servers[0], record)
+
+        def progress(pending):
+            # Only publish to the second server once the first round of
+            # checks has found the records missing there.
+            for record in self.records:
+                self.publish(self.servers[1], record)
+
+        self.assertEqual([], self.checker.wait(self.records, progress))
+
+    def test_stragglers(self):
+        for server in self.servers:
+            self.publish(server, self.records[0])
+            server.records['sel._domainkey.example.org'] = ['v=DKIM1; p=old']
+
+        self.checker.deadline = 0.2
+
+        self.assertEqual([self.records[1]], self.checker.wait(self.records))
+
+    def test_stream(self):
+        arriving = queue.Queue()
+        arriving.put(self.records[0])
+        propagated = []
+
+        def record_propagated(record, seconds):
+            propagated.append(record)
+
+            # The second record only arrives once the first has propagated.
+            if record is self.records[0]:
+                arriving.put(self.records[1])
+                arriving.put(None)
+
+        for server in self.servers:
+            for record in self.records:
+                self.publish(server, record)
+
+        self.assertEqual([], self.checker.wait_stream(iter(arriving.get, None),
+                                                      propagated=record_propagated))
+        self.assertEqual(self.records, propagated)
+
+    def test_stream_stopped(self):
+        arriving = queue.Queue()
+        arriving.put(self.records[0])
+        stop = threading.Event()
+
+        def progress(pending):
+            stop.set()
+
+        self.assertEqual([self.records[0]],
+                         self.checker.wait_stream(iter(arriving.get, None), progress, stop=stop))
@@ -0,0 +1,59 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from odkim_rotate.key_table import KeyTable
+from odkim_rotate.selection import EntrySelector
+
+class EntrySelectorTests(unittest.TestCase):
+    def setUp(self):
+        self.key_table_file = tempfile.mkstemp()[1]
+
+        with open(self.key_table_file, 'w') as f:
+            f.write('apple    apple.test:20170101:/keys/apple.private\n')
+            f.write('banana   banana.test:20170601123456:/keys/banana.private\n')
+            f.write('cherry   mail.cherry.test:20160101:/keys/cherry.private\n')
+            f.write('date     date.example:20170301:/keys/date.private\n')
+
+        self.keytable = KeyTable(self.key_table_file)
+        self.now = datetime.datetime(2017, 7, 1)
+
+    def tearDown(self):
+        os.unlink(self.key_table_file)
+        self.keytable.discard_backup()
+
+    def select(self, **kwargs):
+        selector = EntrySelector(**kwargs)
+        return [short_name for short_name, values in selector.select(self.keytable, self.now)]
+
+    def test_all(self):
+        self.assertEqual(['apple', 'banana', 'cherry', 'date'], self.select())
+
+    def test_include_exclude(self):
+        self.assertEqual(['apple', 'banana', 'cherry'], self.select(include=['*.test']))
+        self.assertEqual(['cherry', 'date'], self.select(include=['cherry', 'date.*']))
+        self.assertEqual(['apple', 'date'], self.select(exclude=['b*', '*.cherry.test']))
+
+    def test_older_than(self):
+        self.assertEqual(['apple', 'cherry', 'date'], self.select(older_than_days=90))
+        self.assertEqual(['apple', 'cherry'], self.select(older_than_days=150))
+
+    def test_limit_oldest_first(self):
+        self.assertEqual(['apple', 'cherry'], self.select(limit=2))
+        self.assertEqual(['cherry'], self.select(include=['*.test'], limit=1))
+
+    def test_unselected_untouched(self):
+        with open(self.key_table_file) as f:
+            original = f.read().splitlines()
+
+        for short_name, values in EntrySelector(limit=1).select(self.keytable, self.now):
+            self.keytable.update_selector(short_name, '20170701')
+
+        self.keytable.save_changes()
+
+        with open(self.key_table_file) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual('cherry   mail.cherry.test:20170701:/keys/cherry.private', lines[2])
+        self.assertEqual(original[:2] + original[3:], lines[:2] + lines[3:])
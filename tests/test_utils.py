@@ -36,3 +36,29 @@ class CreateDnsProviderTests(unittest.TestCase):
         with self.assertRaises(NameError):
             provider = create_dns_provider('42')
 
+
+class MapConcurrentlyTests(unittest.TestCase):
+    def test_results_in_order(self):
+        results = map_concurrently(lambda x: x * 2, [3, 1, 2], 2)
+        self.assertEqual([(3, 6, None), (1, 2, None), (2, 4, None)], results)
+
+    def test_errors_captured(self):
+        def func(x):
+            if x == 1:
+                raise ValueError('bad')
+            return x
+
+        results = map_concurrently(func, [0, 1, 2], 3)
+
+        self.assertEqual((0, 0, None), results[0])
+        self.assertIsInstance(results[1][2], ValueError)
+        self.assertEqual((2, 2, None), results[2])
+
+class CreateKeyGeneratorTests(unittest.TestCase):
+    def test_opendkim(self):
+        generator = create_key_generator('opendkim', 'rsa', 2048)
+        self.assertIsInstance(generator, OpenDkimKeyGenerator)
+
+    def test_unknown(self):
+        with self.assertRaises(NameError):
+            generator = create_key_generator('42', 'rsa', 2048)
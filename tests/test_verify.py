@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from odkim_rotate.keygen.generator import KeyGenerator
+from odkim_rotate.verify.verifier import KeyVerificationError
+from tests.stub_dns_server import StubDnsServer
+
+try:
+    from odkim_rotate.keygen.python_generator import PythonKeyGenerator
+    from odkim_rotate.verify.dns_verifier import DnsKeyVerifier
+
+    PythonKeyGenerator()
+except RuntimeError:
+    PythonKeyGenerator = None
+
+@unittest.skipIf(PythonKeyGenerator is None, 'cryptography is not installed')
+class DnsKeyVerifierTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubDnsServer()
+        self.verifier = DnsKeyVerifier([self.server.address], 0.5)
+        self.key_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.key_dir)
+
+    def generate_key(self, key_type, name):
+        key = PythonKeyGenerator(key_type, 1024).generate('example.com', 'sel')
+        path = os.path.join(self.key_dir, name)
+
+        with open(path, 'wb') as f:
+            f.write(key.private_key)
+
+        return key, path
+
+    def test_rsa_matches(self):
+        key, path = self.generate_key(KeyGenerator.RSA, 'example.private')
+
+        # Published records are often split into several strings.
+        self.server.records['sel._domainkey.example.com'] = [
+            'v=spf1 -all', [key.txt_value[:50], key.txt_value[50:]]]
+
+        self.verifier.verify('example.com', 'sel', path)
+
+    def test_ed25519_matches(self):
+        key, path = self.generate_key(KeyGenerator.ED25519, 'example.private')
+        self.server.records['sel._domainkey.example.com'] = [key.txt_value]
+
+        self.verifier.verify('example.com', 'sel', path)
+
+    def test_mismatch(self):
+        key, path = self.generate_key(KeyGenerator.RSA, 'example.private')
+        other, other_path = self.generate_key(KeyGenerator.RSA, 'other.private')
+        self.server.records['sel._domainkey.example.com'] = [other.txt_value]
+
+        with self.assertRaises(KeyVerificationError):
+            self.verifier.verify('example.com', 'sel', path)
+
+    def test_missing_record(self):
+        key, path = self.generate_key(KeyGenerator.RSA, 'example.private')
+
+        with self.assertRaises(KeyVerificationError):
+            self.verifier.verify('example.com', 'sel', path)